@@ -0,0 +1,132 @@
+"""Recompute the denormalized counters from the data they summarize.
+
+The like routes move like_count with $inc, which starts from 0 on documents
+written before the field existed, and posts keep comment_count and
+last_activity_at for the feed and the hot ranking. Run once after deploying,
+and again any time the counters are suspected to have drifted:
+
+    python -m app.backfillCounters
+
+Likes and reviews are fixed by server-side updates, and migrated posts take
+one aggregation over their comments. Embedded comment trees nest to any
+depth, which no fixed aggregation expression can follow, so unmigrated posts
+are recounted one at a time here, each written back only if its comments
+haven't changed meanwhile (as migrateComments.py does). Afterwards every post
+has a comment_count, which the comment routes keep up to date.
+Requires MongoDB 4.2+ for pipeline updates. At the end, cached posts and
+courses are dropped and the hot ranking is rebuilt from the new counts.
+"""
+from pymongo import UpdateOne
+from app.main import app, init_db, init_redis, close_redis
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+from app.hotPosts import rebuild_hot_ranking
+from app.cache import forget_all_entities, invalidate_tags
+import asyncio
+
+
+def size_of(path: str) -> dict:
+    return {"$size": {"$ifNull": [path, []]}}
+
+def recount_tree(comments: list):
+    """An embedded comment list with like_count set at every level, how many
+    comments it holds in all, and the newest one's created_at."""
+    recounted, count, latest = [], 0, None
+    for comment in comments or []:
+        replies, reply_count, reply_latest = recount_tree(comment.get("replies"))
+        recounted.append({**comment, "like_count": len(comment.get("likes") or []), "replies": replies})
+        count += 1 + reply_count
+        latest = max(filter(None, [latest, comment.get("created_at"), reply_latest]), default=None)
+    return recounted, count, latest
+
+def reviews_with_like_counts() -> dict:
+    return {"$map": {
+        "input": {"$ifNull": ["$reviews", []]},
+        "as": "review",
+        "in": {"$mergeObjects": ["$$review", {"like_count": size_of("$$review.likes")}]},
+    }}
+
+
+async def backfill_counters():
+    await init_db()
+    posts = await PostModel.get_motor_collection().update_many({}, [{"$set": {
+        "like_count": size_of("$likes"),
+    }}])
+    print(f"Recounted likes on {posts.modified_count} posts")
+
+    embedded = await count_embedded_comments()
+    print(f"Recounted comments and their likes on {embedded} unmigrated posts")
+    migrated = await count_stored_comments()
+    print(f"Recounted comments on {migrated} migrated posts")
+
+    courses = await CourseModel.get_motor_collection().update_many({}, [{"$set": {
+        "reviews": reviews_with_like_counts(),
+    }}])
+    print(f"Recounted review likes on {courses.modified_count} courses")
+
+    await init_redis()
+    try:
+        # Cached copies still hold the old counts, which save_entity() would write back
+        await forget_all_entities(app, PostModel)
+        await forget_all_entities(app, CourseModel)
+        await invalidate_tags(app, "list:posts", "list:courses")
+        await rebuild_hot_ranking(app, force=True)
+    finally:
+        await close_redis()
+
+async def count_embedded_comments() -> int:
+    counted = 0
+    unmigrated = PostModel.get_motor_collection().find({"comments_migrated": {"$ne": True}}, {"_id": 1})
+    async for post in unmigrated:
+        counted += await count_embedded_post(post["_id"])
+    return counted
+
+async def count_embedded_post(post_id) -> int:
+    """Recount one post's embedded tree; 0 if it has been migrated or deleted."""
+    posts = PostModel.get_motor_collection()
+    while True:
+        post = await posts.find_one({"_id": post_id, "comments_migrated": {"$ne": True}}, {"comments": 1})
+        if post is None:
+            return 0
+        comments, count, latest = recount_tree(post.get("comments"))
+        unchanged = {"comments": post["comments"]} if "comments" in post else {"comments": {"$exists": False}}
+        result = await posts.update_one(
+            {"_id": post_id, "comments_migrated": {"$ne": True}, **unchanged},
+            [{"$set": {
+                "comments": {"$literal": comments},
+                "comment_count": count,
+                # $max skips nulls, so a post without comments keeps its creation time
+                "last_activity_at": {"$max": ["$created_at", "$last_activity_at", latest]},
+            }}],
+        )
+        if result.matched_count:
+            return 1
+        print(f"Comments on {post_id} changed while counting, retrying")
+
+async def count_stored_comments() -> int:
+    posts = PostModel.get_motor_collection()
+    counts = PostCommentModel.get_motor_collection().aggregate([
+        {"$group": {"_id": "$post_id", "count": {"$sum": 1}, "latest": {"$max": "$created_at"}}},
+    ])
+    counted, operations = [], []
+    async for group in counts:
+        counted.append(group["_id"])
+        operations.append(UpdateOne(
+            {"_id": group["_id"], "comments_migrated": True},
+            [{"$set": {
+                "comment_count": group["count"],
+                "last_activity_at": {"$max": ["$created_at", "$last_activity_at", group["latest"]]},
+            }}],
+        ))
+    if operations:
+        await posts.bulk_write(operations, ordered=False)
+    # Migrated posts that have no comments left
+    await posts.update_many({"comments_migrated": True, "_id": {"$nin": counted}}, [{"$set": {
+        "comment_count": 0,
+        "last_activity_at": {"$max": ["$created_at", "$last_activity_at"]},
+    }}])
+    return len(counted)
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_counters())
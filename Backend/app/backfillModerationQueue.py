@@ -0,0 +1,71 @@
+"""Open moderation queue items for content flagged before the queue existed.
+
+    python -m app.backfillModerationQueue
+
+This is the last full scan for flagged content. Run it once after deploying;
+from then on the report routes keep the queue up to date. Items that are
+already open are left alone, so running it again changes nothing. Reports
+have no timestamps, so backfilled items are queued at the time of the run.
+"""
+from pymongo import UpdateOne
+from datetime import datetime, timezone
+from app.main import init_db
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+from app.models.professor import ProfessorReviewModel
+from app.models.moderation import ModerationItemModel
+from app.moderationQueue import POST, COMMENT, COURSE_REVIEW, PROFESSOR_REVIEW, OPEN, course_review_key
+from app.commentStore import as_uuid
+import asyncio
+
+
+def queue_item(target_type: str, target_id, parent_id, reports, now: datetime) -> UpdateOne:
+    return UpdateOne(
+        {"target_type": target_type, "target_id": str(target_id), "status": OPEN},
+        {"$setOnInsert": {
+            "parent_id": parent_id and str(parent_id),
+            "flagged_at": now,
+            "last_reported_at": now,
+            "report_count": len(reports or []),
+        }},
+        upsert=True,
+    )
+
+def flagged_in_tree(post_id, comments, now: datetime):
+    for comment in comments or []:
+        if comment.get("flagged"):
+            yield queue_item(COMMENT, as_uuid(comment["id"]), post_id, comment.get("reports"), now)
+        yield from flagged_in_tree(post_id, comment.get("replies"), now)
+
+
+async def backfill_moderation_queue():
+    await init_db()
+    now = datetime.now(timezone.utc)
+    operations = []
+
+    async for post in PostModel.get_motor_collection().find({"flagged": True}, {"reports": 1}):
+        operations.append(queue_item(POST, post["_id"], None, post.get("reports"), now))
+    async for comment in PostCommentModel.get_motor_collection().find({"flagged": True}, {"post_id": 1, "reports": 1}):
+        operations.append(queue_item(COMMENT, as_uuid(comment["_id"]), comment["post_id"], comment.get("reports"), now))
+    unmigrated = PostModel.get_motor_collection().find({"comments_migrated": {"$ne": True}}, {"comments": 1})
+    async for post in unmigrated:
+        operations.extend(flagged_in_tree(post["_id"], post.get("comments"), now))
+    courses = CourseModel.get_motor_collection().find({"reviews.flagged": True}, {"reviews.flagged": 1, "reviews.created_at": 1, "reviews.reports": 1})
+    async for course in courses:
+        for review in course.get("reviews", []):
+            if review.get("flagged"):
+                key = course_review_key(course["_id"], review["created_at"])
+                operations.append(queue_item(COURSE_REVIEW, key, course["_id"], review.get("reports"), now))
+    reviews = ProfessorReviewModel.get_motor_collection().find({"flagged": True}, {"professor_id": 1, "reports": 1})
+    async for review in reviews:
+        operations.append(queue_item(PROFESSOR_REVIEW, review["_id"], as_uuid(review["professor_id"]), review.get("reports"), now))
+
+    if operations:
+        result = await ModerationItemModel.get_motor_collection().bulk_write(operations, ordered=False)
+        print(f"Queued {result.upserted_count} of {len(operations)} flagged items")
+    else:
+        print("Nothing flagged")
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_moderation_queue())
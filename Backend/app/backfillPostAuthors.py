@@ -0,0 +1,52 @@
+"""Set author_id on posts written before it was recorded.
+
+    python -m app.backfillPostAuthors
+
+Profiles list a user's posts by PostModel.author_id, no longer through
+UserModel.posts. Posts that only appear in their author's UserModel.posts
+get the author's id from there. Run once after deploying; posts that
+already have an author_id are never touched, so running it again is
+harmless.
+"""
+from bson import Binary, ObjectId
+from pymongo import UpdateMany
+from app.main import app, init_db, init_redis, close_redis
+from app.models.posts import PostModel
+from app.models.user import UserModel
+from app.commentStore import as_uuid
+from app.cache import forget_all_entities, invalidate_tags
+import asyncio
+
+BATCH_SIZE = 500
+
+
+async def backfill_post_authors():
+    await init_db()
+    posts = PostModel.get_motor_collection()
+    operations, updated, usernames = [], 0, []
+    users = UserModel.get_motor_collection().find({"posts.0": {"$exists": True}}, {"posts": 1, "username": 1})
+    async for user in users:
+        usernames.append(user.get("username"))
+        post_ids = [ObjectId(post_id) for post_id in user["posts"] if ObjectId.is_valid(post_id)]
+        operations.append(UpdateMany(
+            {"_id": {"$in": post_ids}, "author_id": None},
+            {"$set": {"author_id": Binary.from_uuid(as_uuid(user["_id"]))}},
+        ))
+        if len(operations) >= BATCH_SIZE:
+            updated += (await posts.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await posts.bulk_write(operations, ordered=False)).modified_count
+    print(f"Set author_id on {updated} posts")
+
+    await init_redis()
+    try:
+        # Cached copies still have no author_id, which save_entity() would write back
+        await forget_all_entities(app, PostModel)
+        await invalidate_tags(app, "list:posts", *(f"user:{username}" for username in usernames if username))
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_post_authors())
@@ -0,0 +1,326 @@
+"""Dismissing or removing many reported items in one request.
+
+The single-item admin routes load and save a whole document per item. A
+batch is instead grouped by kind of content. Each group reads what it needs
+with one $in query, sends every item's write at once (one single-document
+write per item, so each item knows whether its own write found its target),
+then recomputes what the removals change (course and professor ratings,
+comment counts) once per parent, however many of its items were in the batch.
+
+Comments on posts whose comments haven't been migrated are the exception.
+Each one is still its own targeted update (see embeddedComments.py), since
+its ancestors have to be looked up first.
+
+Every item gets a result: "ok", or "not_found" if its target was gone by
+the time its write ran. Only the items that were applied are resolved in the
+moderation queue and recounted, rerated or rescored.
+"""
+from fastapi import FastAPI
+from bson import Binary, ObjectId
+from pymongo import UpdateOne
+from pymongo.results import DeleteResult
+from collections import defaultdict
+from uuid import UUID
+import asyncio
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+from app.models.professor import ProfessorModel, ProfessorReviewModel
+from app.cache import forget_entities, invalidate_tags
+from app.commentStore import as_uuid, stored_comment_filter, subtree_filter
+from app.embeddedComments import unflag_embedded_comment, pull_embedded_comment
+from app.hotPosts import rescore_posts
+from app.moderationQueue import (
+    POST, COMMENT, COURSE_REVIEW, PROFESSOR_REVIEW, course_review_key, resolve_items, resolve_children,
+)
+
+DISMISS = "dismiss"
+REMOVE = "remove"
+OK = "ok"
+NOT_FOUND = "not_found"
+
+UNFLAG = {"$set": {"flagged": False, "reports": []}}
+
+
+def rounded_average(path: str) -> dict:
+    return {"$ifNull": [{"$round": [{"$avg": path}, 2]}, 0]}
+
+# Pipeline update giving a course the ratings the admin delete route computes
+COURSE_RATINGS = [
+    {"$set": {
+        "ratings.average_rating_E": rounded_average("$reviews.ratingE"),
+        "ratings.average_rating_MD": rounded_average("$reviews.ratingMD"),
+        "ratings.average_rating_AD": rounded_average("$reviews.ratingAD"),
+    }},
+    {"$set": {"rating": {"$floor": {"$divide": [
+        {"$add": ["$ratings.average_rating_E", "$ratings.average_rating_MD", "$ratings.average_rating_AD"]}, 3,
+    ]}}}},
+]
+
+
+def object_id(value):
+    return ObjectId(value) if value and ObjectId.is_valid(value) else None
+
+def comment_uuid(value):
+    try:
+        return UUID(value)
+    except (TypeError, ValueError):
+        return None
+
+async def resolve_by_action(app: FastAPI, target_type: str, targets: dict):
+    """Resolve queue items; targets maps an action to the targets it was applied to."""
+    for action, resolution in ((DISMISS, "dismissed"), (REMOVE, "removed")):
+        if targets[action]:
+            await resolve_items(app, target_type, targets[action], resolution)
+
+
+async def write_each(writes: list) -> list:
+    """Await single-document writes together; whether each one found its target."""
+    return [
+        (result.deleted_count if isinstance(result, DeleteResult) else result.matched_count) > 0
+        for result in await asyncio.gather(*writes)
+    ]
+
+
+async def moderate_posts(app: FastAPI, entries: list, tags: set) -> dict:
+    results, writes, applied = {}, [], []
+    targets = defaultdict(list)
+    posts = PostModel.get_motor_collection()
+    for index, item in entries:
+        results[index] = NOT_FOUND
+        post_id = object_id(item.id)
+        if post_id is None:
+            continue
+        writes.append(posts.update_one({"_id": post_id}, UNFLAG) if item.action == DISMISS else posts.delete_one({"_id": post_id}))
+        applied.append((index, item.action, post_id))
+    for (index, action, post_id), found in zip(applied, await write_each(writes)):
+        if found:
+            targets[action].append(post_id)
+            results[index] = OK
+    if not targets:
+        return results
+
+    removed = targets[REMOVE]
+    if removed:
+        await PostCommentModel.get_motor_collection().delete_many({"post_id": {"$in": removed}})
+        await resolve_children(app, COMMENT, removed, "gone")
+        # Drops the deleted posts from the hot ranking
+        await rescore_posts(app, removed)
+    await resolve_by_action(app, POST, targets)
+    touched = targets[DISMISS] + removed
+    await forget_entities(app, PostModel, touched)
+    tags.update(f"post:{post_id}" for post_id in touched)
+    tags.add("list:posts")
+    return results
+
+
+async def moderate_comments(app: FastAPI, entries: list, tags: set) -> dict:
+    """Comments are addressed by id and the id of their post (parent_id)."""
+    results = {}
+    targets = defaultdict(list)
+    parsed = [(object_id(item.parent_id), comment_uuid(item.id)) for _, item in entries]
+    post_ids = list({post_id for post_id, _ in parsed if post_id})
+    posts = await PostModel.get_motor_collection().find(
+        {"_id": {"$in": post_ids}}, {"comments_migrated": 1}
+    ).to_list(None)
+    migrated = {post["_id"]: post.get("comments_migrated", False) for post in posts}
+
+    stored = PostCommentModel.get_motor_collection()
+    wanted = [Binary.from_uuid(comment_id) for post_id, comment_id in parsed if comment_id and migrated.get(post_id)]
+    paths = {
+        (comment["post_id"], as_uuid(comment["_id"])): comment["path"]
+        for comment in await stored.find({"_id": {"$in": wanted}}, {"post_id": 1, "path": 1}).to_list(None)
+    }
+
+    writes, stored_items, applied = [], [], []
+    for (index, item), (post_id, comment_id) in zip(entries, parsed):
+        results[index] = NOT_FOUND
+        if post_id not in migrated or comment_id is None:
+            continue
+        entry = (index, item.action, post_id, comment_id)
+        if migrated[post_id]:
+            path = paths.get((post_id, comment_id))
+            if path is None:
+                continue
+            if item.action == DISMISS:
+                writes.append(stored.update_one(stored_comment_filter(post_id, comment_id), UNFLAG))
+            else:
+                writes.append(stored.delete_many(subtree_filter(post_id, path)))
+            stored_items.append(entry)
+        else:
+            # One at a time: each looks up its ancestors in the current tree
+            apply = unflag_embedded_comment if item.action == DISMISS else pull_embedded_comment
+            if await apply(post_id, comment_id):
+                applied.append(entry)
+    applied += [entry for entry, found in zip(stored_items, await write_each(writes)) if found]
+
+    touched, recount, rescore = set(), set(), set()
+    for index, action, post_id, comment_id in applied:
+        if action == REMOVE:
+            (recount if migrated[post_id] else rescore).add(post_id)
+        targets[action].append(comment_id)
+        touched.add(post_id)
+        results[index] = OK
+
+    if recount:
+        await recount_comments(list(recount))
+    if touched:
+        await forget_entities(app, PostModel, list(touched))
+        await rescore_posts(app, list(recount | rescore))
+        tags.update(f"post:{post_id}" for post_id in touched)
+        tags.add("list:posts")
+    await resolve_by_action(app, COMMENT, targets)
+    return results
+
+async def recount_comments(post_ids: list):
+    """Set comment_count from the comments collection, one write per post."""
+    counts = {post_id: 0 for post_id in post_ids}
+    async for group in PostCommentModel.get_motor_collection().aggregate([
+        {"$match": {"post_id": {"$in": post_ids}}},
+        {"$group": {"_id": "$post_id", "count": {"$sum": 1}}},
+    ]):
+        counts[group["_id"]] = group["count"]
+    await PostModel.get_motor_collection().bulk_write(
+        [UpdateOne({"_id": post_id}, {"$set": {"comment_count": count}}) for post_id, count in counts.items()],
+        ordered=False,
+    )
+
+
+async def moderate_course_reviews(app: FastAPI, entries: list, tags: set) -> dict:
+    """Course reviews are addressed by index (id) and course id (parent_id).
+
+    Indexes refer to the course as it was before the batch: removed reviews
+    are first set to null, and only pulled once every item has been applied.
+    """
+    results = {}
+    targets = defaultdict(list)
+    course_ids = [object_id(item.parent_id) for _, item in entries]
+    courses = CourseModel.get_motor_collection()
+    found = await courses.find(
+        {"_id": {"$in": [i for i in course_ids if i]}}, {"reviews.created_at": 1}
+    ).to_list(None)
+    created = {course["_id"]: [review.get("created_at") for review in course.get("reviews", [])] for course in found}
+
+    writes, applied = [], []
+    for (index, item), course_id in zip(entries, course_ids):
+        results[index] = NOT_FOUND
+        position = int(item.id) if item.id.isdigit() else -1
+        reviews = created.get(course_id, [])
+        if position >= len(reviews) or reviews[position] is None:
+            continue
+        review = f"reviews.{position}"
+        # Only while the review is still where it was read
+        query = {"_id": course_id, f"{review}.created_at": reviews[position]}
+        if item.action == DISMISS:
+            writes.append(courses.update_one(query, {"$set": {f"{review}.flagged": False, f"{review}.reports": []}}))
+        else:
+            writes.append(courses.update_one(query, {"$unset": {review: ""}}))
+        applied.append((index, item.action, course_id, reviews[position]))
+
+    touched, emptied = set(), []
+    for (index, action, course_id, created_at), found in zip(applied, await write_each(writes)):
+        if not found:
+            continue
+        if action == REMOVE and course_id not in emptied:
+            emptied.append(course_id)
+        targets[action].append(course_review_key(course_id, created_at))
+        touched.add(course_id)
+        results[index] = OK
+    if not touched:
+        return results
+
+    operations = []
+    for course_id in emptied:
+        operations.append(UpdateOne({"_id": course_id}, {"$pull": {"reviews": None}}))
+        operations.append(UpdateOne({"_id": course_id}, COURSE_RATINGS))
+    if operations:
+        await courses.bulk_write(operations, ordered=True)
+    await forget_entities(app, CourseModel, list(touched))
+    await resolve_by_action(app, COURSE_REVIEW, targets)
+    tags.update(f"course:{course_id}" for course_id in touched)
+    tags.add("list:courses")
+    return results
+
+
+async def moderate_professor_reviews(app: FastAPI, entries: list, tags: set) -> dict:
+    results = {}
+    targets = defaultdict(list)
+    ids = [object_id(item.id) for _, item in entries]
+    reviews = ProfessorReviewModel.get_motor_collection()
+    found = await reviews.find({"_id": {"$in": [i for i in ids if i]}}, {"professor_id": 1}).to_list(None)
+    professors = {review["_id"]: review["professor_id"] for review in found}
+
+    writes, applied = [], []
+    for (index, item), review_id in zip(entries, ids):
+        results[index] = NOT_FOUND
+        if review_id not in professors:
+            continue
+        writes.append(reviews.update_one({"_id": review_id}, UNFLAG) if item.action == DISMISS else reviews.delete_one({"_id": review_id}))
+        applied.append((index, item.action, review_id))
+
+    rerate = {}
+    for (index, action, review_id), found in zip(applied, await write_each(writes)):
+        if not found:
+            continue
+        professor_id = professors[review_id]
+        if action == REMOVE:
+            rerate[as_uuid(professor_id)] = professor_id
+        targets[action].append(review_id)
+        tags.add(f"professor:{as_uuid(professor_id)}")
+        results[index] = OK
+    if not targets:
+        return results
+
+    if rerate:
+        await rate_professors(list(rerate.values()))
+        await forget_entities(app, ProfessorModel, list(rerate))
+        tags.add("list:professors")
+    await resolve_by_action(app, PROFESSOR_REVIEW, targets)
+    return results
+
+async def rate_professors(professor_ids: list):
+    """Recompute ratings from the remaining reviews, one write per professor."""
+    ratings = {as_uuid(professor_id): {
+        "overall": 0.0, "clarity": 0.0, "engagement": 0.0, "strictness": 0.0, "total_reviews": 0,
+    } for professor_id in professor_ids}
+    # Missing sub-ratings count as 0, as in the admin delete route
+    averages = ProfessorReviewModel.get_motor_collection().aggregate([
+        {"$match": {"professor_id": {"$in": professor_ids}}},
+        {"$group": {
+            "_id": "$professor_id",
+            "total_reviews": {"$sum": 1},
+            "overall": {"$avg": "$overall_rating"},
+            "clarity": {"$avg": {"$ifNull": ["$clarity", 0]}},
+            "engagement": {"$avg": {"$ifNull": ["$engagement", 0]}},
+            "strictness": {"$avg": {"$ifNull": ["$strictness", 0]}},
+        }},
+    ])
+    async for group in averages:
+        professor_id = as_uuid(group.pop("_id"))
+        ratings[professor_id] = {
+            field: value if field == "total_reviews" else round(value, 2) for field, value in group.items()
+        }
+    await ProfessorModel.get_motor_collection().bulk_write(
+        [UpdateOne({"_id": Binary.from_uuid(professor_id)}, {"$set": {"ratings": rating}})
+         for professor_id, rating in ratings.items()],
+        ordered=False,
+    )
+
+
+HANDLERS = {
+    POST: moderate_posts,
+    COMMENT: moderate_comments,
+    COURSE_REVIEW: moderate_course_reviews,
+    PROFESSOR_REVIEW: moderate_professor_reviews,
+}
+
+async def moderate(app: FastAPI, items: list) -> list:
+    """Apply a batch of moderation actions; one result per item, in order."""
+    groups = defaultdict(list)
+    for index, item in enumerate(items):
+        groups[item.target_type].append((index, item))
+    results, tags = {}, set()
+    for target_type, entries in groups.items():
+        results.update(await HANDLERS[target_type](app, entries, tags))
+    if tags:
+        await invalidate_tags(app, *tags)
+    return [results[index] for index in range(len(items))]
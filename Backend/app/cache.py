@@ -1,11 +1,137 @@
-from fastapi import FastAPI
-import json
+from fastapi import FastAPI, Request
+from app.localCache import publish_invalidation
+from beanie.operators import In
+from beanie.odm.utils.encoder import Encoder
+from beanie.odm.utils.parsing import parse_obj
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions
+from collections import Counter, defaultdict, deque
+from typing import NamedTuple, Optional
+import bson
+import orjson
+import os
+import time
+
+# Default lifetime of cached HTTP responses. Tag invalidation keeps entries
+# fresh, so this can safely be long.
+CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))
+
+# Bump when the shape of cached values changes. Deploys can also set
+# CACHE_VERSION (e.g. to the release sha): each version reads and writes its
+# own namespace and entries of older ones simply expire, so nothing is flushed.
+CACHE_SCHEMA_VERSION = 1
+CACHE_NAMESPACE = f"v{CACHE_SCHEMA_VERSION}:{os.getenv('CACHE_VERSION', 'default')}:"
+
+# Redis set holding every cache key tagged with a given entity
+TAG_PREFIX = f"{CACHE_NAMESPACE}tag:"
+
+# Cached HTTP responses live under "resp:<route template>:<hash>" so keys can
+# be grouped and accounted per route
+RESPONSE_PREFIX = f"{CACHE_NAMESPACE}resp:"
+
+# Values stored through set_cache()/the /api/cache endpoints
+KV_PREFIX = f"{CACHE_NAMESPACE}kv:"
+
+# Documents cached by id as "entity:<model>:<id>", stored as the same BSON
+# Mongo holds so they decode exactly like a find would
+ENTITY_PREFIX = f"{CACHE_NAMESPACE}entity:"
+ENTITY_TTL = int(os.getenv("CACHE_ENTITY_TTL", 3600))
+# Match how the motor client decodes documents
+ENTITY_CODEC_OPTIONS = CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+
+# Counters for the Redis tier and stale-while-revalidate. The in-process
+# tier keeps its own counters on app.state.local_cache.
+cache_stats = Counter()
+
+# Invalidations that couldn't reach Redis while it was down, replayed by
+# resume_cache() once it's back so older entries don't outlive their data
+missed_tags = set()
+missed_keys = set()
+
+# Per route template: hit/miss/fill/eviction counts and recent fill times
+route_stats = defaultdict(Counter)
+fill_latencies = defaultdict(lambda: deque(maxlen=1000))
+
+# Upper bounds (seconds) of the TTL buckets reported by the key browser
+TTL_BUCKETS = [("<1m", 60), ("<10m", 600), ("<1h", 3600), ("<1d", 86400), (">=1d", None)]
+
+# Deletes every key referenced by the given tag sets plus the sets themselves,
+# atomically so a response cached mid-invalidation can't lose its tag.
+INVALIDATE_TAGS_SCRIPT = """
+local deleted = {}
+for _, tag in ipairs(KEYS) do
+    for _, key in ipairs(redis.call('SMEMBERS', tag)) do
+        redis.call('DEL', key)
+        table.insert(deleted, key)
+    end
+    redis.call('DEL', tag)
+end
+return deleted
+"""
+
+# Adds ARGV[1] to every tag set in KEYS, extending but never shortening their
+# TTL to ARGV[2]: a short-lived entry must not expire a tag that long-lived
+# entries still depend on.
+TAG_KEY_SCRIPT = """
+for _, tag in ipairs(KEYS) do
+    redis.call('SADD', tag, ARGV[1])
+    if redis.call('TTL', tag) < tonumber(ARGV[2]) then
+        redis.call('EXPIRE', tag, ARGV[2])
+    end
+end
+return 1
+"""
+
+# Responses that vary per user live at most CACHE_USER_TTL seconds, and each
+# user's entries are capped at CACHE_USER_MAX_BYTES, oldest evicted first.
+USER_CACHE_TTL = int(os.getenv("CACHE_USER_TTL", 60))
+USER_CACHE_MAX_BYTES = int(os.getenv("CACHE_USER_MAX_BYTES", 256 * 1024))
+# Per user: sorted set of their cached keys by store time, and a hash of sizes
+USER_INDEX_PREFIX = f"{CACHE_NAMESPACE}user-cache:"
+
+# KEYS: the user's index and size hash. ARGV: new key, its size, store time,
+# TTL, byte cap. Forgets expired entries, then evicts the user's oldest
+# entries until they fit the cap, and returns the evicted keys.
+USER_QUOTA_SCRIPT = """
+local index, sizes = KEYS[1], KEYS[2]
+redis.call('ZADD', index, ARGV[3], ARGV[1])
+redis.call('HSET', sizes, ARGV[1], ARGV[2])
+redis.call('EXPIRE', index, ARGV[4])
+redis.call('EXPIRE', sizes, ARGV[4])
+local live, total = {}, 0
+for _, key in ipairs(redis.call('ZRANGE', index, 0, -1)) do
+    if redis.call('EXISTS', key) == 1 then
+        table.insert(live, key)
+        total = total + tonumber(redis.call('HGET', sizes, key) or 0)
+    else
+        redis.call('ZREM', index, key)
+        redis.call('HDEL', sizes, key)
+    end
+end
+local evicted = {}
+local i = 1
+while total > tonumber(ARGV[5]) and i < #live do
+    total = total - tonumber(redis.call('HGET', sizes, live[i]) or 0)
+    redis.call('DEL', live[i])
+    redis.call('ZREM', index, live[i])
+    redis.call('HDEL', sizes, live[i])
+    table.insert(evicted, live[i])
+    i = i + 1
+end
+return evicted
+"""
+
+# Dimensions a cached response can vary on besides the URL
+VARY_USER = "user"  # the signed-in user, from the access token
+VARY_ROLE = "role"  # the token's is_uoft/is_admin claims
 
 # These functions now depend on the app instance
 async def set_cache(app: FastAPI, key: str, value: dict, expiration: int = 3600):
     if app.state.redis:
         try:
-            await app.state.redis.setex(key, expiration, json.dumps(value))
+            await app.state.redis.setex(f"{KV_PREFIX}{key}", expiration, orjson.dumps(value))
+            # Other workers may still hold the previous value locally
+            await publish_invalidation(app, [f"{KV_PREFIX}{key}"])
             print(f"Cached data for key: {key}")
             return True
         except Exception as e:
@@ -15,12 +141,22 @@ async def set_cache(app: FastAPI, key: str, value: dict, expiration: int = 3600)
 
 async def get_cache(app: FastAPI, key: str):
     if app.state.redis:
+        local = app.state.local_cache.get(f"{KV_PREFIX}{key}")
+        if local is not None:
+            return local
         try:
-            cached = await app.state.redis.get(key)
+            pipe = app.state.redis.pipeline(transaction=False)
+            pipe.get(f"{KV_PREFIX}{key}")
+            pipe.pttl(f"{KV_PREFIX}{key}")
+            cached, ttl_ms = await pipe.execute()
             if cached:
                 print(f"Cache hit for key: {key}")
-                return json.loads(cached)
+                cache_stats["redis_hits"] += 1
+                value = orjson.loads(cached)
+                app.state.local_cache.set(f"{KV_PREFIX}{key}", value, len(cached), ttl_ms / 1000)
+                return value
             print(f"Cache miss for key: {key}")
+            cache_stats["redis_misses"] += 1
             return None
         except Exception as e:
             print(f"Failed to get cache: {e}")
@@ -31,10 +167,417 @@ async def invalidate_cache(app: FastAPI, key: str):
     """Remove a specific key from the cache."""
     if app.state.redis:
         try:
-            await app.state.redis.delete(key)
+            await app.state.redis.delete(f"{KV_PREFIX}{key}")
+            await publish_invalidation(app, [f"{KV_PREFIX}{key}"])
             print(f"Invalidated cache for key: {key}")
             return True
         except Exception as e:
             print(f"Failed to invalidate cache: {e}")
             return False
-    return False
\ No newline at end of file
+    return False
+
+async def set_cache_many(app: FastAPI, values: dict, expiration: int = 3600):
+    """set_cache for many keys in a single round trip."""
+    if app.state.redis:
+        try:
+            pipe = app.state.redis.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.setex(f"{KV_PREFIX}{key}", expiration, orjson.dumps(value))
+            await pipe.execute()
+            await publish_invalidation(app, [f"{KV_PREFIX}{key}" for key in values])
+            print(f"Cached data for {len(values)} keys")
+            return True
+        except Exception as e:
+            print(f"Failed to set cache: {e}")
+            return False
+    return False
+
+async def get_cache_many(app: FastAPI, keys: list):
+    """get_cache for many keys: local hits first, then one MGET for the rest.
+
+    Returns {key: value or None}, or None if Redis is unavailable.
+    """
+    if app.state.redis:
+        values = {}
+        missing = []
+        for key in keys:
+            local = app.state.local_cache.get(f"{KV_PREFIX}{key}")
+            if local is not None:
+                values[key] = local
+            else:
+                missing.append(key)
+        if not missing:
+            return values
+        try:
+            redis_keys = [f"{KV_PREFIX}{key}" for key in missing]
+            pipe = app.state.redis.pipeline(transaction=False)
+            pipe.mget(redis_keys)
+            for redis_key in redis_keys:
+                pipe.pttl(redis_key)
+            cached, *ttls = await pipe.execute()
+            for key, redis_key, raw, ttl_ms in zip(missing, redis_keys, cached, ttls):
+                if raw is None:
+                    cache_stats["redis_misses"] += 1
+                    values[key] = None
+                    continue
+                cache_stats["redis_hits"] += 1
+                values[key] = orjson.loads(raw)
+                app.state.local_cache.set(redis_key, values[key], len(raw), ttl_ms / 1000)
+            print(f"Cache hits for {sum(1 for key in missing if values[key] is not None)}/{len(missing)} keys")
+            return values
+        except Exception as e:
+            print(f"Failed to get cache: {e}")
+            return None
+    return None
+
+async def invalidate_cache_many(app: FastAPI, keys: list):
+    """Remove many keys from the cache with a single DEL."""
+    if app.state.redis:
+        try:
+            redis_keys = [f"{KV_PREFIX}{key}" for key in keys]
+            if redis_keys:
+                await app.state.redis.delete(*redis_keys)
+                await publish_invalidation(app, redis_keys)
+            print(f"Invalidated cache for {len(redis_keys)} keys")
+            return True
+        except Exception as e:
+            print(f"Failed to invalidate cache: {e}")
+            return False
+    return False
+
+def entity_key(model, doc_id) -> str:
+    return f"{ENTITY_PREFIX}{model.__name__}:{doc_id}"
+
+def encode_entity(doc) -> bytes:
+    return bson.encode(Encoder().encode(doc))
+
+def decode_entity(model, raw: bytes):
+    # A fresh instance every time: routes mutate what they get before saving
+    return parse_obj(model, bson.decode(raw, codec_options=ENTITY_CODEC_OPTIONS))
+
+def redis_down(app: FastAPI) -> bool:
+    """Redis is configured but its circuit is open."""
+    return app.state.redis is not None and not app.state.redis
+
+async def cache_entities(app: FastAPI, docs):
+    """Write documents through to Redis and drop stale local copies everywhere."""
+    if docs and redis_down(app):
+        missed_keys.update(entity_key(type(doc), doc.id) for doc in docs)
+    if app.state.redis and docs:
+        try:
+            encoded = {entity_key(type(doc), doc.id): encode_entity(doc) for doc in docs}
+            pipe = app.state.redis.pipeline(transaction=False)
+            for key, raw in encoded.items():
+                pipe.setex(key, ENTITY_TTL, raw)
+            await pipe.execute()
+            await publish_invalidation(app, list(encoded))
+            for key, raw in encoded.items():
+                app.state.local_cache.set(key, raw, len(raw), ENTITY_TTL)
+            return True
+        except Exception as e:
+            print(f"Failed to cache {len(docs)} documents: {e}")
+            missed_keys.update(entity_key(type(doc), doc.id) for doc in docs)
+            return False
+    return False
+
+async def forget_entities(app: FastAPI, model, ids):
+    """Drop cached documents changed without save_entity, e.g. by update_many."""
+    if ids and redis_down(app):
+        missed_keys.update(entity_key(model, doc_id) for doc_id in ids)
+    if app.state.redis and ids:
+        try:
+            keys = [entity_key(model, doc_id) for doc_id in ids]
+            await app.state.redis.delete(*keys)
+            await publish_invalidation(app, keys)
+            return True
+        except Exception as e:
+            print(f"Failed to forget {len(ids)} {model.__name__} documents: {e}")
+            missed_keys.update(entity_key(model, doc_id) for doc_id in ids)
+            return False
+    return False
+
+async def forget_all_entities(app: FastAPI, model):
+    """Drop every cached document of a model, e.g. after delete_all."""
+    return await delete_matching(app, entity_key(model, "*"))
+
+async def delete_matching(app: FastAPI, pattern: str):
+    if redis_down(app):
+        missed_keys.add(pattern)
+    if app.state.redis:
+        try:
+            keys = [key async for key in app.state.redis.scan_iter(match=pattern, count=500)]
+            if keys:
+                await app.state.redis.delete(*keys)
+                await publish_invalidation(app, keys)
+            return True
+        except Exception as e:
+            print(f"Failed to delete keys matching {pattern}: {e}")
+            missed_keys.add(pattern)
+            return False
+    return False
+
+async def get_entity(app: FastAPI, model, doc_id):
+    """model.get(doc_id), read through the local cache and Redis."""
+    docs = await get_entities(app, model, [doc_id])
+    return docs[0] if docs else None
+
+async def get_entities(app: FastAPI, model, ids: list) -> list:
+    """Documents for ids, in order, skipping ones that don't exist.
+
+    Cached documents come from memory or one MGET, and only the rest are
+    fetched from Mongo, with a single $in query.
+    """
+    if not ids:
+        return []
+    found = {}
+    missing = []
+    for doc_id in ids:
+        # The local copy can't be trusted while invalidations aren't arriving
+        raw = app.state.local_cache.get(entity_key(model, doc_id)) if app.state.redis else None
+        if raw is not None:
+            found[str(doc_id)] = raw
+        else:
+            missing.append(doc_id)
+
+    if missing and app.state.redis:
+        try:
+            cached = await app.state.redis.mget([entity_key(model, doc_id) for doc_id in missing])
+            still_missing = []
+            for doc_id, raw in zip(missing, cached):
+                if raw is None:
+                    still_missing.append(doc_id)
+                else:
+                    found[str(doc_id)] = raw
+                    app.state.local_cache.set(entity_key(model, doc_id), raw, len(raw))
+            missing = still_missing
+        except Exception as e:
+            print(f"Failed to get cached {model.__name__} documents: {e}")
+    cache_stats["entity_hits"] += len(ids) - len(missing)
+    cache_stats["entity_misses"] += len(missing)
+
+    docs = {doc_id: decode_entity(model, raw) for doc_id, raw in found.items()}
+    if missing:
+        if len(missing) == 1:
+            fetched = await model.get(missing[0])
+            fetched = [fetched] if fetched is not None else []
+        else:
+            fetched = await model.find(In(model.id, missing)).to_list()
+        await cache_entities(app, fetched)
+        docs.update((str(doc.id), doc) for doc in fetched)
+    return [docs[str(doc_id)] for doc_id in ids if str(doc_id) in docs]
+
+async def save_entity(app: FastAPI, doc):
+    """doc.save(), then write the new version through to the cache."""
+    await doc.save()
+    await cache_entities(app, [doc])
+
+async def insert_entity(app: FastAPI, doc):
+    await doc.insert()
+    await cache_entities(app, [doc])
+
+async def delete_entity(app: FastAPI, doc):
+    await doc.delete()
+    await forget_entities(app, type(doc), [doc.id])
+
+def tag_response(request: Request, *tags: str):
+    """Record the entities (e.g. "post:<id>", "list:posts") a GET response contains.
+
+    The cache middleware reads these after the route runs and links the cached
+    response to each tag, so invalidate_tags() can drop it later.
+    """
+    existing = getattr(request.state, "cache_tags", None)
+    if existing is None:
+        existing = set()
+        request.state.cache_tags = existing
+    existing.update(tags)
+
+async def tag_cache_key(app: FastAPI, key: str, tags, expiration: int = CACHE_TTL):
+    """Add a cached key to the Redis set of every tag it depends on."""
+    if app.state.redis and tags:
+        try:
+            tag_keys = [f"{TAG_PREFIX}{tag}" for tag in set(tags)]
+            await app.state.redis.eval(TAG_KEY_SCRIPT, len(tag_keys), *tag_keys, key, expiration)
+            return True
+        except Exception as e:
+            print(f"Failed to tag cache key {key}: {e}")
+            return False
+    return False
+
+async def enforce_user_quota(app: FastAPI, user: str, key: str, size: int, expiration: int):
+    """Record a per-user entry and evict that user's oldest ones over the cap."""
+    if app.state.redis:
+        try:
+            index = f"{USER_INDEX_PREFIX}{user}"
+            evicted = await app.state.redis.eval(
+                USER_QUOTA_SCRIPT, 2, index, f"{index}:sizes",
+                key, size, time.time(), expiration, USER_CACHE_MAX_BYTES,
+            )
+            if evicted:
+                await publish_invalidation(app, evicted)
+                route_stats[route_of_key(key)]["evictions"] += len(evicted)
+            return True
+        except Exception as e:
+            print(f"Failed to enforce cache quota for {key}: {e}")
+            return False
+    return False
+
+async def invalidate_tags(app: FastAPI, *tags: str):
+    """Remove every cached response tagged with any of the given entities."""
+    if tags and redis_down(app):
+        missed_tags.update(tags)
+    if app.state.redis and tags:
+        try:
+            tag_keys = [f"{TAG_PREFIX}{tag}" for tag in set(tags)]
+            deleted = await app.state.redis.eval(INVALIDATE_TAGS_SCRIPT, len(tag_keys), *tag_keys)
+            await publish_invalidation(app, deleted)
+            for key in deleted:
+                route_stats[route_of_key(key)]["evictions"] += 1
+            print(f"Invalidated {len(deleted)} cached responses for tags: {sorted(set(tags))}")
+            return True
+        except Exception as e:
+            print(f"Failed to invalidate tags {tags}: {e}")
+            missed_tags.update(tags)
+            return False
+    return False
+
+async def resume_cache(app: FastAPI):
+    """Called once Redis reconnects: catch up on what this worker missed."""
+    # Other workers' invalidations didn't arrive either
+    app.state.local_cache.clear()
+    tags = list(missed_tags)
+    keys = list(missed_keys)
+    missed_tags.clear()
+    missed_keys.clear()
+    if tags:
+        await invalidate_tags(app, *tags)
+    patterns = [key for key in keys if "*" in key]
+    keys = [key for key in keys if "*" not in key]
+    for pattern in patterns:
+        await delete_matching(app, pattern)
+    if keys:
+        try:
+            await app.state.redis.delete(*keys)
+            await publish_invalidation(app, keys)
+        except Exception as e:
+            print(f"Failed to drop {len(keys)} stale documents: {e}")
+            missed_keys.update(keys)
+    print(f"Replayed {len(tags)} tag and {len(keys) + len(patterns)} key invalidations missed while Redis was down")
+
+class CachePolicy(NamedTuple):
+    ttl: int = CACHE_TTL
+    cacheable: bool = True
+    # Query params that select a different response, None for all of them
+    vary_params: Optional[tuple] = None
+    # Seconds a 404 is cached for, 0 to never cache them
+    negative_ttl: int = 0
+    # Entries older than this are served stale while being refreshed
+    soft_ttl: Optional[int] = None
+    # VARY_USER or VARY_ROLE, None when every client gets the same response
+    vary_on: Optional[str] = None
+
+DEFAULT_CACHE_POLICY = CachePolicy()
+
+# How long item routes remember that something doesn't exist
+NEGATIVE_CACHE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", 30))
+
+def cache_policy(
+    ttl: int = CACHE_TTL,
+    cacheable: bool = True,
+    vary_params: Optional[tuple] = None,
+    negative_ttl: int = 0,
+    soft_ttl: Optional[int] = None,
+    vary_on: Optional[str] = None,
+):
+    """Set how the response cache treats this GET route.
+
+    ttl: lifetime of a cached 200.
+    cacheable: False makes every request run the route.
+    vary_params: query params that are part of the cache key; others are
+        ignored. Path params always are, since the key includes the path.
+    negative_ttl: cache 404s for this many seconds instead of not at all.
+    soft_ttl: serve entries older than this immediately while a background
+        task re-runs the route to refresh them (stale-while-revalidate).
+    vary_on: VARY_USER keeps a copy per signed-in user, capped by
+        CACHE_USER_TTL and CACHE_USER_MAX_BYTES; VARY_ROLE keeps one per
+        combination of role claims. Anonymous requests share one copy.
+
+    Routes without a policy are cached for CACHE_TTL, keyed on all params.
+    Put it below the router decorator so FastAPI registers the marked function.
+    """
+    def decorator(endpoint):
+        endpoint.cache_policy = CachePolicy(ttl, cacheable, vary_params and tuple(vary_params), negative_ttl, soft_ttl, vary_on)
+        return endpoint
+    return decorator
+
+def route_of_key(key) -> str:
+    if isinstance(key, bytes):
+        key = key.decode()
+    if not key.startswith(RESPONSE_PREFIX):
+        return "other"
+    return key[len(RESPONSE_PREFIX):].rsplit(":", 1)[0]
+
+def percentile(samples, fraction: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def route_stats_summary() -> dict:
+    summary = {}
+    for route, counts in route_stats.items():
+        lookups = counts["hits"] + counts["misses"]
+        latencies = fill_latencies[route]
+        p50 = percentile(latencies, 0.5)
+        p99 = percentile(latencies, 0.99)
+        summary[route] = {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hit_ratio": round(counts["hits"] / lookups, 4) if lookups else None,
+            "fills": counts["fills"],
+            "evictions": counts["evictions"],
+            "fill_ms_p50": round(p50 * 1000, 2) if p50 is not None else None,
+            "fill_ms_p99": round(p99 * 1000, 2) if p99 is not None else None,
+        }
+    return summary
+
+async def scan_cache_keys(app: FastAPI, prefix: str = "", max_keys: int = 10000):
+    """Walk cached responses with SCAN and total their memory and TTLs per route."""
+    if not app.state.redis:
+        return None
+    routes = defaultdict(lambda: {
+        "keys": 0,
+        "memory_bytes": 0,
+        "ttl": {name: 0 for name, _ in TTL_BUCKETS},
+    })
+    scanned = 0
+    batch = []
+
+    async def measure(keys):
+        pipe = app.state.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+            pipe.ttl(key)
+        results = await pipe.execute()
+        for key, memory, ttl in zip(keys, results[::2], results[1::2]):
+            if memory is None:
+                continue  # expired between SCAN and MEMORY USAGE
+            group = routes[route_of_key(key)]
+            group["keys"] += 1
+            group["memory_bytes"] += memory
+            for name, bound in TTL_BUCKETS:
+                if bound is None or 0 <= ttl < bound:
+                    group["ttl"][name] += 1
+                    break
+
+    async for key in app.state.redis.scan_iter(match=f"{RESPONSE_PREFIX}{prefix}*", count=500):
+        batch.append(key)
+        scanned += 1
+        if len(batch) >= 500:
+            await measure(batch)
+            batch = []
+        if scanned >= max_keys:
+            break
+    if batch:
+        await measure(batch)
+    ordered = sorted(routes.items(), key=lambda item: item[1]["memory_bytes"], reverse=True)
+    return {"scanned": scanned, "truncated": scanned >= max_keys, "routes": dict(ordered)}
@@ -0,0 +1,72 @@
+"""Measure what compressed cache entries cost in Redis and save on the wire.
+
+Run against a live API with USE_REDIS=true, using the same Redis settings:
+
+    python -m app.cacheBenchmark http://localhost:8000 /api/posts "/api/courses?page=0"
+
+For each path it fills the cache entry, then reports the response size per
+content-coding and the Redis memory of the entry with and without its
+compressed copies.
+"""
+from dotenv import load_dotenv
+from app.cacheMiddleware import BODY_FIELD, VARIANT_PREFIX, COMPRESSORS, cache_key_for, policy_of, resolve_route
+from app.main import app
+from app.cacheWarmup import request_scope
+import redis.asyncio as redis
+import aiohttp
+import asyncio
+import os
+import sys
+
+load_dotenv()
+
+
+async def fetch_size(session, url: str, coding: str):
+    async with session.get(url, headers={"Accept-Encoding": coding}) as response:
+        body = await response.read()
+        if coding != "identity" and response.headers.get("Content-Encoding") != coding:
+            return None
+        return len(body)
+
+
+async def benchmark(base_url: str, paths):
+    client = redis.Redis(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASS", None),
+    )
+    codings = ["identity"] + [coding.decode() for coding in COMPRESSORS]
+    async with aiohttp.ClientSession(auto_decompress=False) as session:
+        for path in paths:
+            url = base_url.rstrip("/") + path
+            # The first request fills the entry, the rest are served from it
+            wire = {coding: await fetch_size(session, url, coding) for coding in codings}
+
+            scope = request_scope(url)
+            endpoint, template = resolve_route(app, scope)
+            key = cache_key_for(scope, template, policy_of(endpoint))
+            memory = await client.memory_usage(key)
+            if memory is None:
+                print(f"{path}: not cached, skipping")
+                continue
+            identity_bytes = await client.hstrlen(key, BODY_FIELD)
+            variant_bytes = 0
+            for coding in COMPRESSORS:
+                variant_bytes += await client.hstrlen(key, VARIANT_PREFIX + coding)
+
+            print(path)
+            for coding, size in wire.items():
+                if size is None:
+                    print(f"  wire {coding:>8}: not offered")
+                else:
+                    print(f"  wire {coding:>8}: {size:>10} bytes ({size / wire['identity']:.1%})")
+            print(f"  redis before: {memory - variant_bytes:>10} bytes (identity body {identity_bytes})")
+            print(f"  redis after:  {memory:>10} bytes (+{variant_bytes} compressed)")
+    await client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(benchmark(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,540 @@
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import cookie_parser
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.cache import (
+    DEFAULT_CACHE_POLICY, RESPONSE_PREFIX, VARY_USER, USER_CACHE_TTL,
+    tag_cache_key, enforce_user_quota, cache_stats, route_stats, fill_latencies,
+)
+from app.routes.auth import ACCESS_SECRET_KEY, ALGORITHM
+from urllib.parse import parse_qsl, urlencode
+from app.localCache import publish_invalidation
+from uuid import uuid4
+import asyncio
+import gzip
+import hashlib
+import jwt
+import logging
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Hash fields of a cached response. Headers are stored one field each under
+# HEADER_PREFIX so a hit can be replayed without parsing anything.
+STATUS_FIELD = b"status"
+BODY_FIELD = b"body"
+STORED_AT_FIELD = b"stored_at"
+HEADER_PREFIX = b"h:"
+ETAG_FIELD = HEADER_PREFIX + b"etag"
+# Compressed copies of the body, one field per content-coding
+VARIANT_PREFIX = b"body:"
+
+# Bodies smaller than this are neither stored compressed nor compressed on the fly
+COMPRESS_MIN_SIZE = int(os.getenv("CACHE_COMPRESS_MIN_SIZE", 1024))
+
+# Content-codings we can produce, most preferred first
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS[b"br"] = lambda body: brotli.compress(body, quality=5)
+if zstandard is not None:
+    COMPRESSORS[b"zstd"] = lambda body: zstandard.ZstdCompressor(level=6).compress(body)
+COMPRESSORS[b"gzip"] = lambda body: gzip.compress(body, compresslevel=6)
+
+# Recomputed on replay, or never safe to share between clients
+SKIPPED_HEADERS = {b"content-length", b"set-cookie"}
+
+# Endpoints whose responses must always be live
+UNCACHED_PREFIXES = ("/api/cache",)
+
+# Single-flight on misses: the worker holding the fill lock recomputes the
+# response, everyone else waits up to COALESCE_TIMEOUT seconds for it before
+# giving up and computing it themselves.
+LOCK_PREFIX = "lock:"
+COALESCE_TIMEOUT = float(os.getenv("CACHE_COALESCE_TIMEOUT", 5))
+COALESCE_POLL_INTERVAL = 0.05
+
+# Only the worker that took the lock may release it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Bound on the path -> route memo used to look up route cache settings
+MAX_RESOLVED_PATHS = 10000
+UNMATCHED_ROUTE = "unmatched"
+
+
+def resolve_route(app, scope: Scope):
+    """(endpoint, path template) of the route that will serve this request."""
+    for route in app.router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return child_scope.get("endpoint"), getattr(child_scope.get("route"), "path", UNMATCHED_ROUTE)
+    return None, UNMATCHED_ROUTE
+
+
+def policy_of(endpoint):
+    return getattr(endpoint, "cache_policy", DEFAULT_CACHE_POLICY)
+
+
+def token_claims(scope: Scope):
+    """Claims of the request's access token, or None if it has no valid one."""
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            token = cookie_parser(value.decode("latin-1")).get("access_token", "")
+            if not token.startswith("Bearer "):
+                return None
+            try:
+                return jwt.decode(token.split(" ")[1], ACCESS_SECRET_KEY, algorithms=[ALGORITHM])
+            except jwt.PyJWTError:
+                # Routes treat an invalid or expired token as signed out too
+                return None
+    return None
+
+
+def cache_variant(scope: Scope, policy):
+    """Which copy of the route's response this request gets under policy.vary_on.
+
+    "" for public routes and "anonymous" for requests without a valid token.
+    None if the variant can't be told from the token, so the request must
+    bypass the cache.
+    """
+    if policy.vary_on is None:
+        return ""
+    claims = token_claims(scope)
+    if claims is None:
+        return "anonymous"
+    if policy.vary_on == VARY_USER:
+        user = claims.get("uid") or hashlib.md5(claims.get("sub", "").encode()).hexdigest()
+        return f"user:{user}"
+    if "is_uoft" not in claims:
+        # Issued before tokens carried role claims
+        return None
+    roles = [role for role in ("uoft", "admin") if claims.get(f"is_{role}")]
+    return "role:" + ("+".join(roles) or "member")
+
+
+def cache_key_for(scope: Scope, template: str, policy=DEFAULT_CACHE_POLICY, variant: str = "") -> str:
+    """Key of the response to this request, whichever host it came through.
+
+    Only the route's significant query params are part of the key, sorted, so
+    ?page=0&limit=20 and ?limit=20&page=0 share an entry.
+    """
+    params = [
+        (name, value)
+        for name, value in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        if policy.vary_params is None or name in policy.vary_params
+    ]
+    canonical = scope["path"]
+    if params:
+        canonical += "?" + urlencode(sorted(params))
+    if variant:
+        canonical = f"{variant}:{canonical}"
+    url_hash = hashlib.md5(f"GET:{canonical}".encode()).hexdigest()
+    return f"{RESPONSE_PREFIX}{template}:{url_hash}"
+
+
+def entry_size(entry: dict) -> int:
+    return sum(len(field) + len(value) for field, value in entry.items() if isinstance(value, bytes))
+
+
+def is_cacheable(status: int, headers, policy) -> bool:
+    if status != 200 and not (status == 404 and policy.negative_ttl > 0):
+        return False
+    content_type = None
+    for name, value in headers:
+        if name == b"set-cookie":
+            return False
+        if name == b"content-type":
+            content_type = value
+    return content_type == b"application/json"
+
+
+def etag_for(body: bytes) -> bytes:
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+
+def with_validators(headers, etag: bytes, policy) -> list:
+    """Add the ETag, and ask browsers to revalidate with it rather than refetch."""
+    headers = [(name, value) for name, value in headers if name not in (b"etag", b"vary")]
+    headers.append((b"etag", etag))
+    if not any(name == b"cache-control" for name, _ in headers):
+        # Shared caches must not hand one user's copy to another
+        headers.append((b"cache-control", b"private, no-cache" if policy.vary_on else b"no-cache"))
+    headers.append((b"vary", b"Accept-Encoding, Cookie" if policy.vary_on else b"Accept-Encoding"))
+    return headers
+
+
+def compress_variants(body: bytes) -> dict:
+    if len(body) < COMPRESS_MIN_SIZE:
+        return {}
+    return {VARIANT_PREFIX + coding: compress(body) for coding, compress in COMPRESSORS.items()}
+
+
+def choose_encoding(scope: Scope, entry: dict):
+    """Most preferred content-coding that the client accepts and the entry has."""
+    accepted = {}
+    for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+            for item in value.split(b","):
+                coding, _, params = item.strip().partition(b";")
+                q = 1.0
+                if params.strip().startswith(b"q="):
+                    try:
+                        q = float(params.strip()[2:])
+                    except ValueError:
+                        q = 0.0
+                accepted[coding.strip().lower()] = q
+    for coding in COMPRESSORS:
+        if accepted.get(coding, accepted.get(b"*", 0)) > 0 and VARIANT_PREFIX + coding in entry:
+            return coding
+    return None
+
+
+def variant_etag(etag: bytes, coding) -> bytes:
+    # Each representation needs its own strong validator
+    return etag if coding is None else etag[:-1] + b"-" + coding + b'"'
+
+
+def if_none_match(scope: Scope, etag: bytes) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"if-none-match":
+            if value.strip() == b"*":
+                return True
+            return etag in (tag.strip().removeprefix(b"W/") for tag in value.split(b","))
+    return False
+
+
+async def send_not_modified(send: Send, etag: bytes, cached: dict):
+    cache_stats["not_modified"] += 1
+    headers = [(b"etag", etag)]
+    for name in (b"cache-control", b"vary"):
+        if HEADER_PREFIX + name in cached:
+            headers.append((name, cached[HEADER_PREFIX + name]))
+    headers.append((b"x-cache", b"HIT"))
+    await send({"type": "http.response.start", "status": 304, "headers": headers})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def is_stale(entry: dict, policy) -> bool:
+    if policy.soft_ttl is None or STORED_AT_FIELD not in entry:
+        return False
+    return time.time() - float(entry[STORED_AT_FIELD]) > policy.soft_ttl
+
+
+async def discard(message: Message):
+    pass
+
+
+class StarletteCacheMiddleware:
+    """Pure ASGI response cache for GET requests.
+
+    Responses are stored in a Redis hash as the exact body bytes plus their
+    headers, and replayed verbatim on a hit without touching the route or
+    decoding the payload. Compressed copies are made once when the entry is
+    filled; responses that bypass the cache are gzipped on the fly instead.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.compressed_app = GZipMiddleware(app, minimum_size=COMPRESS_MIN_SIZE)
+        # cache key -> future resolved with the entry once this worker's fill completes
+        self.inflight = {}
+        # cache key -> background task refreshing a stale entry
+        self.refreshing = {}
+        # path -> (endpoint, path template)
+        self.routes = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"].startswith(UNCACHED_PREFIXES):
+            await self.compressed_app(scope, receive, send)
+            return
+
+        redis = scope["app"].state.redis
+        if not redis:
+            await self.compressed_app(scope, receive, send)
+            return
+
+        endpoint, template = self.route_for(scope)
+        policy = policy_of(endpoint)
+        variant = cache_variant(scope, policy) if policy.cacheable else None
+        if variant is None:
+            await self.compressed_app(scope, receive, send)
+            return
+        scope.setdefault("state", {})["cache_variant"] = variant
+        stats = route_stats[template]
+        cache_key = cache_key_for(scope, template, policy, variant)
+        local_cache = scope["app"].state.local_cache
+
+        cached = local_cache.get(cache_key)
+        if cached is not None:
+            stats["hits"] += 1
+            await self.serve_hit(scope, cache_key, cached, policy, send)
+            return
+
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.hgetall(cache_key)
+            pipe.pttl(cache_key)
+            cached, ttl_ms = await pipe.execute()
+            if cached:
+                logger.info(f"Cache hit for {cache_key}")
+                cache_stats["redis_hits"] += 1
+                stats["hits"] += 1
+                local_cache.set(cache_key, cached, entry_size(cached), ttl_ms / 1000)
+                await self.serve_hit(scope, cache_key, cached, policy, send)
+                return
+            cache_stats["redis_misses"] += 1
+        except Exception as e:
+            logger.error(f"Redis error on get: {e}, proceeding without cache")
+
+        logger.info(f"Cache miss for {cache_key}")
+        stats["misses"] += 1
+        inflight = self.inflight.get(cache_key)
+        if inflight is not None:
+            # Another request in this worker is already filling the key
+            try:
+                cached = await asyncio.wait_for(asyncio.shield(inflight), COALESCE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out waiting for fill of {cache_key}")
+                cached = None
+            if cached is not None:
+                await self.replay(scope, cached, send)
+            else:
+                await self.fill(scope, receive, send, cache_key, policy)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[cache_key] = future
+        cached = None
+        try:
+            cached = await self.fill_coalesced(scope, receive, send, cache_key, policy)
+        finally:
+            del self.inflight[cache_key]
+            future.set_result(cached)
+
+    def route_for(self, scope: Scope):
+        path = scope["path"]
+        route = self.routes.get(path)
+        if route is None:
+            if len(self.routes) >= MAX_RESOLVED_PATHS:
+                self.routes.clear()
+            route = resolve_route(scope["app"], scope)
+            self.routes[path] = route
+        return route
+
+    async def serve_hit(self, scope: Scope, cache_key: str, cached: dict, policy, send: Send):
+        if is_stale(cached, policy):
+            cache_stats["stale_serves"] += 1
+            if cache_key not in self.refreshing and cache_key not in self.inflight:
+                task = asyncio.create_task(self.refresh(scope, cache_key, policy))
+                self.refreshing[cache_key] = task
+                task.add_done_callback(lambda _: self.refreshing.pop(cache_key, None))
+        await self.replay(scope, cached, send)
+
+    async def refresh(self, scope: Scope, cache_key: str, policy):
+        """Re-run the route in the background and replace a stale entry."""
+        redis = scope["app"].state.redis
+        lock_key = f"{LOCK_PREFIX}{cache_key}"
+        token = uuid4().hex
+        try:
+            # Another worker may already be refreshing the same entry
+            if not await redis.set(lock_key, token, nx=True, px=int(COALESCE_TIMEOUT * 1000)):
+                return
+        except Exception as e:
+            logger.error(f"Failed to take refresh lock for {cache_key}: {e}")
+            return
+
+        refresh_scope = dict(scope)
+        refresh_scope["state"] = {k: v for k, v in scope.get("state", {}).items() if k != "cache_tags"}
+        done = asyncio.Event()
+
+        async def receive():
+            if not done.is_set():
+                done.set()
+                return {"type": "http.request", "body": b"", "more_body": False}
+            return {"type": "http.disconnect"}
+
+        try:
+            cached = await self.fill(refresh_scope, receive, discard, cache_key, policy)
+            if cached is not None:
+                cache_stats["background_refreshes"] += 1
+                # Other workers may still hold the stale copy locally
+                await publish_invalidation(scope["app"], [cache_key])
+        except Exception as e:
+            logger.error(f"Background refresh of {cache_key} failed: {e}")
+        finally:
+            try:
+                await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                logger.error(f"Failed to release refresh lock for {cache_key}: {e}")
+
+    async def fill_coalesced(self, scope: Scope, receive: Receive, send: Send, cache_key: str, policy):
+        """Fill the key unless another worker holds its fill lock, then wait for theirs."""
+        redis = scope["app"].state.redis
+        lock_key = f"{LOCK_PREFIX}{cache_key}"
+        token = uuid4().hex
+        try:
+            locked = await redis.set(lock_key, token, nx=True, px=int(COALESCE_TIMEOUT * 1000))
+        except Exception as e:
+            logger.error(f"Failed to take fill lock for {cache_key}: {e}")
+            return await self.fill(scope, receive, send, cache_key, policy)
+
+        if not locked:
+            cached = await self.wait_for_remote_fill(redis, cache_key, lock_key)
+            if cached:
+                await self.replay(scope, cached, send)
+                return cached
+            return await self.fill(scope, receive, send, cache_key, policy)
+
+        try:
+            return await self.fill(scope, receive, send, cache_key, policy)
+        finally:
+            try:
+                await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                logger.error(f"Failed to release fill lock for {cache_key}: {e}")
+
+    async def wait_for_remote_fill(self, redis, cache_key: str, lock_key: str):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + COALESCE_TIMEOUT
+        while loop.time() < deadline:
+            await asyncio.sleep(COALESCE_POLL_INTERVAL)
+            try:
+                pipe = redis.pipeline(transaction=False)
+                pipe.hgetall(cache_key)
+                pipe.exists(lock_key)
+                cached, locked = await pipe.execute()
+            except Exception as e:
+                logger.error(f"Redis error waiting for fill of {cache_key}: {e}")
+                return None
+            if cached:
+                return cached
+            if not locked:
+                # The other worker finished without caching anything
+                return None
+        logger.warning(f"Timed out waiting for fill of {cache_key}")
+        return None
+
+    async def fill(self, scope: Scope, receive: Receive, send: Send, cache_key: str, policy):
+        """Run the route, streaming its response to the client, and cache it if possible."""
+        # Routes record their cache tags in the request state
+        scope.setdefault("state", {})
+        start_message = {}
+        chunks = []
+        entry = None
+        streaming = False
+        started_at = time.perf_counter()
+
+        async def send_and_capture(message: Message):
+            nonlocal entry, streaming
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk, so a cacheable
+                # single-chunk response can be sent the same way a hit is
+                start_message.update(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            if (
+                not streaming
+                and body
+                and not message.get("more_body", False)
+                and is_cacheable(start_message["status"], start_message["headers"], policy)
+            ):
+                entry = await build_entry(start_message, body, policy)
+                await self.replay(scope, entry, send, hit=False)
+                return
+            if not streaming:
+                streaming = True
+                await send(start_message)
+            chunks.append(body)
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
+
+        if entry is None:
+            if not start_message or not is_cacheable(start_message["status"], start_message["headers"], policy):
+                return None
+            body = b"".join(chunks)
+            if not body:
+                logger.info(f"Empty response body for {cache_key}, not caching")
+                return None
+            entry = await build_entry(start_message, body, policy)
+        template = self.route_for(scope)[1]
+        route_stats[template]["fills"] += 1
+        fill_latencies[template].append(time.perf_counter() - started_at)
+        # Missing things are only remembered briefly, in case they get created
+        ttl = policy.negative_ttl if start_message["status"] == 404 else policy.ttl
+        if policy.vary_on == VARY_USER:
+            ttl = min(ttl, USER_CACHE_TTL)
+        return await self.store(scope, cache_key, entry, ttl)
+
+    async def replay(self, scope: Scope, cached: dict, send: Send, hit: bool = True):
+        coding = choose_encoding(scope, cached)
+        etag = variant_etag(cached[ETAG_FIELD], coding) if ETAG_FIELD in cached else None
+        if etag is not None and if_none_match(scope, etag):
+            await send_not_modified(send, etag, cached)
+            return
+        body = cached[BODY_FIELD] if coding is None else cached[VARIANT_PREFIX + coding]
+        headers = [
+            (field[len(HEADER_PREFIX):], value)
+            for field, value in cached.items()
+            if field.startswith(HEADER_PREFIX) and field != ETAG_FIELD
+        ]
+        if etag is not None:
+            headers.append((b"etag", etag))
+        if coding is not None:
+            headers.append((b"content-encoding", coding))
+        headers.append((b"content-length", str(len(body)).encode()))
+        headers.append((b"x-cache", b"HIT" if hit else b"MISS"))
+        await send({"type": "http.response.start", "status": int(cached[STATUS_FIELD]), "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def store(self, scope: Scope, cache_key: str, entry: dict, ttl: int):
+        app = scope["app"]
+        try:
+            pipe = app.state.redis.pipeline(transaction=True)
+            pipe.delete(cache_key)
+            pipe.hset(cache_key, mapping=entry)
+            pipe.expire(cache_key, ttl)
+            await pipe.execute()
+            await tag_cache_key(app, cache_key, scope["state"].get("cache_tags"), ttl)
+            variant = scope["state"].get("cache_variant", "")
+            if variant.startswith("user:"):
+                await enforce_user_quota(app, variant[len("user:"):], cache_key, entry_size(entry), ttl)
+            app.state.local_cache.set(cache_key, entry, entry_size(entry), ttl)
+            logger.info(f"Cached response for {cache_key}")
+        except Exception as e:
+            logger.error(f"Failed to cache response for {cache_key}: {e}")
+        # Waiting requests can replay the entry even if storing it failed
+        return entry
+
+
+async def build_entry(start_message: Message, body: bytes, policy) -> dict:
+    """The Redis hash for a response: status, headers, body and its compressed copies."""
+    entry = {
+        STATUS_FIELD: str(start_message["status"]).encode(),
+        BODY_FIELD: body,
+        STORED_AT_FIELD: str(time.time()).encode(),
+    }
+    for name, value in with_validators(start_message["headers"], etag_for(body), policy):
+        if name not in SKIPPED_HEADERS:
+            entry[HEADER_PREFIX + name] = value
+    # Compressing a large feed takes long enough to stall the event loop
+    entry.update(await asyncio.to_thread(compress_variants, body))
+    return entry
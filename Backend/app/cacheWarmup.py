@@ -0,0 +1,88 @@
+from fastapi import FastAPI
+from urllib.parse import urlsplit
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Warm-up runs each path through the full app, cache middleware included, so
+# the entries it leaves behind are exactly what real requests will hit.
+# CACHE_WARM_PAGES pages of each paginated list are warmed, plus any paths in
+# CACHE_WARM_PATHS (comma separated). Set CACHE_WARM_PAGES=0 to disable.
+CACHE_WARM_PAGES = int(os.getenv("CACHE_WARM_PAGES", 3))
+CACHE_WARM_PATHS = [path.strip() for path in os.getenv("CACHE_WARM_PATHS", "").split(",") if path.strip()]
+CACHE_WARM_PAGINATED = ["/api/courses?page={page}", "/api/professors?page={page}"]
+# The feed pages by cursor, so only its first page has a known URL
+CACHE_WARM_FIRST_PAGES = ["/api/posts"]
+# Cache keys don't depend on the host, any will do
+CACHE_WARM_BASE_URL = "http://localhost"
+CACHE_WARM_CONCURRENCY = 4
+
+
+def warm_paths():
+    if CACHE_WARM_PAGES <= 0:
+        return CACHE_WARM_PATHS
+    paths = [path.format(page=page) for path in CACHE_WARM_PAGINATED for page in range(CACHE_WARM_PAGES)]
+    return paths + CACHE_WARM_FIRST_PAGES + CACHE_WARM_PATHS
+
+
+def request_scope(url: str, headers=None) -> dict:
+    """Minimal ASGI scope for an in-process GET of url."""
+    parts = urlsplit(url)
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": parts.scheme,
+        "server": (parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)),
+        "client": ("127.0.0.1", 0),
+        "root_path": "",
+        "path": parts.path,
+        "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(),
+        "headers": [(b"host", parts.netloc.encode())] + list(headers or []),
+    }
+
+
+async def fetch_status(app: FastAPI, url: str) -> int:
+    status = 0
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(request_scope(url), receive, send)
+    return status
+
+
+async def warm_cache(app: FastAPI):
+    """Precompute the hottest pages so a new instance doesn't start cold."""
+    paths = warm_paths()
+    if not app.state.redis or not paths:
+        return
+    semaphore = asyncio.Semaphore(CACHE_WARM_CONCURRENCY)
+
+    async def warm(path):
+        async with semaphore:
+            try:
+                return await fetch_status(app, CACHE_WARM_BASE_URL.rstrip("/") + path)
+            except Exception as e:
+                logger.error(f"Cache warm-up of {path} failed: {e}")
+                return None
+
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    statuses = await asyncio.gather(*[warm(path) for path in paths])
+    warmed = sum(1 for status in statuses if status == 200)
+    logger.info(f"Cache warm-up: {warmed}/{len(paths)} paths in {loop.time() - started_at:.2f}s")
@@ -0,0 +1,286 @@
+"""Invalidate cached responses and documents from MongoDB change streams.
+
+Routes invalidate what they write themselves, but writes that bypass them
+(fix_likes.py, the course scraper, edits in the mongo shell, another service)
+would otherwise stay stale until their entries expire. With
+CACHE_CHANGE_STREAMS=true one worker at a time, elected through Redis, follows
+the change stream of the watched collections and turns every change into the
+same tag and document invalidations a route would make. Search responses are
+tagged with the list:* tags, so this also keeps search results current.
+
+The resume token is stored in MongoDB so a restart carries on where the last
+consumer stopped. If the oplog has moved past it, everything cached is
+dropped and the stream starts over from now.
+
+Change streams need a replica set. To try it locally, run a single-node one:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+
+then start the API with MONGO_URI=mongodb://localhost:27017/?replicaSet=rs0,
+USE_REDIS=true and CACHE_CHANGE_STREAMS=true, and edit a document from mongosh.
+tests/test_change_streams.py does the same against TEST_REPLICA_SET_URI.
+
+A delete event carries only the document's _id, so a deleted comment or
+professor review wouldn't say which post or professor to invalidate. The
+consumer turns on pre-images for those collections (MongoDB 6.0+) and reads
+the deleted document from them.
+"""
+from fastapi import FastAPI
+from bson import Binary
+from bson.binary import UUID_SUBTYPE
+from pymongo.errors import OperationFailure
+from app.db import db
+from app.cache import (
+    CACHE_NAMESPACE, RESPONSE_PREFIX, ENTITY_PREFIX,
+    invalidate_tags, forget_entities, delete_matching,
+)
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+from app.models.professor import ProfessorModel, ProfessorReviewModel
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAMS_ENABLED = os.getenv("CACHE_CHANGE_STREAMS", "false").lower() == "true"
+
+STREAM_NAME = "cache"
+tokens_collection = db["change_stream_tokens"]
+# The token is saved at most this often; replaying a second of changes is harmless
+TOKEN_SAVE_INTERVAL = 1.0
+
+# Only one worker across all instances consumes the stream
+LEADER_KEY = f"{CACHE_NAMESPACE}change-streams:leader"
+LEADER_TTL_MS = 15000
+LEADER_RENEW_INTERVAL = 5.0
+# Renew or release the lock only while this worker still holds it
+LEADER_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+LEADER_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# The resume token no longer exists in the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL = 280
+INVALID_RESUME_TOKEN = 260
+RESUME_FAILURES = (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL, INVALID_RESUME_TOKEN)
+# $changeStream on a standalone server
+NOT_A_REPLICA_SET = 40573
+NAMESPACE_NOT_FOUND = 26
+
+
+# Fields whose changes no cached response depends on
+IGNORED_FIELDS = {
+    PostModel: {"views", "views_batch"},
+}
+
+WATCHED_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+
+def document_id(value):
+    # Motor's default codec leaves UUIDs as Binary subtype 4
+    if isinstance(value, Binary) and value.subtype == UUID_SUBTYPE:
+        return value.as_uuid()
+    return value
+
+
+def post_invalidations(doc_id, document):
+    return [f"post:{doc_id}", "list:posts"], (PostModel, doc_id)
+
+def post_comment_invalidations(doc_id, document):
+    if document and document.get("post_id") is not None:
+        return [f"post:{document['post_id']}"], None
+    logger.warning(f"No pre-image for comment {doc_id}, its post's cached comments stay until they expire")
+    return [], None
+
+def course_invalidations(doc_id, document):
+    return [f"course:{doc_id}", "list:courses"], (CourseModel, doc_id)
+
+def professor_invalidations(doc_id, document):
+    return [f"professor:{doc_id}", "list:professors"], (ProfessorModel, doc_id)
+
+def professor_review_invalidations(doc_id, document):
+    if document and document.get("professor_id") is not None:
+        return [f"professor:{document_id(document['professor_id'])}"], None
+    logger.warning(f"No pre-image for professor review {doc_id}, its professor's cached pages stay until they expire")
+    return [], None
+
+# model -> function(document id, full document) -> (tags, (model, id) or None)
+INVALIDATORS = {
+    PostModel: post_invalidations,
+    PostCommentModel: post_comment_invalidations,
+    CourseModel: course_invalidations,
+    ProfessorModel: professor_invalidations,
+    ProfessorReviewModel: professor_review_invalidations,
+}
+
+# Invalidators that need the deleted document, read from its pre-image
+PRE_IMAGE_MODELS = (PostCommentModel, ProfessorReviewModel)
+
+def watched_collections() -> dict:
+    """Collection name -> model; beanie only knows the names after init_beanie."""
+    return {model.get_collection_name(): model for model in INVALIDATORS}
+
+
+def invalidations_for(change: dict):
+    """Map a change event to the tags and cached document it makes stale."""
+    model = watched_collections().get(change["ns"]["coll"])
+    if model is None:
+        return [], None
+    if change["operationType"] == "update":
+        description = change.get("updateDescription", {})
+        changed = set(description.get("updatedFields", {})) | set(description.get("removedFields", []))
+        changed = {field.split(".")[0] for field in changed}
+        if changed and changed <= IGNORED_FIELDS.get(model, set()):
+            return [], None
+    doc_id = document_id(change["documentKey"]["_id"])
+    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+    return INVALIDATORS[model](doc_id, document)
+
+
+async def apply_change(app: FastAPI, change: dict):
+    tags, entity = invalidations_for(change)
+    if entity:
+        model, doc_id = entity
+        await forget_entities(app, model, [doc_id])
+    if tags:
+        await invalidate_tags(app, *tags)
+
+
+async def load_resume_token():
+    saved = await tokens_collection.find_one({"_id": STREAM_NAME})
+    return saved["token"] if saved else None
+
+async def save_resume_token(token):
+    if token is not None:
+        await tokens_collection.update_one({"_id": STREAM_NAME}, {"$set": {"token": token}}, upsert=True)
+
+
+async def enable_pre_images() -> bool:
+    """Record pre-images for PRE_IMAGE_MODELS; False if the server can't."""
+    options = {"changeStreamPreAndPostImages": {"enabled": True}}
+    try:
+        for model in PRE_IMAGE_MODELS:
+            try:
+                await db.command("collMod", model.get_collection_name(), **options)
+            except OperationFailure as e:
+                if e.code != NAMESPACE_NOT_FOUND:
+                    raise
+                # Nothing written to it yet
+                await db.create_collection(model.get_collection_name(), **options)
+    except OperationFailure as e:
+        logger.warning(f"Change stream pre-images unavailable ({e}), deleted comments and reviews won't be invalidated")
+        return False
+    return True
+
+
+async def acquire_leadership(app: FastAPI, owner: str) -> bool:
+    try:
+        return bool(await app.state.redis.set(LEADER_KEY, owner, nx=True, px=LEADER_TTL_MS))
+    except Exception as e:
+        logger.warning(f"Change stream leader election failed: {e}")
+        return False
+
+async def keep_leadership(app: FastAPI, owner: str):
+    """Renew the leader lock; returns once it's lost so the consumer stops."""
+    while True:
+        await asyncio.sleep(LEADER_RENEW_INTERVAL)
+        try:
+            renewed = await app.state.redis.eval(LEADER_RENEW_SCRIPT, 1, LEADER_KEY, owner, LEADER_TTL_MS)
+        except Exception as e:
+            logger.warning(f"Failed to renew change stream leadership: {e}")
+            return
+        if not renewed:
+            logger.warning("Lost change stream leadership")
+            return
+
+async def release_leadership(app: FastAPI, owner: str):
+    try:
+        await app.state.redis.eval(LEADER_RELEASE_SCRIPT, 1, LEADER_KEY, owner)
+    except Exception as e:
+        logger.warning(f"Failed to release change stream leadership: {e}")
+
+
+async def consume_changes(app: FastAPI):
+    """Apply changes from the stream until cancelled or the stream fails."""
+    token = await load_resume_token()
+    saved_token, saved_at = token, time.monotonic()
+    collections = list(watched_collections())
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": collections},
+        "operationType": {"$in": WATCHED_OPERATIONS},
+    }}]
+    before_change = "whenAvailable" if await enable_pre_images() else None
+    try:
+        async with db.watch(
+            pipeline, full_document="updateLookup", full_document_before_change=before_change, resume_after=token,
+        ) as stream:
+            logger.info(f"Following changes to {', '.join(collections)}" + (" from saved token" if token else ""))
+            async for change in stream:
+                await apply_change(app, change)
+                token = stream.resume_token
+                if time.monotonic() - saved_at >= TOKEN_SAVE_INTERVAL:
+                    await save_resume_token(token)
+                    saved_token, saved_at = token, time.monotonic()
+    finally:
+        if token is not saved_token:
+            try:
+                await save_resume_token(token)
+            except Exception as e:
+                logger.error(f"Failed to save change stream resume token: {e}")
+
+
+async def restart_from_now(app: FastAPI):
+    """The saved token is gone from the oplog: whatever changed since is unknown."""
+    logger.warning("Change stream history lost, dropping every cached response and document")
+    await tokens_collection.delete_one({"_id": STREAM_NAME})
+    await delete_matching(app, f"{RESPONSE_PREFIX}*")
+    await delete_matching(app, f"{ENTITY_PREFIX}*")
+
+
+async def follow_changes(app: FastAPI):
+    """Background task: consume the change stream while this worker is leader."""
+    owner = uuid.uuid4().hex
+    while True:
+        if not await acquire_leadership(app, owner):
+            await asyncio.sleep(LEADER_RENEW_INTERVAL)
+            continue
+        consumer = asyncio.create_task(consume_changes(app))
+        watchdog = asyncio.create_task(keep_leadership(app, owner))
+        try:
+            await asyncio.wait([consumer, watchdog], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (consumer, watchdog):
+                task.cancel()
+            await asyncio.gather(consumer, watchdog, return_exceptions=True)
+            await release_leadership(app, owner)
+
+        if consumer.cancelled():
+            # Leadership lost; whoever holds it now resumes from the saved token
+            continue
+        error = consumer.exception()
+        code = error.code if isinstance(error, OperationFailure) else None
+        if code == NOT_A_REPLICA_SET:
+            logger.error("Change streams need a replica set, cache invalidation from MongoDB disabled")
+            return
+        try:
+            if code in RESUME_FAILURES:
+                await restart_from_now(app)
+                continue
+        except Exception as e:
+            error = e
+        if error:
+            logger.error(f"Change stream failed: {error}, restarting")
+        await asyncio.sleep(LEADER_RENEW_INTERVAL)
@@ -0,0 +1,163 @@
+"""Comments stored one document each in PostCommentModel.
+
+Comments used to be embedded in PostModel.comments with replies nested in
+their parents, so every comment write rewrote the whole post and popular
+threads grew toward the 16MB document limit. Posts move over one at a time
+(see migrateComments.py); a post's comments_migrated flag says which store
+holds its thread, and the routes use whichever that is.
+
+A comment's path is its parent's path plus a segment of its own: its creation
+time in milliseconds and the start of its id, both fixed-width hex. Sorting
+by (post_id, path) lists a thread depth-first with siblings oldest first, the
+order the embedded arrays had, and a comment's replies are the paths it
+prefixes.
+"""
+from fastapi import FastAPI
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID
+from app.models.posts import PostModel, PostCommentModel, CommentModel, ReportDetail
+from app.cache import forget_entities
+from app.likes import liked_by, like_update
+import re
+
+PATH_SEPARATOR = "/"
+
+
+def as_uuid(value) -> UUID:
+    # Raw documents hold UUIDs as Binary subtype 4
+    if isinstance(value, Binary):
+        return value.as_uuid()
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+def path_segment(comment_id, created_at: datetime) -> str:
+    if created_at.tzinfo is None:
+        # MongoDB hands datetimes back naive, in UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    millis = int(created_at.timestamp() * 1000)
+    return f"{millis:012x}{as_uuid(comment_id).hex[:8]}"
+
+def child_path(parent_path: Optional[str], comment_id, created_at: datetime) -> str:
+    segment = path_segment(comment_id, created_at)
+    return f"{parent_path}{PATH_SEPARATOR}{segment}" if parent_path else segment
+
+def subtree_filter(post_id, path: str) -> dict:
+    """A comment and all its replies; an anchored prefix regex can use the index."""
+    return {"post_id": post_id, "path": {"$regex": f"^{re.escape(path)}"}}
+
+
+def comment_response(comment, replies: list) -> dict:
+    """The shape /posts/{id}/comments has always returned for a comment."""
+    return {
+        "id": comment.id,
+        "content": comment.content,
+        "author_id": comment.author_id,
+        "author_name": comment.author_name,
+        "created_at": comment.created_at,
+        "parent_id": comment.parent_id,
+        "likes": [str(like) for like in comment.likes] if comment.likes else [],
+        "likes_count": len(comment.likes) if comment.likes else 0,
+        "replies": replies,
+    }
+
+
+async def comments_migrated(post_id) -> Optional[bool]:
+    """Whether a post's comments are in PostCommentModel; None if there's no such post."""
+    if not ObjectId.is_valid(str(post_id)):
+        return None
+    post = await PostModel.get_motor_collection().find_one({"_id": ObjectId(str(post_id))}, {"comments_migrated": 1})
+    return None if post is None else post.get("comments_migrated", False)
+
+async def save_embedded_comments(app: FastAPI, post: PostModel) -> bool:
+    """Write back the edited comment tree of a post that hasn't been migrated.
+
+    Returns False if the migration took the post over since it was loaded;
+    saving then would bring back the comments it moved out.
+    """
+    result = await PostModel.find_one(PostModel.id == post.id, PostModel.comments_migrated != True).update(
+        {"$set": {PostModel.comments: post.comments}}
+    )
+    await forget_entities(app, PostModel, [post.id])
+    return result.matched_count > 0
+
+async def count_comments(post_id, delta: int):
+    # Posts backfillCounters hasn't reached yet have no count to adjust
+    await PostModel.get_motor_collection().update_one(
+        {"_id": post_id, "comment_count": {"$type": "number"}}, {"$inc": {"comment_count": delta}}
+    )
+
+
+def stored_comment_filter(post_id, comment_id: UUID) -> dict:
+    return {"_id": Binary.from_uuid(comment_id), "post_id": post_id}
+
+async def stored_comment_exists(post_id, comment_id: UUID) -> bool:
+    found = await PostCommentModel.get_motor_collection().find_one(stored_comment_filter(post_id, comment_id), {"_id": 1})
+    return found is not None
+
+async def insert_comment(post_id, comment: CommentModel) -> bool:
+    """Store a new comment on a migrated post; False if its parent isn't there."""
+    parent = None
+    if comment.parent_id:
+        parent = await PostCommentModel.find_one(
+            PostCommentModel.id == comment.parent_id, PostCommentModel.post_id == post_id
+        )
+        if parent is None:
+            return False
+    await PostCommentModel(
+        id=comment.id,
+        post_id=post_id,
+        parent_id=comment.parent_id,
+        path=child_path(parent.path if parent else None, comment.id, comment.created_at),
+        depth=parent.depth + 1 if parent else 0,
+        content=comment.content,
+        author_id=comment.author_id,
+        author_name=comment.author_name,
+        created_at=comment.created_at,
+    ).insert()
+    await PostModel.get_motor_collection().update_one(
+        {"_id": post_id}, {"$inc": {"comment_count": 1}, "$max": {"last_activity_at": comment.created_at}}
+    )
+    return True
+
+async def delete_comment_subtree(post_id, comment_id: UUID) -> bool:
+    """Delete a stored comment with its replies; False if there's no such comment."""
+    collection = PostCommentModel.get_motor_collection()
+    comment = await collection.find_one(stored_comment_filter(post_id, comment_id), {"path": 1})
+    if comment is None:
+        return False
+    result = await collection.delete_many(subtree_filter(post_id, comment["path"]))
+    await count_comments(post_id, -result.deleted_count)
+    return True
+
+async def toggle_stored_comment_like(post_id, comment_id: UUID, user_id: UUID, like: bool) -> Optional[int]:
+    """Like or unlike a stored comment; the new like count, None if nothing matched."""
+    comment = await PostCommentModel.get_motor_collection().find_one_and_update(
+        {**stored_comment_filter(post_id, comment_id), "likes": liked_by(user_id, like)},
+        like_update("", user_id, like),
+        projection={"like_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return comment["like_count"] if comment else None
+
+async def report_stored_comment(post_id, comment_id: UUID, report: ReportDetail) -> bool:
+    """Add a report and flag the comment; False if nothing matched, e.g. reported already."""
+    result = await PostCommentModel.get_motor_collection().update_one(
+        {**stored_comment_filter(post_id, comment_id), "reports.user_id": {"$ne": Binary.from_uuid(report.user_id)}},
+        {
+            "$push": {"reports": {
+                "user_id": Binary.from_uuid(report.user_id),
+                "user_name": report.user_name,
+                "reason": report.reason,
+            }},
+            "$set": {"flagged": True},
+        },
+    )
+    return result.matched_count > 0
+
+async def unflag_stored_comment(post_id, comment_id: UUID) -> bool:
+    result = await PostCommentModel.get_motor_collection().update_one(
+        stored_comment_filter(post_id, comment_id), {"$set": {"flagged": False, "reports": []}}
+    )
+    return result.matched_count > 0
@@ -0,0 +1,194 @@
+"""Comment threads served a bounded piece at a time.
+
+/posts/{id}/comments used to return a post's whole thread, so a popular post
+cost every one of its comments on every request. Now a request returns at
+most `limit` replies under each comment (and `limit` top-level comments), at
+most `depth` levels of them, and never more than MAX_THREAD_COMMENTS in all.
+Each comment says how many direct replies it has; when not all of them were
+returned, its replies_cursor fetches the next ones (with their own replies,
+`depth` levels down), as next_cursor does for the top-level comments.
+
+Siblings come "old" (oldest first, the order threads have always had),
+"new" or "top" (most liked first). A cursor holds the last comment's path
+segment (see commentStore.py) and like count, which both comment stores can
+compare, so paging carries on if the post's comments are migrated meanwhile.
+"""
+from fastapi import HTTPException
+from bson import Binary
+from collections import defaultdict
+from typing import Optional
+from uuid import UUID
+from app.models.posts import PostModel, PostCommentModel
+from app.commentStore import PATH_SEPARATOR, as_uuid, path_segment, comment_response
+import asyncio
+import base64
+import orjson
+
+DEFAULT_THREAD_DEPTH = 3
+MAX_THREAD_DEPTH = 10
+DEFAULT_THREAD_REPLIES = 10
+MAX_THREAD_COMMENTS = 500
+
+OLD = "old"
+NEW = "new"
+TOP = "top"
+
+# Sibling order on the (post_id, parent_id, ...) indexes
+STORED_SORTS = {
+    OLD: [("path", 1)],
+    NEW: [("path", -1)],
+    TOP: [("like_count", -1), ("path", 1)],
+}
+
+
+def encode_thread_cursor(parent_id: Optional[UUID], sort: str, last=None) -> str:
+    """Cursor for the replies to parent_id after last, a (segment, likes) key; None starts over."""
+    segment, likes = last or (None, None)
+    raw = orjson.dumps([parent_id and str(parent_id), sort, segment, likes])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_thread_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parent_id, sort, segment, likes = orjson.loads(base64.urlsafe_b64decode(padded))
+        if sort not in STORED_SORTS:
+            raise ValueError(sort)
+        return UUID(parent_id) if parent_id else None, sort, (segment, likes) if segment else None
+    except (ValueError, TypeError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class StoredThread:
+    """Replies read from PostCommentModel with one index range scan each."""
+
+    def __init__(self, post_id, sort: str):
+        self.post_id = post_id
+        self.sort = sort
+        self.collection = PostCommentModel.get_motor_collection()
+
+    def key(self, comment):
+        return comment.path.rsplit(PATH_SEPARATOR, 1)[-1], comment.like_count
+
+    async def after(self, parent_id: Optional[UUID], last) -> Optional[dict]:
+        """Filter for the replies after last; None if the parent is gone."""
+        if last is None:
+            return {}
+        segment, likes = last
+        if parent_id:
+            parent = await self.collection.find_one({"_id": Binary.from_uuid(parent_id), "post_id": self.post_id}, {"path": 1})
+            if parent is None:
+                return None
+            segment = f"{parent['path']}{PATH_SEPARATOR}{segment}"
+        if self.sort == NEW:
+            return {"path": {"$lt": segment}}
+        if self.sort == TOP:
+            return {"$or": [{"like_count": {"$lt": likes}}, {"like_count": likes, "path": {"$gt": segment}}]}
+        return {"path": {"$gt": segment}}
+
+    def replies_filter(self, parent_id: Optional[UUID]) -> dict:
+        return {"post_id": self.post_id, "parent_id": parent_id and Binary.from_uuid(parent_id)}
+
+    async def page(self, parent_id: Optional[UUID], last, limit: int):
+        """The first limit replies after last, and how many there are after last."""
+        after = await self.after(parent_id, last)
+        if after is None:
+            return [], 0
+        query = {**self.replies_filter(parent_id), **after}
+        total = await self.collection.count_documents(query)
+        return await self.replies(query, limit), total
+
+    async def replies(self, query: dict, limit: int) -> list:
+        return await PostCommentModel.find(query).sort(STORED_SORTS[self.sort]).limit(limit).to_list()
+
+    async def first_replies(self, parent_id: UUID, limit: int) -> list:
+        return await self.replies(self.replies_filter(parent_id), limit)
+
+    async def reply_counts(self, parent_ids: list) -> dict:
+        """How many replies each comment has, counted on the index."""
+        counts = self.collection.aggregate([
+            {"$match": {"post_id": self.post_id, "parent_id": {"$in": [Binary.from_uuid(i) for i in parent_ids]}}},
+            {"$group": {"_id": "$parent_id", "count": {"$sum": 1}}},
+        ])
+        return {as_uuid(group["_id"]): group["count"] async for group in counts}
+
+
+class EmbeddedThread:
+    """Replies of a post whose comments haven't been migrated, from its tree."""
+
+    def __init__(self, post: PostModel, sort: str):
+        self.sort = sort
+        self.children = defaultdict(list)
+
+        def add(parent_id, comments):
+            for comment in comments:
+                self.children[parent_id].append(comment)
+                add(comment.id, comment.replies)
+        add(None, [comment for comment in post.comments if comment.parent_id is None])
+        for siblings in self.children.values():
+            siblings.sort(key=self.rank, reverse=sort == NEW)
+
+    def key(self, comment):
+        return path_segment(comment.id, comment.created_at), len(comment.likes or [])
+
+    def rank(self, comment):
+        segment, likes = self.key(comment)
+        return (-likes, segment) if self.sort == TOP else (segment,)
+
+    def follows(self, comment, last) -> bool:
+        segment, likes = last
+        if self.sort == NEW:
+            return self.key(comment)[0] < segment
+        return self.rank(comment) > ((-likes, segment) if self.sort == TOP else (segment,))
+
+    async def page(self, parent_id: Optional[UUID], last, limit: int):
+        replies = self.children.get(parent_id, [])
+        if last is not None:
+            replies = [reply for reply in replies if self.follows(reply, last)]
+        return replies[:limit], len(replies)
+
+    async def first_replies(self, parent_id: UUID, limit: int) -> list:
+        return self.children.get(parent_id, [])[:limit]
+
+    async def reply_counts(self, parent_ids: list) -> dict:
+        return {parent_id: len(self.children[parent_id]) for parent_id in parent_ids if parent_id in self.children}
+
+
+def continuation(thread, parent_id: Optional[UUID], shown: list, total: int) -> tuple:
+    """The cursor for the replies after shown, and how many those are."""
+    remaining = total - len(shown)
+    cursor = encode_thread_cursor(parent_id, thread.sort, shown and thread.key(shown[-1])) if remaining > 0 else None
+    return cursor, remaining
+
+async def thread_page(thread, parent_id: Optional[UUID], last, depth: int, limit: int) -> dict:
+    """Replies to parent_id (top-level comments for None) after last, depth levels deep.
+
+    The tree is read a level at a time: one count of the level's replies,
+    then the first replies of each comment while the budget lasts.
+    """
+    comments, total = await thread.page(parent_id, last, min(limit, MAX_THREAD_COMMENTS))
+    next_cursor, remaining = continuation(thread, parent_id, comments, total)
+    level = [(comment, comment_response(comment, [])) for comment in comments]
+    page = {"comments": [node for _, node in level], "next_cursor": next_cursor, "remaining": remaining}
+
+    budget = MAX_THREAD_COMMENTS - len(level)
+    while level:
+        depth -= 1
+        counts = await thread.reply_counts([comment.id for comment, _ in level])
+        wanted = []
+        for comment, _ in level:
+            take = min(counts.get(comment.id, 0), limit, budget) if depth > 0 else 0
+            budget -= take
+            wanted.append(take)
+        fetched = iter(await asyncio.gather(*(
+            thread.first_replies(comment.id, take) for (comment, _), take in zip(level, wanted) if take
+        )))
+
+        next_level = []
+        for (comment, node), take in zip(level, wanted):
+            replies = next(fetched) if take else []
+            node["replies"] = [comment_response(reply, []) for reply in replies]
+            node["reply_count"] = counts.get(comment.id, 0)
+            node["replies_cursor"], node["replies_remaining"] = continuation(thread, comment.id, replies, node["reply_count"])
+            next_level.extend(zip(replies, node["replies"]))
+        level = next_level
+    return page
@@ -0,0 +1,182 @@
+"""Targeted updates to comment trees still embedded in PostModel.comments.
+
+Replying to, liking, reporting, unflagging or deleting an embedded comment
+used to load the post, walk the whole tree in Python and save every comment
+back. Each of these is now one update that reaches the comment through
+arrayFilters on the ids of its ancestors, e.g.
+
+    comments.$[a0].replies.$[a1].replies.$[comment].likes
+
+Finding the ancestors without reading the tree is what comment_paths is for:
+it maps every comment id on the post to its ancestors' ids, top-down, and is
+kept in step by the same updates. Posts written before it existed, or whose
+index lost an entry to a concurrent rebuild, get it rebuilt from the tree the
+first time a comment is missing from it.
+
+All of it only applies until the post's comments are migrated
+(see commentStore.py); every filter requires comments_migrated to be unset.
+"""
+from bson import Binary
+from beanie.odm.utils.encoder import Encoder
+from pymongo import ReturnDocument
+from typing import Optional
+from uuid import UUID
+from app.models.posts import PostModel, CommentModel, ReportDetail
+from app.likes import liked_by, like_update, find_by_id
+from app.commentStore import count_comments
+
+
+def unmigrated(post_id) -> dict:
+    return {"_id": post_id, "comments_migrated": {"$ne": True}}
+
+def level_array(depth: int) -> str:
+    """Path of the arrays holding comments `depth` replies deep, for queries."""
+    return "comments" + ".replies" * depth
+
+def comment_target(ancestors: list, comment_id: UUID):
+    """Update path prefix and array filters reaching one comment."""
+    path = "comments" + "".join(f".$[a{i}].replies" for i in range(len(ancestors))) + ".$[comment]."
+    filters = [{f"a{i}.id": ancestor} for i, ancestor in enumerate(ancestors)]
+    return path, filters + [{"comment.id": Binary.from_uuid(comment_id)}]
+
+def replies_target(ancestors: list):
+    """Update path and array filters of the list a comment with these ancestors sits in."""
+    path = "comments" + "".join(f".$[a{i}].replies" for i in range(len(ancestors)))
+    return path, [{f"a{i}.id": ancestor} for i, ancestor in enumerate(ancestors)]
+
+
+def index_tree(comments, ancestors: tuple = ()) -> dict:
+    """comment_paths for a raw embedded tree."""
+    index = {}
+    for comment in comments or []:
+        comment_id = comment["id"]
+        index[str(comment_id.as_uuid() if isinstance(comment_id, Binary) else comment_id)] = list(ancestors)
+        index.update(index_tree(comment.get("replies"), ancestors + (comment_id,)))
+    return index
+
+async def rebuild_comment_index(post_id) -> Optional[dict]:
+    posts = PostModel.get_motor_collection()
+    post = await posts.find_one(unmigrated(post_id), {"comments": 1})
+    if post is None:
+        return None
+    index = index_tree(post.get("comments"))
+    await posts.update_one(unmigrated(post_id), {"$set": {"comment_paths": index}})
+    return index
+
+async def comment_ancestors(post_id, comment_id: UUID) -> Optional[list]:
+    """Ids of an embedded comment's ancestors, top-down; None if there's no such comment."""
+    key = str(comment_id)
+    post = await PostModel.get_motor_collection().find_one(unmigrated(post_id), {f"comment_paths.{key}": 1})
+    if post is None:
+        return None
+    ancestors = (post.get("comment_paths") or {}).get(key)
+    if ancestors is None:
+        index = await rebuild_comment_index(post_id)
+        ancestors = index.get(key) if index is not None else None
+    return ancestors
+
+
+async def push_embedded_comment(post_id, comment: CommentModel) -> bool:
+    """Add a comment or reply; False if the parent comment isn't there."""
+    query = unmigrated(post_id)
+    path, array_filters, ancestors = "comments", None, []
+    if comment.parent_id:
+        parent_ancestors = await comment_ancestors(post_id, comment.parent_id)
+        if parent_ancestors is None:
+            return False
+        path, array_filters = comment_target(parent_ancestors, comment.parent_id)
+        path += "replies"
+        parent = Binary.from_uuid(comment.parent_id)
+        ancestors = parent_ancestors + [parent]
+        # The parent may have been deleted since its ancestors were read
+        query[level_array(len(parent_ancestors)) + ".id"] = parent
+    result = await PostModel.get_motor_collection().update_one(
+        query,
+        {
+            "$push": {path: Encoder().encode(comment)},
+            "$set": {f"comment_paths.{comment.id}": ancestors},
+            "$max": {"last_activity_at": comment.created_at},
+        },
+        array_filters=array_filters,
+    )
+    if not result.matched_count:
+        return False
+    await count_comments(post_id, 1)
+    return True
+
+async def toggle_embedded_comment_like(post_id, comment_id: UUID, user_id: UUID, like: bool) -> Optional[int]:
+    """Like or unlike an embedded comment; the new like count, None if nothing matched."""
+    ancestors = await comment_ancestors(post_id, comment_id)
+    if ancestors is None:
+        return None
+    cid = Binary.from_uuid(comment_id)
+    array = level_array(len(ancestors))
+    path, array_filters = comment_target(ancestors, comment_id)
+    post = await PostModel.get_motor_collection().find_one_and_update(
+        {**unmigrated(post_id), array: {"$elemMatch": {"id": cid, "likes": liked_by(user_id, like)}}},
+        like_update(path, user_id, like),
+        array_filters=array_filters,
+        # Just the ids and counts on that level, to read the new count back
+        projection={f"{array}.id": 1, f"{array}.like_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return find_by_id(post, cid)["like_count"] if post else None
+
+async def report_embedded_comment(post_id, comment_id: UUID, report: ReportDetail) -> bool:
+    """Add a report and flag the comment; False if nothing matched, e.g. reported already."""
+    ancestors = await comment_ancestors(post_id, comment_id)
+    if ancestors is None:
+        return False
+    reporter = Binary.from_uuid(report.user_id)
+    path, array_filters = comment_target(ancestors, comment_id)
+    result = await PostModel.get_motor_collection().update_one(
+        {**unmigrated(post_id), level_array(len(ancestors)): {"$elemMatch": {
+            "id": Binary.from_uuid(comment_id), "reports.user_id": {"$ne": reporter},
+        }}},
+        {"$push": {f"{path}reports": Encoder().encode(report)}, "$set": {f"{path}flagged": True}},
+        array_filters=array_filters,
+    )
+    return result.matched_count > 0
+
+async def unflag_embedded_comment(post_id, comment_id: UUID) -> bool:
+    ancestors = await comment_ancestors(post_id, comment_id)
+    if ancestors is None:
+        return False
+    path, array_filters = comment_target(ancestors, comment_id)
+    result = await PostModel.get_motor_collection().update_one(
+        {**unmigrated(post_id), level_array(len(ancestors)) + ".id": Binary.from_uuid(comment_id)},
+        {"$set": {f"{path}flagged": False, f"{path}reports": []}},
+        array_filters=array_filters,
+    )
+    return result.matched_count > 0
+
+async def pull_embedded_comment(post_id, comment_id: UUID) -> bool:
+    """Delete a comment with its replies; False if there's no such comment."""
+    ancestors = await comment_ancestors(post_id, comment_id)
+    if ancestors is None:
+        return False
+    posts = PostModel.get_motor_collection()
+    cid = Binary.from_uuid(comment_id)
+    # Index entries of the replies go too; only the index is read, not the tree
+    post = await posts.find_one(unmigrated(post_id), {"comment_paths": 1})
+    index = (post or {}).get("comment_paths") or {}
+    removed = [key for key, path in index.items() if cid in path] + [str(comment_id)]
+    path, array_filters = replies_target(ancestors)
+    result = await posts.update_one(
+        {**unmigrated(post_id), level_array(len(ancestors)) + ".id": cid},
+        {"$pull": {path: {"id": cid}}, "$unset": {f"comment_paths.{key}": "" for key in removed}},
+        array_filters=array_filters or None,
+    )
+    if not result.matched_count:
+        return False
+    await count_comments(post_id, -len(removed))
+    return True
+
+async def embedded_comment_exists(post_id, comment_id: UUID) -> bool:
+    ancestors = await comment_ancestors(post_id, comment_id)
+    if ancestors is None:
+        return False
+    found = await PostModel.get_motor_collection().find_one(
+        {**unmigrated(post_id), level_array(len(ancestors)) + ".id": Binary.from_uuid(comment_id)}, {"_id": 1}
+    )
+    return found is not None
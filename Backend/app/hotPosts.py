@@ -0,0 +1,146 @@
+"""Hot posts ranking, kept in a Redis sorted set.
+
+A post's score is the log of its weighted likes, comments and views plus its
+creation time divided by HOT_DECAY_SECONDS, the scheme Reddit used. Every
+HOT_DECAY_SECONDS a post needs ten times the points to rank with one posted
+that much later. Because the time part is fixed at creation, scores never
+need recomputing as posts age: a write to a post re-scores just that post
+with one ZADD, and /api/posts?sort=hot reads a page with ZREVRANGE. Both are
+O(log n).
+
+Only the top HOT_RANKING_SIZE posts are kept; a post that fell off comes back
+with its next like, comment or view. The set is rebuilt from MongoDB when
+it's found empty: on a new cache namespace, after Redis lost its data, or
+once it expired after HOT_RANKING_TTL without writes (which is also how the
+rankings of older namespaces go away).
+"""
+from fastapi import FastAPI, HTTPException
+from bson import ObjectId
+from datetime import datetime, timezone
+from app.cache import CACHE_NAMESPACE
+from app.models.posts import PostModel
+import base64
+import logging
+import math
+import orjson
+import os
+
+logger = logging.getLogger(__name__)
+
+HOT_KEY = f"{CACHE_NAMESPACE}posts:hot"
+HOT_RANKING_SIZE = int(os.getenv("HOT_RANKING_SIZE", 5000))
+HOT_RANKING_TTL = 7 * 24 * 3600
+HOT_DECAY_SECONDS = float(os.getenv("HOT_DECAY_SECONDS", 45000))
+LIKE_WEIGHT = float(os.getenv("HOT_LIKE_WEIGHT", 1))
+COMMENT_WEIGHT = float(os.getenv("HOT_COMMENT_WEIGHT", 2))
+VIEW_WEIGHT = float(os.getenv("HOT_VIEW_WEIGHT", 0.05))
+
+# What a score is computed from
+SCORE_FIELDS = {"like_count": 1, "comment_count": 1, "views": 1, "created_at": 1}
+REBUILD_BATCH = 1000
+
+
+def hot_score(post: dict) -> float:
+    points = (
+        (post.get("like_count") or 0) * LIKE_WEIGHT
+        + (post.get("comment_count") or 0) * COMMENT_WEIGHT
+        + (post.get("views") or 0) * VIEW_WEIGHT
+    )
+    created_at = post.get("created_at") or datetime.now(timezone.utc)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return math.log10(max(points, 1)) + created_at.timestamp() / HOT_DECAY_SECONDS
+
+
+def encode_hot_cursor(post_id: str, score: float) -> str:
+    raw = orjson.dumps([post_id, score])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_hot_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        post_id, score = orjson.loads(base64.urlsafe_b64decode(padded))
+        return str(post_id), float(score)
+    except (ValueError, TypeError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def rescore_posts(app: FastAPI, post_ids):
+    """Recompute the scores of posts whose counters just changed."""
+    if not app.state.redis:
+        return
+    ids = [ObjectId(str(post_id)) for post_id in post_ids if ObjectId.is_valid(str(post_id))]
+    if not ids:
+        return
+    try:
+        posts = await PostModel.get_motor_collection().find({"_id": {"$in": ids}}, SCORE_FIELDS).to_list(None)
+        scores = {str(post["_id"]): hot_score(post) for post in posts}
+        deleted = [str(post_id) for post_id in ids if str(post_id) not in scores]
+        pipe = app.state.redis.pipeline(transaction=False)
+        if scores:
+            pipe.zadd(HOT_KEY, scores)
+        if deleted:
+            pipe.zrem(HOT_KEY, *deleted)
+        pipe.zremrangebyrank(HOT_KEY, 0, -HOT_RANKING_SIZE - 1)
+        pipe.expire(HOT_KEY, HOT_RANKING_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to update hot ranking: {e}")
+
+async def forget_hot_post(app: FastAPI, post_id):
+    if not app.state.redis:
+        return
+    try:
+        await app.state.redis.zrem(HOT_KEY, str(post_id))
+    except Exception as e:
+        logger.error(f"Failed to update hot ranking: {e}")
+
+
+async def hot_page(app: FastAPI, cursor: str, limit: int):
+    """Ids of the next page of hot posts and the cursor after them.
+
+    The cursor is the last post shown and its score. The page continues below
+    that post's current rank, or below its score if it has since dropped out.
+    """
+    redis = app.state.redis
+    start = 0
+    if cursor:
+        post_id, score = decode_hot_cursor(cursor)
+        rank = await redis.zrevrank(HOT_KEY, post_id)
+        if rank is not None:
+            start = rank + 1
+        else:
+            entries = await redis.zrevrangebyscore(
+                HOT_KEY, f"({score}", "-inf", start=0, num=limit + 1, withscores=True
+            )
+            return page_of(entries, limit)
+    entries = await redis.zrevrange(HOT_KEY, start, start + limit, withscores=True)
+    return page_of(entries, limit)
+
+def page_of(entries: list, limit: int):
+    ids = [member.decode() if isinstance(member, bytes) else member for member, _ in entries]
+    if len(entries) <= limit:
+        return ids, None
+    return ids[:limit], encode_hot_cursor(ids[limit - 1], entries[limit - 1][1])
+
+
+async def rebuild_hot_ranking(app: FastAPI, force: bool = False):
+    """Score every post if the ranking is empty (or force); cheap no-op otherwise."""
+    if not app.state.redis:
+        return
+    try:
+        if not force and await app.state.redis.zcard(HOT_KEY):
+            return
+        scores = {}
+        async for post in PostModel.get_motor_collection().find({}, SCORE_FIELDS):
+            scores[str(post["_id"])] = hot_score(post)
+            if len(scores) >= REBUILD_BATCH:
+                await app.state.redis.zadd(HOT_KEY, scores)
+                scores = {}
+        if scores:
+            await app.state.redis.zadd(HOT_KEY, scores)
+        await app.state.redis.zremrangebyrank(HOT_KEY, 0, -HOT_RANKING_SIZE - 1)
+        await app.state.redis.expire(HOT_KEY, HOT_RANKING_TTL)
+        logger.info(f"Rebuilt hot posts ranking, {await app.state.redis.zcard(HOT_KEY)} posts")
+    except Exception as e:
+        logger.error(f"Failed to rebuild hot ranking: {e}")
@@ -0,0 +1,37 @@
+"""Atomic like/unlike updates.
+
+A like is one update whose filter only matches while the user hasn't liked
+the target yet (or, for an unlike, still has), adding or pulling the user and
+moving the denormalized like_count in the same write. Concurrent likes can't
+overwrite each other the way load-modify-save did, and a repeated like
+matches nothing instead of counting twice.
+"""
+from bson import Binary
+from uuid import UUID
+
+
+def liked_by(user_id: UUID, like: bool) -> dict:
+    """Condition on a likes array for a like (not there yet) or an unlike (there)."""
+    uid = Binary.from_uuid(user_id)
+    return {"$ne": uid} if like else uid
+
+def like_update(path: str, user_id: UUID, like: bool) -> dict:
+    """Update for the likes/like_count pair under path, e.g. "reviews.2."."""
+    uid = Binary.from_uuid(user_id)
+    if like:
+        return {"$addToSet": {f"{path}likes": uid}, "$inc": {f"{path}like_count": 1}}
+    return {"$pull": {f"{path}likes": uid}, "$inc": {f"{path}like_count": -1}}
+
+def find_by_id(node, target):
+    """Find the embedded document with id == target in a projected subtree."""
+    if isinstance(node, dict):
+        if node.get("id") == target:
+            return node
+        node = list(node.values())
+    if isinstance(node, list):
+        for child in node:
+            if isinstance(child, (dict, list)):
+                found = find_by_id(child, target)
+                if found is not None:
+                    return found
+    return None
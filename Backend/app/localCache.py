@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from fastapi import FastAPI
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Every worker subscribes here; a message is a newline-separated list of cache
+# keys to drop, or CLEAR_ALL when the sender can't say which keys changed.
+INVALIDATION_CHANNEL = "cache:invalidate"
+CLEAR_ALL = b"*"
+
+
+class LocalCache:
+    """Per-process LRU cache with a TTL per entry and a total byte budget.
+
+    Sits in front of Redis so hot keys skip the network round trip. Entries
+    are kept coherent across workers by the Redis invalidation channel, and
+    their TTL never outlives the Redis copy they came from.
+    """
+
+    def __init__(self, max_bytes: int, max_ttl: float):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, size: int, ttl: float = None):
+        ttl = self.max_ttl if ttl is None else min(ttl, self.max_ttl)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self._remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+async def publish_invalidation(app: FastAPI, keys):
+    """Drop keys from this worker's local cache and tell every other worker to."""
+    keys = [key.decode() if isinstance(key, bytes) else key for key in keys]
+    if not keys:
+        return
+    app.state.local_cache.delete(*keys)
+    if app.state.redis:
+        try:
+            await app.state.redis.publish(INVALIDATION_CHANNEL, "\n".join(keys))
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation: {e}")
+
+
+async def listen_for_invalidations(app: FastAPI):
+    """Apply invalidations published by any worker until cancelled."""
+    while True:
+        pubsub = None
+        try:
+            pubsub = app.state.redis.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            while True:
+                # Polled with a timeout rather than listen(), which would hit
+                # the client's short socket timeout whenever the channel is idle
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None or message["type"] != "message":
+                    continue
+                if message["data"] == CLEAR_ALL:
+                    app.state.local_cache.clear()
+                else:
+                    app.state.local_cache.delete(*message["data"].decode().split("\n"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Anything published while disconnected was missed
+            logger.error(f"Cache invalidation listener failed: {e}, retrying")
+            app.state.local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            if pubsub is not None:
+                await pubsub.close()
@@ -1,15 +1,13 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.db import test_connection, db
-from app.models.posts import PostModel, CommentModel
+from app.models.posts import PostModel, CommentModel, PostCommentModel
 from app.models.user import UserModel
 from app.models.courses import CourseModel, ReviewModel
 from app.models.professor import ProfessorModel, ProfessorReviewModel
+from app.models.moderation import ModerationItemModel
 from app.routes.posts import router as post_router
 from app.routes.courses import router as course_router
 from app.routes.professors import router as professor_router
@@ -17,10 +15,20 @@ from app.routes.cache import router as cache_router
 from app.routes.auth import router as auth_router
 from app.routes.userProfile import router as profile_router
 from app.routes.search import router as search_router
+from app.routes.moderation import router as moderation_router
+from app.cacheMiddleware import StarletteCacheMiddleware
+from app.localCache import LocalCache, listen_for_invalidations
+from app.cache import CACHE_NAMESPACE, resume_cache
+from app.cacheWarmup import warm_cache
+from app.changeStreams import CHANGE_STREAMS_ENABLED, follow_changes
+from app.viewCounter import flush_views_periodically
+from app.hotPosts import rebuild_hot_ranking
+from app.redisClient import CircuitBreakerRedis
 import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
 import os
-import json
-import hashlib
+import asyncio
 from dotenv import load_dotenv
 import logging
 
@@ -32,29 +40,63 @@ load_dotenv()
 
 app = FastAPI()
 app.state.redis = None
+# In-process tier in front of Redis; only used while Redis is connected so the
+# invalidation channel can keep it coherent
+app.state.local_cache = LocalCache(
+    max_bytes=int(os.getenv("LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    max_ttl=float(os.getenv("LOCAL_CACHE_TTL", 30)),
+)
+app.state.invalidation_listener = None
+app.state.change_stream_consumer = None
+app.state.view_flusher = None
 
 async def init_redis():
     if os.getenv("USE_REDIS", "false").lower() == "true":
+        # A slow Redis should cost a short timeout, not the default of none
+        timeout = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.5))
+        # Requests beyond max_connections wait for a free connection; the
+        # default pool raises instead, which the breaker would count as an outage
+        pool = redis.BlockingConnectionPool(
+            host=os.getenv("REDIS_HOST", "redis"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            password=os.getenv("REDIS_PASS", None),
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+            # Waiting on a busy pool says nothing about Redis, so it gets longer
+            timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 5)),
+            # Cached responses are raw bytes, so values are never decoded
+            decode_responses=False,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+            # Failures go straight to the circuit breaker instead of being retried
+            retry=Retry(NoBackoff(), 0),
+        )
+        client = redis.Redis(connection_pool=pool)
+        # Invalidations were missed while disconnected
+        app.state.redis = CircuitBreakerRedis(client, on_reconnect=lambda: resume_cache(app))
         try:
-            app.state.redis = redis.Redis(
-                host=os.getenv("REDIS_HOST", "redis"),
-                port=int(os.getenv("REDIS_PORT", 6379)),
-                password=os.getenv("REDIS_PASS", None),
-                decode_responses=True
-            )
-            await app.state.redis.ping()
-            # clear the cache on startup
-            await app.state.redis.flushdb()
-            logger.info("Redis cache cleared on startup")
-            logger.info("Redis connected successfully")
+            await client.ping()
+            # No flush: the cache is shared by every worker and instance, and
+            # entries from older deploys live in their own namespace
+            logger.info(f"Redis connected successfully, cache namespace {CACHE_NAMESPACE}")
         except Exception as e:
             logger.error(f"Redis connection failed: {e}")
-            app.state.redis = None
+            # Keeps retrying in the background and enables caching once it connects
+            app.state.redis.trip()
+        app.state.invalidation_listener = asyncio.create_task(listen_for_invalidations(app))
 
 async def close_redis():
-    if app.state.redis:
+    if app.state.change_stream_consumer:
+        app.state.change_stream_consumer.cancel()
+        # Lets it save its resume token and release the leader lock
+        await asyncio.gather(app.state.change_stream_consumer, return_exceptions=True)
+    if app.state.invalidation_listener:
+        app.state.invalidation_listener.cancel()
+    if app.state.redis is not None:
         await app.state.redis.close()
 
+# Added before CORS so CORSMiddleware wraps it and also decorates cache hits
+app.add_middleware(StarletteCacheMiddleware)
+
 origins = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -68,91 +110,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class StarletteCacheMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        logger.info(f"Processing request: {request.method} {request.url}")
-        
-        if not app.state.redis:
-            logger.info("Redis not initialized, skipping cache")
-            return await call_next(request)
-
-        # Generate cache key for GET equivalent
-        get_cache_key = hashlib.md5(f"GET:{request.url}".encode()).hexdigest()
-
-        # Invalidate cache for non-GET requests
-        if request.method != "GET":
-            try:
-                await app.state.redis.delete(get_cache_key)
-                logger.info(f"Invalidated cache for GET equivalent: {get_cache_key}")
-            except Exception as e:
-                logger.error(f"Failed to invalidate cache: {e}")
-            response = await call_next(request)
-            logger.info(f"Response headers: {response.headers}")
-            return response
-
-        # Cache logic for GET requests
-        cache_key = hashlib.md5(f"{request.method}:{request.url}".encode()).hexdigest()
-
-        try:
-            cached = await app.state.redis.get(cache_key)
-            if cached:
-                logger.info(f"Cache hit for {cache_key}")
-                cached_data = json.loads(cached)
-                response = JSONResponse(
-                    content=json.loads(cached_data["body"]),
-                    status_code=cached_data["status"]
-                )
-                response.headers.update({
-                    "Access-Control-Allow-Origin": "http://localhost:3000",
-                    "Access-Control-Allow-Credentials": "true",
-                    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                    "Access-Control-Allow-Headers": "*",
-                })
-                logger.info(f"Cache response headers: {response.headers}")
-                return response
-        except Exception as e:
-            logger.error(f"Redis error on get: {e}, proceeding without cache")
-
-        logger.info(f"Cache miss for {cache_key}")
-        response = await call_next(request)
-
-        if response.status_code == 200 and response.headers.get("content-type") == "application/json":
-            body = b"".join([chunk async for chunk in response.body_iterator])
-            response_body = body.decode("utf-8")
-            if response_body:
-                try:
-                    json.loads(response_body)
-                    cache_data = {
-                        "status": response.status_code,
-                        "body": response_body
-                    }
-                    await app.state.redis.setex(cache_key, 3600, json.dumps(cache_data))
-                    logger.info(f"Cached response for {cache_key}")
-                    response = JSONResponse(content=json.loads(response_body), status_code=200)
-                    response.headers.update({
-                        "Access-Control-Allow-Origin": "http://localhost:3000",
-                        "Access-Control-Allow-Credentials": "true",
-                        "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                        "Access-Control-Allow-Headers": "*",
-                    })
-                except json.JSONDecodeError:
-                    logger.warning(f"Invalid JSON response for {cache_key}, not caching")
-            else:
-                logger.info(f"Empty response body for {cache_key}, not caching")
-        
-        logger.info(f"Final response headers: {response.headers}")
-        return response
-app.add_middleware(StarletteCacheMiddleware)
 
 app.include_router(auth_router, prefix="/auth")
 
 async def init_db():
     await init_beanie(db, document_models=[
         PostModel,
+        PostCommentModel,
         UserModel,
         CourseModel,
         ProfessorModel,
-        ProfessorReviewModel
+        ProfessorReviewModel,
+        ModerationItemModel,
     ])
 
 @app.on_event("startup")
@@ -160,9 +129,22 @@ async def startup():
     await test_connection()
     await init_db()
     await init_redis()
+    # Only scores every post when the ranking is missing from Redis
+    await rebuild_hot_ranking(app)
+    app.state.view_flusher = asyncio.create_task(flush_views_periodically(app))
+    # Invalidations for writes that bypass the API; only useful with a cache
+    if CHANGE_STREAMS_ENABLED and app.state.redis is not None:
+        app.state.change_stream_consumer = asyncio.create_task(follow_changes(app))
+    # Startup only completes, and the instance starts taking traffic, once
+    # the hottest pages are cached
+    await warm_cache(app)
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if app.state.view_flusher:
+        app.state.view_flusher.cancel()
+        # Writes out the views still pending, while Redis is open
+        await asyncio.gather(app.state.view_flusher, return_exceptions=True)
     await close_redis()
 
 app.include_router(post_router, prefix="/api", tags=["Posts"])
@@ -171,6 +153,7 @@ app.include_router(professor_router, prefix="/api", tags=["Professors"])
 app.include_router(cache_router, prefix="/api/cache", tags=["Cache"])
 app.include_router(profile_router, prefix="/api")
 app.include_router(search_router)
+app.include_router(moderation_router, prefix="/api", tags=["Moderation"])
 
 @app.get("/")
 async def root():
@@ -0,0 +1,105 @@
+"""Move embedded comment trees out of PostModel.comments into PostCommentModel.
+
+    python -m app.migrateComments
+
+Posts are migrated one at a time, and each is switched over on its own: its
+comments are copied, then a single update empties the embedded array, sets
+comment_count and flips comments_migrated, but only if the array is still
+exactly what was copied. A comment written meanwhile makes that update miss
+and the post is copied again, so nothing is lost and the API keeps serving
+both kinds of post throughout. Copies are upserts keyed by comment id, so an
+interrupted run is simply started again and carries on with the posts that
+haven't been switched.
+
+Best run while writes are quiet: a thread that keeps changing is retried
+until it holds still for the length of one copy.
+"""
+from bson import Binary
+from datetime import datetime, timezone
+from pymongo import ReplaceOne
+from app.main import app, init_db, init_redis, close_redis
+from app.models.posts import PostModel, PostCommentModel
+from app.commentStore import as_uuid, child_path
+from app.cache import forget_entities, invalidate_tags
+import asyncio
+
+
+def comment_documents(post_id, comments: list, parent=None) -> list:
+    """Raw PostCommentModel documents for an embedded tree, parents first."""
+    documents = []
+    for comment in comments or []:
+        created_at = comment.get("created_at") or datetime.now(timezone.utc)
+        likes = comment.get("likes") or []
+        document = {
+            "_id": Binary.from_uuid(as_uuid(comment["id"])),
+            "post_id": post_id,
+            # Taken from where the comment sits; the stored parent_id isn't always set
+            "parent_id": parent["_id"] if parent else None,
+            "path": child_path(parent["path"] if parent else None, comment["id"], created_at),
+            "depth": parent["depth"] + 1 if parent else 0,
+            "content": comment.get("content", ""),
+            "author_id": comment.get("author_id"),
+            "author_name": comment.get("author_name", ""),
+            "created_at": created_at,
+            "likes": likes,
+            "like_count": len(likes),
+            "reports": comment.get("reports") or [],
+            "flagged": comment.get("flagged", False),
+        }
+        documents.append(document)
+        documents.extend(comment_documents(post_id, comment.get("replies"), document))
+    return documents
+
+
+async def migrate_post(post_id) -> int:
+    """Switch one post over; the number of comments moved, -1 if there was nothing to do."""
+    posts = PostModel.get_motor_collection()
+    stored = PostCommentModel.get_motor_collection()
+    while True:
+        post = await posts.find_one({"_id": post_id}, {"comments": 1, "comments_migrated": 1})
+        if post is None or post.get("comments_migrated"):
+            return -1
+        documents = comment_documents(post_id, post.get("comments"))
+        if documents:
+            await stored.bulk_write(
+                [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents],
+                ordered=False,
+            )
+        # Copies from an earlier attempt of comments deleted since
+        await stored.delete_many({"post_id": post_id, "_id": {"$nin": [document["_id"] for document in documents]}})
+
+        unchanged = {"comments": post["comments"]} if "comments" in post else {"comments": {"$exists": False}}
+        result = await posts.update_one(
+            {"_id": post_id, "comments_migrated": {"$ne": True}, **unchanged},
+            {
+                "$set": {"comments": [], "comments_migrated": True, "comment_count": len(documents)},
+                "$unset": {"comment_paths": ""},
+            },
+        )
+        if result.modified_count:
+            return len(documents)
+        print(f"Comments on {post_id} changed while copying, retrying")
+
+
+async def migrate_comments():
+    await init_db()
+    # Cached copies of the posts still hold their embedded comments
+    await init_redis()
+    try:
+        pending = PostModel.get_motor_collection().find({"comments_migrated": {"$ne": True}}, {"_id": 1})
+        migrated = moved = 0
+        async for post in pending:
+            count = await migrate_post(post["_id"])
+            if count < 0:
+                continue
+            await forget_entities(app, PostModel, [post["_id"]])
+            await invalidate_tags(app, f"post:{post['_id']}", "list:posts")
+            migrated += 1
+            moved += count
+        print(f"Moved {moved} comments out of {migrated} posts")
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate_comments())
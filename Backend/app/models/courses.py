@@ -23,6 +23,7 @@ class ReviewModel(BaseModel):
     ratings: OverallRatingModel = Field(default_factory=OverallRatingModel)
     created_at: datetime = Field(default_factory=datetime.now)
     likes: List[UUID] = Field(default_factory=list)  # Store user IDs
+    like_count: int = Field(default=0)  # len(likes), kept in step by the like routes
     reports: List[ReportDetail] = Field(default_factory=list)  # Add reports field
     flagged: bool = Field(default=False)  # stays False until report threshold met
 
@@ -0,0 +1,43 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from typing import Literal, Optional
+from datetime import datetime, timezone
+
+TargetType = Literal["post", "comment", "course_review", "professor_review"]
+
+
+class ModerationItemModel(Document):
+    """Reported content waiting for an admin, or already dealt with."""
+    target_type: TargetType
+    # Post id, comment id, professor review id, or course id and review timestamp
+    target_id: str
+    # Post of a comment, course or professor of a review
+    parent_id: Optional[str] = None
+    status: Literal["open", "resolved"] = "open"
+    flagged_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    last_reported_at: Optional[datetime] = None
+    report_count: int = 0
+    resolved_at: Optional[datetime] = None
+    resolution: Optional[str] = None  # "dismissed", "removed", or "gone" if deleted elsewhere
+
+    class Settings:
+        name = "moderation_queue"
+        indexes = [
+            # The queue, newest reports first
+            IndexModel([("status", ASCENDING), ("flagged_at", DESCENDING), ("_id", DESCENDING)], name="status_flagged_at"),
+            # One tab of the admin page
+            IndexModel(
+                [("target_type", ASCENDING), ("status", ASCENDING), ("flagged_at", DESCENDING), ("_id", DESCENDING)],
+                name="target_type_status_flagged_at",
+            ),
+            # At most one open item per target; resolved ones stay as history
+            IndexModel(
+                [("target_type", ASCENDING), ("target_id", ASCENDING)],
+                name="open_target",
+                unique=True,
+                partialFilterExpression={"status": "open"},
+            ),
+            # Comments of a deleted post
+            IndexModel([("parent_id", ASCENDING), ("status", ASCENDING)], name="parent_id_status"),
+        ]
@@ -1,8 +1,9 @@
-from beanie import Document
+from beanie import Document, PydanticObjectId
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
 from uuid import UUID, uuid4
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 class ReportDetail(BaseModel):
     user_id: UUID
@@ -18,6 +19,7 @@ class CommentModel(BaseModel):
     parent_id: Optional[UUID] = None  # Changed to UUID
     replies: Optional[List["CommentModel"]] = Field(default_factory=list) 
     likes: List[UUID] = Field(default_factory=list)  # ✅ Added likes field
+    like_count: int = Field(default=0)  # len(likes), kept in step by the like routes
     reports: List[ReportDetail] = Field(default_factory=list)  # ✅ Added reports field
     flagged: bool = Field(default=False)  # stays False until report threshold met
 
@@ -29,12 +31,64 @@ class PostModel(Document):
     content: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     comments: Optional[List[CommentModel]] = Field(default_factory=list)  # Comments stored here
+    comment_paths: Dict[str, List[UUID]] = Field(default_factory=dict)  # comment id -> ancestor ids, top-down
     likes: List[UUID] = Field(default_factory=list)  # Store user IDs
+    like_count: int = Field(default=0)  # len(likes), kept in step by the like routes
     author_id: Optional[UUID] = None  # Add author_id field
     views: int = Field(default=0)  # Add views counter
+    views_batch: Optional[str] = None  # the last view flush in views, see viewCounter.py
     author: Optional[str] = ""
     reports: List[ReportDetail] = Field(default_factory=list)  # Add reports field
     flagged: bool = Field(default=False)  # stays False until report threshold met
+    comments_migrated: bool = Field(default=False)  # comments live in PostCommentModel, not in comments
+    comment_count: Optional[int] = None  # None until backfillCounters has counted the embedded tree
+    last_activity_at: Optional[datetime] = None  # latest of created_at, likes and comments
 
     class Settings:
         collection = "posts"
+        indexes = [
+            # Keyset pagination of the feed, newest first
+            IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+            # A user's posts on their profile, the same way
+            IndexModel(
+                [("author_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                name="author_id_created_at_id",
+            ),
+        ]
+
+
+class PostCommentModel(Document):
+    """A comment or reply stored on its own, replacing PostModel.comments."""
+    id: UUID = Field(default_factory=uuid4)
+    post_id: PydanticObjectId
+    parent_id: Optional[UUID] = None
+    # One fixed-width segment per ancestor and one for the comment, oldest
+    # first: sorting by path lists a thread depth-first, a subtree is a prefix
+    path: str
+    depth: int = Field(default=0)  # 0 for top-level comments
+    content: str
+    author_id: UUID
+    author_name: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    likes: List[UUID] = Field(default_factory=list)
+    like_count: int = Field(default=0)
+    reports: List[ReportDetail] = Field(default_factory=list)
+    flagged: bool = Field(default=False)
+
+    class Settings:
+        name = "comments"
+        indexes = [
+            # A post's thread in display order
+            IndexModel([("post_id", ASCENDING), ("path", ASCENDING)], name="post_id_path", unique=True),
+            # A comment's replies, oldest or newest first, and counting them
+            IndexModel(
+                [("post_id", ASCENDING), ("parent_id", ASCENDING), ("path", ASCENDING)],
+                name="post_id_parent_id_path",
+            ),
+            # A comment's replies, most liked first
+            IndexModel(
+                [("post_id", ASCENDING), ("parent_id", ASCENDING), ("like_count", DESCENDING), ("path", ASCENDING)],
+                name="post_id_parent_id_like_count_path",
+            ),
+            IndexModel([("author_id", ASCENDING)], name="author_id"),
+        ]
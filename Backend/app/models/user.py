@@ -12,6 +12,6 @@ class UserModel(Document):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     comments: List[UUID] = Field(default_factory=list)  # Only store Comment IDs
     bio: Optional[str] = Field(default=None)
-    posts: List[str] = Field(default_factory=list)  # Store post IDs, defaults to empty list
+    posts: List[str] = Field(default_factory=list)  # Post ids; profiles query PostModel.author_id instead
     is_uoft: bool = Field(default=False)
     is_admin: bool = Field(default=False)
\ No newline at end of file
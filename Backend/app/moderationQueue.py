@@ -0,0 +1,108 @@
+"""The moderation queue: one document per reported item, in ModerationItemModel.
+
+Flagged content used to be found by scanning for it: every post with its
+whole comment tree, every course with all its reviews. Now the report routes
+open a queue item for what they flag (or add to the one already open), and
+the unflag and delete routes resolve it. The admin views page through the
+open items on the (status, flagged_at) indexes and load just the content
+those items point to, so they cost O(flagged items) however big the site is.
+
+Content deleted some other way (a post deleted with its comments, a review
+deleted by its author) leaves its item open until a listing finds the target
+gone and resolves it as "gone".
+
+The listings are cached per role and tagged MODERATION_QUEUE_TAG, which
+every change to the queue made here invalidates.
+
+Course reviews have no id and are addressed by position, which shifts when
+an earlier review is deleted. Their items are keyed by course id and the
+review's creation time instead, and the listing looks up the current index.
+"""
+from fastapi import FastAPI
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone
+from typing import Optional
+from app.models.moderation import ModerationItemModel
+from app.pagination import after_cursor, next_cursor
+from app.cache import invalidate_tags
+
+POST = "post"
+COMMENT = "comment"
+COURSE_REVIEW = "course_review"
+PROFESSOR_REVIEW = "professor_review"
+
+OPEN = "open"
+RESOLVED = "resolved"
+
+# Shown on every listing of the queue
+MODERATION_QUEUE_TAG = "list:moderation-queue"
+
+# Newest reports first, matching the indexes
+NEWEST_FLAGGED = [("flagged_at", -1), ("_id", -1)]
+
+
+def course_review_key(course_id, created_at: datetime) -> str:
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    # As MongoDB stores it: milliseconds, naive UTC
+    created_at = created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)
+    return f"{course_id}:{created_at.isoformat()}"
+
+
+async def enqueue_report(app: FastAPI, target_type: str, target_id, parent_id=None):
+    """Open an item for reported content, or count the report on the open one."""
+    now = datetime.now(timezone.utc)
+    for attempt in range(2):
+        try:
+            await ModerationItemModel.get_motor_collection().update_one(
+                {"target_type": target_type, "target_id": str(target_id), "status": OPEN},
+                {
+                    "$setOnInsert": {"flagged_at": now, "parent_id": parent_id and str(parent_id)},
+                    "$set": {"last_reported_at": now},
+                    "$inc": {"report_count": 1},
+                },
+                upsert=True,
+            )
+            await invalidate_tags(app, MODERATION_QUEUE_TAG)
+            return
+        except DuplicateKeyError:
+            # A concurrent first report inserted the item; it matches now
+            if attempt:
+                raise
+
+async def resolve_matching(app: FastAPI, query: dict, resolution: str) -> int:
+    result = await ModerationItemModel.get_motor_collection().update_many(
+        {**query, "status": OPEN},
+        {"$set": {"status": RESOLVED, "resolved_at": datetime.now(timezone.utc), "resolution": resolution}},
+    )
+    if result.modified_count:
+        await invalidate_tags(app, MODERATION_QUEUE_TAG)
+    return result.modified_count
+
+async def resolve_items(app: FastAPI, target_type: str, target_ids, resolution: str) -> int:
+    """Resolve the open items of these targets; how many there were."""
+    return await resolve_matching(app, {
+        "target_type": target_type, "target_id": {"$in": [str(target_id) for target_id in target_ids]},
+    }, resolution)
+
+async def resolve_children(app: FastAPI, target_type: str, parent_ids, resolution: str) -> int:
+    """Resolve the open items under parents, e.g. the comments of deleted posts."""
+    return await resolve_matching(app, {
+        "parent_id": {"$in": [str(parent_id) for parent_id in parent_ids]}, "target_type": target_type,
+    }, resolution)
+
+
+async def queue_page(status: str, cursor: Optional[str], limit: int, target_type: Optional[str] = None):
+    """One page of queue items, newest reports first, and the cursor after it."""
+    query = {"status": status, **after_cursor(cursor, "flagged_at")}
+    if target_type:
+        query["target_type"] = target_type
+    items = await ModerationItemModel.get_motor_collection().find(query).sort(NEWEST_FLAGGED).limit(limit + 1).to_list(None)
+    return items, next_cursor(items, limit, "flagged_at")
+
+async def resolve_missing(app: FastAPI, target_type: str, items: list, found) -> list:
+    """Resolve the items whose target no longer exists; the rest, in order."""
+    missing = [item["target_id"] for item in items if item["target_id"] not in found]
+    if missing:
+        await resolve_items(app, target_type, missing, "gone")
+    return [item for item in items if item["target_id"] in found]
@@ -0,0 +1,60 @@
+"""Keyset pagination over (created_at, _id), newest first.
+
+Other timestamps work the same way through `field`, e.g. the moderation
+queue pages over (flagged_at, _id).
+
+A page is fetched with a range query on the compound index instead of
+skip(), so page 100 costs the same as page 1 and posts inserted meanwhile
+don't shift what the next page returns. The cursor handed to clients is the
+sort key of the last item, base64-encoded so they treat it as opaque.
+"""
+from fastapi import HTTPException
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+import base64
+import orjson
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Sort matching the (created_at, _id) index, newest first
+NEWEST_FIRST = {"created_at": -1, "_id": -1}
+
+
+def encode_cursor(created_at: datetime, doc_id) -> str:
+    raw = orjson.dumps([created_at.isoformat(), str(doc_id)])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = orjson.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), ObjectId(doc_id)
+    except (ValueError, TypeError, InvalidId, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(cursor: str, field: str = "created_at") -> dict:
+    """Filter for the items that sort after the cursor, {} for the first page."""
+    if not cursor:
+        return {}
+    created_at, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": created_at}},
+        {field: created_at, "_id": {"$lt": doc_id}},
+    ]}
+
+def page_size(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def next_cursor(items: list, limit: int, field: str = "created_at"):
+    """Cursor for the page after items, None when it was the last one.
+
+    items is expected to hold up to limit + 1 rows; the extra row only
+    signals that there is more and is dropped.
+    """
+    if len(items) <= limit:
+        return None
+    del items[limit:]
+    last = items[-1]
+    return encode_cursor(last[field], last["_id"])
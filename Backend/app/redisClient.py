@@ -0,0 +1,141 @@
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Consecutive connection errors before the circuit opens
+FAILURE_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", 5))
+# Reconnection probes back off from RETRY_MIN to RETRY_MAX seconds
+RETRY_MIN = float(os.getenv("REDIS_RETRY_MIN", 0.5))
+RETRY_MAX = float(os.getenv("REDIS_RETRY_MAX", 30))
+
+# Errors that mean Redis is unreachable, as opposed to a bad command
+CONNECTION_ERRORS = (RedisConnectionError, RedisTimeoutError, asyncio.TimeoutError, OSError)
+
+# Client methods that don't talk to Redis, or manage their own connection
+PASSTHROUGH = {"pubsub", "close", "aclose"}
+
+
+class CircuitOpenError(RedisConnectionError):
+    pass
+
+
+class CircuitBreakerRedis:
+    """redis.asyncio client wrapper that fails fast while Redis is down.
+
+    After FAILURE_THRESHOLD consecutive connection errors the circuit opens:
+    the wrapper becomes falsy, so the usual `if app.state.redis:` checks skip
+    Redis entirely, and a call that slips through raises CircuitOpenError
+    without touching the network. A background task probes with PING,
+    backing off between attempts, and closes the circuit on the first success.
+    """
+
+    def __init__(self, client, on_reconnect=None):
+        # on_reconnect: coroutine function run each time the circuit closes
+        self.client = client
+        self.on_reconnect = on_reconnect
+        self.failures = 0
+        self.is_open = False
+        self.trips = 0
+        self.reconnect_task = None
+
+    def __bool__(self):
+        return not self.is_open
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name in PASSTHROUGH or not callable(attr):
+            return attr
+        if name == "pipeline":
+            return lambda *args, **kwargs: GuardedPipeline(self, attr(*args, **kwargs))
+
+        async def guarded(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        return guarded
+
+    async def call(self, method, *args, **kwargs):
+        if self.is_open:
+            raise CircuitOpenError("Redis circuit is open")
+        try:
+            result = await method(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.record_failure()
+            raise
+        self.failures = 0
+        return result
+
+    async def scan_iter(self, *args, **kwargs):
+        if self.is_open:
+            raise CircuitOpenError("Redis circuit is open")
+        try:
+            async for key in self.client.scan_iter(*args, **kwargs):
+                yield key
+        except CONNECTION_ERRORS:
+            self.record_failure()
+            raise
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= FAILURE_THRESHOLD:
+            self.trip()
+
+    def trip(self):
+        """Open the circuit and start probing for Redis to come back."""
+        if self.is_open:
+            return
+        self.is_open = True
+        self.trips += 1
+        logger.error("Redis unavailable, caching disabled until it reconnects")
+        self.reconnect_task = asyncio.create_task(self.reconnect())
+
+    async def reconnect(self):
+        delay = RETRY_MIN
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.client.ping()
+            except Exception as e:
+                logger.warning(f"Redis still unavailable: {e}, retrying in {delay:.1f}s")
+                delay = min(delay * 2, RETRY_MAX)
+                continue
+            self.failures = 0
+            self.is_open = False
+            logger.info("Redis reconnected, caching resumed")
+            if self.on_reconnect:
+                try:
+                    await self.on_reconnect()
+                except Exception as e:
+                    logger.error(f"Redis reconnect hook failed: {e}")
+            return
+
+    def stats(self) -> dict:
+        return {"state": "open" if self.is_open else "closed", "failures": self.failures, "trips": self.trips}
+
+    async def close(self):
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+        await self.client.close()
+
+
+class GuardedPipeline:
+    """Buffers commands like a redis pipeline; execute() goes through the breaker."""
+
+    def __init__(self, breaker: CircuitBreakerRedis, pipeline):
+        self.breaker = breaker
+        self.pipeline = pipeline
+
+    def __getattr__(self, name):
+        attr = getattr(self.pipeline, name)
+        if not callable(attr):
+            return attr
+
+        def buffered(*args, **kwargs):
+            attr(*args, **kwargs)
+            return self
+        return buffered
+
+    async def execute(self, *args, **kwargs):
+        return await self.breaker.call(self.pipeline.execute, *args, **kwargs)
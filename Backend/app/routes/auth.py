@@ -5,6 +5,7 @@ from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 from app.models.user import UserModel
+from app.cache import cache_policy, tag_response, invalidate_tags, VARY_USER
 from dotenv import load_dotenv
 import os
 import jwt
@@ -61,6 +62,10 @@ def create_token(data: dict, expires_delta: timedelta, secret_key: str):
     to_encode.update({"exp": datetime.utcnow() + expires_delta})
     return jwt.encode(to_encode, secret_key, algorithm=ALGORITHM)
 
+def access_token_claims(user: UserModel) -> dict:
+    # uid and the roles let the response cache pick a user's copy without a DB lookup
+    return {"sub": user.email, "uid": str(user.id), "is_uoft": user.is_uoft, "is_admin": user.is_admin}
+
 def create_access_token(data: dict):
     return create_token(data, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), ACCESS_SECRET_KEY)
 
@@ -78,7 +83,7 @@ async def login_user(request: LoginRequest, response: Response):
     if not await verify_password(request.password, user.password):
         raise HTTPException(status_code=400, detail="Incorrect password")
 
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data=access_token_claims(user))
     refresh_token = create_refresh_token(data={"sub": user.email})
 
     print(f"Generated Access Token: {access_token}")  # Debugging
@@ -170,9 +175,11 @@ async def get_current_user(request: Request):
 
 # Protect an Endpoint
 @router.get("/me")
-async def get_user_info(current_user: UserModel = Depends(get_current_user)):
+@cache_policy(vary_params=(), vary_on=VARY_USER)
+async def get_user_info(request: Request, current_user: UserModel = Depends(get_current_user)):
     if current_user is None:
         raise HTTPException(status_code=401, detail="User not authenticated")
+    tag_response(request, f"user:{current_user.username}")
     return {
         "id": str(current_user.id),  # Convert UUID to string for JSON
         "username": current_user.username,
@@ -283,7 +290,7 @@ async def register_user(request: RegisterUserRequest, response: Response):
     await new_user.insert()
 
     # Generate JWT token and set it in a cookie
-    access_token = create_access_token(data={"sub": new_user.email})
+    access_token = create_access_token(data=access_token_claims(new_user))
 
     response.set_cookie(
         key="access_token",
@@ -297,6 +304,7 @@ async def register_user(request: RegisterUserRequest, response: Response):
     return {"message": "User registered and logged in successfully", "username": new_user.username}
 
 @router.get("/check-refresh")
+@cache_policy(cacheable=False)
 async def check_refresh_token(request: Request):
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
@@ -304,7 +312,7 @@ async def check_refresh_token(request: Request):
     return {"message": "Refresh token exists"}
 
 @router.post("/update-email-after-verification")
-async def update_email_after_verification(request: EmailUpdateAfterVerification):
+async def update_email_after_verification(request: EmailUpdateAfterVerification, http_request: Request):
     user = await UserModel.find_one(UserModel.email == request.current_email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -325,6 +333,7 @@ async def update_email_after_verification(request: EmailUpdateAfterVerification)
     user.email = request.new_email
     user.is_uoft = True
     await user.save()
+    await invalidate_tags(http_request.app, f"user:{user.username}")
 
     return {"message": "Email updated successfully"}
 
@@ -400,7 +409,7 @@ async def refresh_token(request: Request, response: Response):
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
 
-        new_access_token = create_access_token(data={"sub": user.email})
+        new_access_token = create_access_token(data=access_token_claims(user))
 
         response.set_cookie(
             key="access_token",
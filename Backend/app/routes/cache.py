@@ -1,15 +1,34 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from app.cache import set_cache, get_cache, invalidate_cache
+from typing import List, Dict
+from app.cache import (
+    set_cache, get_cache, invalidate_cache, set_cache_many, get_cache_many, invalidate_cache_many,
+    cache_stats, route_stats_summary, scan_cache_keys,
+)
 from fastapi import FastAPI
 
 router = APIRouter()
 
+# Upper bound on keys per batch request
+MAX_BATCH_KEYS = 1000
+
 class CacheUpdateRequest(BaseModel):
     key: str
     value: dict
     expiration: int = 3600
 
+class CacheKeysRequest(BaseModel):
+    keys: List[str]
+
+class CacheUpdateManyRequest(BaseModel):
+    values: Dict[str, dict]
+    expiration: int = 3600
+
+def check_batch_size(keys):
+    if len(keys) > MAX_BATCH_KEYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_KEYS} keys per request")
+
 async def get_app():
     from app.main import app  # Import here to avoid circular imports
     return app
@@ -29,4 +48,52 @@ async def get_cache_endpoint(key: str, app: FastAPI = Depends(get_app)):
     data = await get_cache(app, key)
     if data:
         return {"source": "cache", "data": data}
-    return {"source": "cache", "data": None, "message": "No data found in cache"}
\ No newline at end of file
+    return {"source": "cache", "data": None, "message": "No data found in cache"}
+
+@router.post("/mget", response_class=ORJSONResponse)
+async def get_cache_many_endpoint(request: CacheKeysRequest, app: FastAPI = Depends(get_app)):
+    check_batch_size(request.keys)
+    data = await get_cache_many(app, request.keys)
+    if data is None:
+        return ORJSONResponse({"source": "cache", "data": None, "message": "Redis not available"})
+    # Values are plain JSON already, skip FastAPI's re-encoding
+    return ORJSONResponse({"source": "cache", "data": data})
+
+@router.post("/mset")
+async def update_cache_many(request: CacheUpdateManyRequest, app: FastAPI = Depends(get_app)):
+    check_batch_size(request.values)
+    success = await set_cache_many(app, request.values, request.expiration)
+    return {"success": success, "keys": list(request.values), "message": "Cache updated" if success else "Cache update failed"}
+
+@router.post("/invalidate-many")
+async def invalidate_cache_many_endpoint(request: CacheKeysRequest, app: FastAPI = Depends(get_app)):
+    check_batch_size(request.keys)
+    success = await invalidate_cache_many(app, request.keys)
+    return {"success": success, "keys": request.keys, "message": "Cache invalidated" if success else "Cache invalidation failed"}
+
+@router.get("/stats")
+async def cache_stats_endpoint(app: FastAPI = Depends(get_app)):
+    # Counters are per worker process
+    return {
+        "local": app.state.local_cache.stats(),
+        "redis": {
+            "hits": cache_stats["redis_hits"],
+            "misses": cache_stats["redis_misses"],
+            "circuit": app.state.redis.stats() if app.state.redis is not None else None,
+        },
+        "stale_while_revalidate": {
+            "stale_serves": cache_stats["stale_serves"],
+            "background_refreshes": cache_stats["background_refreshes"],
+        },
+        "not_modified": cache_stats["not_modified"],
+        "entities": {"hits": cache_stats["entity_hits"], "misses": cache_stats["entity_misses"]},
+        "routes": route_stats_summary(),
+    }
+
+@router.get("/keys")
+async def cache_keys_endpoint(prefix: str = "", max_keys: int = 10000, app: FastAPI = Depends(get_app)):
+    # prefix is matched against the route template, e.g. "/api/courses"
+    summary = await scan_cache_keys(app, prefix, max_keys)
+    if summary is None:
+        return {"success": False, "message": "Redis not available"}
+    return summary
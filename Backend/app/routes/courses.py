@@ -1,14 +1,24 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
-from app.models.courses import CourseModel, ReviewModel, OverallRatingModel, ReportDetail
+from app.models.courses import CourseModel, ReviewModel, ReportDetail
 from app.models.user import UserModel
 from app.routes.auth import get_current_user
+from app.cache import (
+    tag_response, invalidate_tags, cache_policy, NEGATIVE_CACHE_TTL, VARY_ROLE,
+    get_entity, get_entities, forget_entities,
+)
+from app.likes import liked_by, like_update
+from app.moderationQueue import COURSE_REVIEW, OPEN, MODERATION_QUEUE_TAG, course_review_key, enqueue_report, resolve_items, queue_page, resolve_missing
+from app.pagination import DEFAULT_PAGE_SIZE, page_size
+from app.bulkModeration import COURSE_RATINGS
+from pymongo import ReturnDocument
+from bson import Binary, ObjectId
+from beanie.odm.utils.encoder import Encoder
+from typing import Optional
 from app.courseScrape import scrape_all_pages
 from beanie import PydanticObjectId
 from pydantic import BaseModel
-from beanie.operators import In
 from app.models.professor import ProfessorModel
 from uuid import UUID
-import math 
 
 REPORT_THRESHOLD = 3
 
@@ -23,77 +33,132 @@ class ReviewAuthorUpdateRequest(BaseModel):
     old_username: str
     new_username: str
 
+async def review_created_at(course_id: str, index: int):
+    """When the review now at index was written, read from Mongo rather than the cache.
+
+    The routes below update reviews in place, on the condition that the review
+    at index is still this one, instead of saving a cached copy of the course
+    over likes and reports written since.
+    """
+    if not ObjectId.is_valid(course_id):
+        raise HTTPException(status_code=404, detail="Course not found")
+    course = await CourseModel.get_motor_collection().find_one({"_id": ObjectId(course_id)}, {"reviews.created_at": 1})
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    reviews = course.get("reviews", [])
+    if index < 0 or index >= len(reviews):
+        raise HTTPException(status_code=404, detail="Review index out of range")
+    return reviews[index].get("created_at")
+
+async def remove_review(course_id: str, index: int, created_at, rerate: bool) -> bool:
+    """Pull the review at index if it's still the one created at created_at."""
+    courses = CourseModel.get_motor_collection()
+    review = f"reviews.{index}"
+    result = await courses.update_one(
+        {"_id": ObjectId(course_id), f"{review}.created_at": created_at}, {"$unset": {review: ""}}
+    )
+    if not result.matched_count:
+        return False
+    await courses.update_one({"_id": ObjectId(course_id)}, {"$pull": {"reviews": None}})
+    if rerate:
+        await courses.update_one({"_id": ObjectId(course_id)}, COURSE_RATINGS)
+    return True
+
 @router.delete("/courses/{course_id}/reviews/{index}")
 async def delete_own_course_review(
     course_id: str, 
     index: int, 
+    request: Request,
 ):
-    # 1. Fetch the course
-    course = await CourseModel.get(course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-
-    # 2. Validate the review index
-    if index < 0 or index >= len(course.reviews):
-        raise HTTPException(status_code=404, detail="Review index out of range")
+    # 1. Find the review
+    created_at = await review_created_at(course_id, index)
 
-    # 4. Remove the review and save
-    course.reviews.pop(index)
-    await course.save()
+    # 2. Remove it, unless it moved meanwhile
+    if not await remove_review(course_id, index, created_at, rerate=False):
+        raise HTTPException(status_code=409, detail="Review moved; reload and try again")
+    await resolve_items(request.app, COURSE_REVIEW, [course_review_key(course_id, created_at)], "gone")
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
 
     return {"message": "Review deleted successfully"}
 
 @router.post("/courses/update-reviews-author")
-async def update_course_reviews_author(request_data: ReviewAuthorUpdateRequest):
-    # Get all courses
-    courses = await CourseModel.find_all().to_list()
-    updated_count = 0
-    for course in courses:
-        updated = False
-        # Loop over each review in the course
-        for review in course.reviews:
-            if review.author == request_data.old_username:
-                review.author = request_data.new_username
-                updated = True
-                updated_count += 1
-        if updated:
-            await course.save()
+async def update_course_reviews_author(request_data: ReviewAuthorUpdateRequest, request: Request):
+    # Get the courses with reviews by this author
+    courses = CourseModel.get_motor_collection()
+    matching = await courses.find(
+        {"reviews.author": request_data.old_username}, {"reviews.author": 1}
+    ).to_list(None)
+    updated_count = sum(
+        review.get("author") == request_data.old_username for course in matching for review in course["reviews"]
+    )
+    course_ids = [course["_id"] for course in matching]
+    if course_ids:
+        # Only the author fields, so likes and reports written meanwhile stay
+        await courses.update_many(
+            {"_id": {"$in": course_ids}},
+            {"$set": {"reviews.$[review].author": request_data.new_username}},
+            array_filters=[{"review.author": request_data.old_username}],
+        )
+        await forget_entities(request.app, CourseModel, course_ids)
+        await invalidate_tags(request.app, *[f"course:{course_id}" for course_id in course_ids], "list:courses")
     return {"message": f"Updated {updated_count} course reviews."}
 
 @router.delete("/admin/courses/{course_id}/reviews/{index}")
-async def delete_course_review(course_id: str, index: int):
-    course = await CourseModel.get(course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if index < 0 or index >= len(course.reviews):
-        raise HTTPException(status_code=404, detail="Review index out of range")
-
-    # Remove the review
-    course.reviews.pop(index)
-
-    # Recalculate ratings
-    if course.reviews:
-        total = len(course.reviews)
-        sum_E = sum(r.ratingE for r in course.reviews)
-        sum_MD = sum(r.ratingMD for r in course.reviews)
-        sum_AD = sum(r.ratingAD for r in course.reviews)
-
-        course.ratings.average_rating_E = round(sum_E / total, 2)
-        course.ratings.average_rating_MD = round(sum_MD / total, 2)
-        course.ratings.average_rating_AD = round(sum_AD / total, 2)
-
-        course.rating = math.floor((course.ratings.average_rating_E +
-                                    course.ratings.average_rating_MD +
-                                    course.ratings.average_rating_AD) / 3)
-    else:
-        # No reviews left
-        course.ratings = OverallRatingModel()
-        course.rating = 0
-
-    await course.save()
+async def delete_course_review(course_id: str, index: int, request: Request):
+    created_at = await review_created_at(course_id, index)
+
+    # Remove the review and recalculate ratings from the ones left
+    if not await remove_review(course_id, index, created_at, rerate=True):
+        raise HTTPException(status_code=409, detail="Review moved; reload and try again")
+    await resolve_items(request.app, COURSE_REVIEW, [course_review_key(course_id, created_at)], "removed")
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
     return {"message": "Course review deleted and ratings updated"}
 
 
+async def toggle_review_like(course_id: str, review_index: int, user_id: UUID, like: bool) -> Optional[int]:
+    """Like or unlike a review in one update; the new like count, None if nothing matched."""
+    review = f"reviews.{review_index}"
+    course = await CourseModel.get_motor_collection().find_one_and_update(
+        # $ne alone would match a missing review, and the update would pad the array with nulls
+        {"_id": ObjectId(course_id), review: {"$exists": True}, f"{review}.likes": liked_by(user_id, like)},
+        like_update(f"{review}.", user_id, like),
+        projection={"reviews.like_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return course["reviews"][review_index]["like_count"] if course else None
+
+async def add_review(course_id, review: ReviewModel) -> bool:
+    """Append a review and recompute the ratings, leaving the other reviews as they are."""
+    courses = CourseModel.get_motor_collection()
+    result = await courses.update_one({"_id": ObjectId(course_id)}, {"$push": {"reviews": Encoder().encode(review)}})
+    if not result.matched_count:
+        return False
+    await courses.update_one({"_id": ObjectId(course_id)}, COURSE_RATINGS)
+    return True
+
+async def report_review(course_id, review_index: int, created_at, report: ReportDetail) -> Optional[int]:
+    """Add a report and flag the review; its report count, None if nothing matched."""
+    review = f"reviews.{review_index}"
+    course = await CourseModel.get_motor_collection().find_one_and_update(
+        {
+            "_id": ObjectId(course_id),
+            f"{review}.created_at": created_at,
+            f"{review}.reports.user_id": {"$ne": Binary.from_uuid(report.user_id)},
+        },
+        {"$push": {f"{review}.reports": Encoder().encode(report)}, "$set": {f"{review}.flagged": True}},
+        projection={"reviews.reports.user_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return len(course["reviews"][review_index]["reports"]) if course else None
+
+async def review_exists(course_id: str, review_index: int) -> bool:
+    course = await CourseModel.get_motor_collection().find_one(
+        {"_id": ObjectId(course_id), f"reviews.{review_index}": {"$exists": True}}, {"_id": 1}
+    )
+    return course is not None
+
 @router.post("/courses/reviews/{course_id}/{review_index}/like")
 async def like_review(course_id: str, review_index: int, request: Request):
     current_user = await get_current_user(request)
@@ -103,18 +168,18 @@ async def like_review(course_id: str, review_index: int, request: Request):
     if not current_user.is_uoft:
         raise HTTPException(status_code=403, detail="Only UofT users can like reviews")
 
-    course = await CourseModel.get(course_id)
-    if not course or review_index >= len(course.reviews):
+    if not ObjectId.is_valid(course_id) or review_index < 0:
         raise HTTPException(status_code=404, detail="Review not found")
 
-    review = course.reviews[review_index]
-    if current_user.id in review.likes:
+    likes = await toggle_review_like(course_id, review_index, current_user.id, like=True)
+    if likes is None:
+        if not await review_exists(course_id, review_index):
+            raise HTTPException(status_code=404, detail="Review not found")
         raise HTTPException(status_code=400, detail="Already liked")
 
-    review.likes.append(current_user.id)
-    course.reviews[review_index] = review
-    await course.save()
-    return {"message": "Review liked", "likes": len(review.likes)}
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
+    return {"message": "Review liked", "likes": likes}
 
 
 @router.post("/courses/reviews/{course_id}/{review_index}/unlike")
@@ -123,90 +188,102 @@ async def unlike_review(course_id: str, review_index: int, request: Request):
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    course = await CourseModel.get(course_id)
-    if not course or review_index >= len(course.reviews):
+    if not ObjectId.is_valid(course_id) or review_index < 0:
         raise HTTPException(status_code=404, detail="Review not found")
 
-    review = course.reviews[review_index]
-    if current_user.id not in review.likes:
+    likes = await toggle_review_like(course_id, review_index, current_user.id, like=False)
+    if likes is None:
+        if not await review_exists(course_id, review_index):
+            raise HTTPException(status_code=404, detail="Review not found")
         raise HTTPException(status_code=400, detail="You haven't liked this review")
 
-    review.likes.remove(current_user.id)
-    course.reviews[review_index] = review
-    await course.save()
-    return {"message": "Review unliked", "likes": len(review.likes)}
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
+    return {"message": "Review unliked", "likes": likes}
 
 
 @router.post("/admin/courses/{course_id}/reviews/{index}/unflag")
-async def unflag_course_review(course_id: str, index: int):
-    course = await CourseModel.get(course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    if index < 0 or index >= len(course.reviews):
-        raise HTTPException(status_code=404, detail="Review index out of range")
-
-    course.reviews[index].flagged = False
-    course.reviews[index].reports = []
-    await course.save()
+async def unflag_course_review(course_id: str, index: int, request: Request):
+    created_at = await review_created_at(course_id, index)
+
+    review = f"reviews.{index}"
+    result = await CourseModel.get_motor_collection().update_one(
+        {"_id": ObjectId(course_id), f"{review}.created_at": created_at},
+        {"$set": {f"{review}.flagged": False, f"{review}.reports": []}},
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=409, detail="Review moved; reload and try again")
+    await resolve_items(request.app, COURSE_REVIEW, [course_review_key(course_id, created_at)], "dismissed")
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
     return {"message": "Course review unflagged"}
 
 
 @router.get("/admin/flagged/course-reviews")
-async def get_flagged_course_reviews():
-    courses = await CourseModel.find().to_list()
-    flagged = []
+@cache_policy(vary_params=("cursor", "limit"), vary_on=VARY_ROLE)
+async def get_flagged_course_reviews(request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    items, cursor = await queue_page(OPEN, cursor, page_size(limit), COURSE_REVIEW)
+    course_ids = {PydanticObjectId(item["parent_id"]) for item in items}
+    tag_response(request, MODERATION_QUEUE_TAG, *[f"course:{course_id}" for course_id in course_ids])
+    courses = await get_entities(request.app, CourseModel, list(course_ids))
+    # Where each review is now; positions shift as reviews are deleted
+    reviews = {}
     for course in courses:
         for i, review in enumerate(course.reviews):
-            if review.flagged:
-                flagged.append({
-                "course_id": str(course.id),
-                "review_index": i,
-                "course_title": course.title,
-                "content": review.content,
-                "author": review.author,
-                "created_at": review.created_at,
-                "reports": [r.dict() for r in review.reports] if review.reports else []
-            })
-
-    return flagged
+            reviews[course_review_key(course.id, review.created_at)] = (course, i, review)
 
-@router.post("/courses/reviews/{course_id}/{review_idx}/report")
-async def report_course_review(course_id: PydanticObjectId, review_idx: int, report: ReportRequest):
-    course = await CourseModel.get(course_id)
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-
-    try:
-        review = course.reviews[review_idx]
-    except IndexError:
-        raise HTTPException(status_code=404, detail="Review not found")
+    flagged = []
+    for item in await resolve_missing(request.app, COURSE_REVIEW, items, reviews):
+        course, i, review = reviews[item["target_id"]]
+        flagged.append({
+            "course_id": str(course.id),
+            "review_index": i,
+            "course_title": course.title,
+            "content": review.content,
+            "author": review.author,
+            "created_at": review.created_at,
+            "reports": [r.dict() for r in review.reports] if review.reports else []
+        })
+
+    return {"items": flagged, "next_cursor": cursor}
 
-    if any(r.user_id == report.user_id for r in review.reports):
-        raise HTTPException(status_code=400, detail="You have already reported this review")
+@router.post("/courses/reviews/{course_id}/{review_idx}/report")
+async def report_course_review(course_id: PydanticObjectId, review_idx: int, report: ReportRequest, request: Request):
+    created_at = await review_created_at(course_id, review_idx)
 
     user = await UserModel.get(report.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not")
-    review.reports.append(ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username))
+    detail = ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username)
 
+    # Flagged on the first report
+    reports = await report_review(course_id, review_idx, created_at, detail)
+    if reports is None:
+        if await CourseModel.get_motor_collection().count_documents(
+            {"_id": course_id, f"reviews.{review_idx}.created_at": created_at}, limit=1
+        ):
+            raise HTTPException(status_code=400, detail="You have already reported this review")
+        raise HTTPException(status_code=409, detail="Review moved; reload and try again")
 
-    if len(review.reports) >= 1:
-        review.flagged = True  # Flag review if threshold met
-
-    await course.save()
-    return {"message": "Review reported", "reports": len(review.reports)}
+    await enqueue_report(request.app, COURSE_REVIEW, course_review_key(course_id, created_at), parent_id=course_id)
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
+    return {"message": "Review reported", "reports": reports}
 
 
 @router.post("/scrape-courses")
-async def scrape_courses():
+async def scrape_courses(request: Request):
     try:
         await scrape_all_pages()
+        await invalidate_tags(request.app, "list:courses")
         return {"message": "Courses scraped and stored successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/courses")
-async def get_courses(page: int = 0, limit: int = 20):
+@cache_policy(vary_params=("page", "limit"))
+async def get_courses(request: Request, page: int = 0, limit: int = 20):
+    tag_response(request, "list:courses")
     # Calculate skip value based on page and limit
     skip = page * limit
     
@@ -216,13 +293,16 @@ async def get_courses(page: int = 0, limit: int = 20):
 
 
 @router.get("/courses/{course_id}")
-async def get_course(course_id: PydanticObjectId):
-    course = await CourseModel.get(course_id)
+@cache_policy(vary_params=(), negative_ttl=NEGATIVE_CACHE_TTL)
+async def get_course(course_id: PydanticObjectId, request: Request):
+    tag_response(request, f"course:{course_id}")
+    course = await get_entity(request.app, CourseModel, course_id)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+    tag_response(request, *[f"professor:{pid}" for pid in course.professors])
 
     # Fetch professor details
-    professors = await ProfessorModel.find(In(ProfessorModel.id, course.professors)).to_list()
+    professors = await get_entities(request.app, ProfessorModel, course.professors)
 
     return {
         **course.dict(),
@@ -234,27 +314,11 @@ async def get_course(course_id: PydanticObjectId):
 
   
 @router.post("/courses/{course_id}/review")
-async def create_course_review(course_id: PydanticObjectId, review: ReviewModel):
-    course = await CourseModel.get(course_id)
-    if not course:
+async def create_course_review(course_id: PydanticObjectId, review: ReviewModel, request: Request):
+    # Add the new review and recalculate average ratings based on all reviews
+    if not await add_review(course_id, review):
         raise HTTPException(status_code=404, detail="Course not found")
 
-    # Add the new review
-    course.reviews.append(review)
-
-    # Recalculate average ratings based on all reviews
-    total = len(course.reviews)
-    sum_E = sum(r.ratingE for r in course.reviews)
-    sum_MD = sum(r.ratingMD for r in course.reviews)
-    sum_AD = sum(r.ratingAD for r in course.reviews)
-
-    course.ratings.average_rating_E = round(sum_E / total, 2)
-    course.ratings.average_rating_MD = round(sum_MD / total, 2)
-    course.ratings.average_rating_AD = round(sum_AD / total, 2)
-
-    course.rating = math.floor((course.ratings.average_rating_E +
-                                course.ratings.average_rating_MD +
-                                course.ratings.average_rating_AD) / 3)
-
-    await course.save()
+    await forget_entities(request.app, CourseModel, [course_id])
+    await invalidate_tags(request.app, f"course:{course_id}", "list:courses")
     return review
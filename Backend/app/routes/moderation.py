@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Request
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from app.cache import cache_policy, tag_response, VARY_ROLE
+from app.models.moderation import TargetType
+from app.moderationQueue import OPEN, MODERATION_QUEUE_TAG, queue_page
+from app.bulkModeration import moderate, OK
+from app.pagination import DEFAULT_PAGE_SIZE, page_size
+
+router = APIRouter()
+MAX_BULK_ITEMS = 500
+
+
+class ModerationAction(BaseModel):
+    target_type: TargetType
+    action: Literal["dismiss", "remove"]
+    # Post, comment or professor review id; a course review's index
+    id: str
+    # The post of a comment, the course of a course review
+    parent_id: Optional[str] = None
+
+class BulkModerationRequest(BaseModel):
+    items: List[ModerationAction] = Field(..., max_length=MAX_BULK_ITEMS)
+
+
+# Everything reported, newest first; the /admin/flagged/* routes page one
+# kind at a time with the content attached
+@router.get("/admin/moderation-queue")
+@cache_policy(vary_params=("status", "target_type", "cursor", "limit"), vary_on=VARY_ROLE)
+async def get_moderation_queue(
+    request: Request,
+    status: Literal["open", "resolved"] = OPEN,
+    target_type: Optional[TargetType] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    items, cursor = await queue_page(status, cursor, page_size(limit), target_type)
+    tag_response(request, MODERATION_QUEUE_TAG)
+    for item in items:
+        item["_id"] = str(item["_id"])
+    return {"items": items, "next_cursor": cursor}
+
+# Dismiss (unflag) or remove many reported items at once
+@router.post("/admin/moderation/bulk")
+async def bulk_moderate(body: BulkModerationRequest, request: Request):
+    results = await moderate(request.app, body.items)
+    return {
+        "results": [{**item.dict(), "result": result} for item, result in zip(body.items, results)],
+        "succeeded": results.count(OK),
+    }
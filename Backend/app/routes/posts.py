@@ -1,13 +1,40 @@
 from fastapi import APIRouter, HTTPException, Body, Request
-from app.models.posts import PostModel, CommentModel, ReportDetail
+from app.models.posts import PostModel, CommentModel, PostCommentModel, ReportDetail
 from app.models.user import UserModel
 from beanie import PydanticObjectId  # Needed for MongoDB ObjectId
+from beanie.operators import In
 from uuid import UUID, uuid4
-from bson import ObjectId
+from bson import ObjectId, Binary
 from app.models.user import UserModel
 from app.routes.auth import get_current_user
+from app.cache import (
+    tag_response, invalidate_tags, cache_policy, NEGATIVE_CACHE_TTL, VARY_USER, VARY_ROLE,
+    get_entity, insert_entity, delete_entity, forget_entities,
+)
+from pymongo import ReturnDocument
+from beanie.odm.utils.encoder import Encoder
+from app.likes import liked_by, like_update
+from app.viewCounter import record_view, pending_views
+from app.hotPosts import rescore_posts, forget_hot_post, hot_page, rebuild_hot_ranking
+from app.moderationQueue import (
+    POST, COMMENT, OPEN, MODERATION_QUEUE_TAG, enqueue_report, resolve_items, resolve_children, queue_page, resolve_missing,
+)
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEWEST_FIRST, after_cursor, page_size, next_cursor
+from app.commentStore import (
+    comments_migrated, save_embedded_comments,
+    insert_comment, delete_comment_subtree, toggle_stored_comment_like, stored_comment_exists,
+    report_stored_comment, unflag_stored_comment,
+)
+from app.commentThreads import (
+    DEFAULT_THREAD_DEPTH, MAX_THREAD_DEPTH, DEFAULT_THREAD_REPLIES, StoredThread, EmbeddedThread,
+    decode_thread_cursor, thread_page,
+)
+from app.embeddedComments import (
+    push_embedded_comment, pull_embedded_comment, toggle_embedded_comment_like, embedded_comment_exists,
+    report_embedded_comment, unflag_embedded_comment,
+)
 from datetime import datetime, timezone
-from typing import Optional, List
+from typing import Literal, Optional
 from pydantic import BaseModel
 from fastapi import Depends
 
@@ -15,6 +42,8 @@ from fastapi import Depends
 router = APIRouter()
 REPORT_THRESHOLD = 3
 DELETED_USER_ID = UUID("00000000-0000-0000-0000-000000000000")
+# 409 detail when the comment migration takes a post over mid-request
+MIGRATING = "Comments are being migrated, try again"
 
 
 class CommentRequest(BaseModel):
@@ -37,61 +66,79 @@ class UsernameUpdateRequest(BaseModel):
     user_id: UUID
     new_username: str
 
-def find_comment_and_apply_action(comments, comment_id, action):
-    for comment in comments:
-        if str(comment.id) == str(comment_id):
-            return action(comment)
-        if comment.replies:
-            result = find_comment_and_apply_action(comment.replies, comment_id, action)
-            if result:
-                return result
-    return None
+# Characters of content shown in the feed
+EXCERPT_LENGTH = 400
+
+# Feed entries: enough to render a card, without comment trees or like lists
+POST_SUMMARY_PROJECTION = {
+    "title": 1,
+    "author": 1,
+    "created_at": 1,
+    "views": 1,
+    "last_activity_at": 1,
+    "excerpt": {"$substrCP": ["$content", 0, EXCERPT_LENGTH]},
+    "truncated": {"$gt": [{"$strLenCP": "$content"}, EXCERPT_LENGTH]},
+    "like_count": {"$size": {"$ifNull": ["$likes", []]}},
+    # Stored on every post once backfillCounters has run
+    "comment_count": {"$ifNull": ["$comment_count", 0]},
+}
+
+def parse_comment_id(comment_id: str) -> UUID:
+    try:
+        return UUID(comment_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Comment not found")
 
 @router.delete("/admin/posts/{post_id}")
-async def delete_post(post_id: str):
-    post = await PostModel.get(post_id)
+async def delete_post(post_id: str, request: Request):
+    post = await get_entity(request.app, PostModel, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    await post.delete()
+    await delete_entity(request.app, post)
+    await PostCommentModel.find(PostCommentModel.post_id == post.id).delete()
+    await resolve_items(request.app, POST, [post.id], "removed")
+    await resolve_children(request.app, COMMENT, [post.id], "gone")
+    await forget_hot_post(request.app, post.id)
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
     return {"message": "Post deleted"}
 
 @router.post("/admin/posts/{post_id}/unflag")
-async def unflag_post(post_id: str):
-    post = await PostModel.get(post_id)
-    if not post:
+async def unflag_post(post_id: str, request: Request):
+    if not ObjectId.is_valid(post_id):
         raise HTTPException(status_code=404, detail="Post not found")
-    post.reports = []
-    post.flagged = False
-    await post.save()
+    # A targeted update, so counters moved since the post was cached stay put
+    result = await PostModel.get_motor_collection().update_one(
+        {"_id": ObjectId(post_id)}, {"$set": {"flagged": False, "reports": []}}
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await resolve_items(request.app, POST, [post_id], "dismissed")
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
     return {"message": "Post unflagged"}
 
 @router.post("/admin/posts/{post_id}/comments/{comment_id}/delete")
-async def delete_nested_comment(post_id: str, comment_id: str):
-    post = await PostModel.get(post_id)
-    if not post:
+async def delete_nested_comment(post_id: str, comment_id: str, request: Request):
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
-
-    def remove_comment(comments):
-        for i, c in enumerate(comments):
-            if str(c.id) == comment_id:
-                comments.pop(i)
-                return True
-            if remove_comment(c.replies):
-                return True
-        return False
-
-    deleted = remove_comment(post.comments)
-
-    if not deleted:
+    delete = delete_comment_subtree if migrated else pull_embedded_comment
+    cid = parse_comment_id(comment_id)
+    if not await delete(PydanticObjectId(post_id), cid):
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    await post.save()
+    await resolve_items(request.app, COMMENT, [cid], "removed")
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    await rescore_posts(request.app, [post_id])
     return {"message": "Nested comment deleted"}
 
 @router.post("/posts/update-comments-username")
-async def update_comments_username_endpoint(request_data: UsernameUpdateRequest):
-    # Find all posts that contain comments with the matching author_id.
-    posts = await PostModel.find(PostModel.comments.author_id == request_data.user_id).to_list()
+async def update_comments_username_endpoint(request_data: UsernameUpdateRequest, request: Request):
+    # Find all unmigrated posts that contain comments with the matching author_id.
+    posts = await PostModel.find(
+        PostModel.comments.author_id == request_data.user_id, PostModel.comments_migrated != True
+    ).to_list()
     
     # Recursive helper to update username in comments and nested replies.
     def recursive_update(comments: list) -> bool:
@@ -106,146 +153,157 @@ async def update_comments_username_endpoint(request_data: UsernameUpdateRequest)
         return updated
 
     # For each post, update its comments if needed.
+    updated_tags = []
     for post in posts:
         if recursive_update(post.comments):
-            await post.save()
+            # A post migrated meanwhile is covered by the update below
+            await save_embedded_comments(request.app, post)
+            updated_tags.append(f"post:{post.id}")
+
+    # Migrated comments, found through the author_id index
+    author_id = Binary.from_uuid(request_data.user_id)
+    stored = PostCommentModel.get_motor_collection()
+    post_ids = await stored.distinct("post_id", {"author_id": author_id})
+    if post_ids:
+        await stored.update_many({"author_id": author_id}, {"$set": {"author_name": request_data.new_username}})
+        updated_tags.extend(f"post:{post_id}" for post_id in post_ids)
+    if updated_tags:
+        await invalidate_tags(request.app, *updated_tags, "list:posts")
     
     return {"message": "Username updated in comments"}
 
 @router.post("/posts/update-author-username")
-async def update_author_username_endpoint(request_data: UsernameUpdateRequest):
+async def update_author_username_endpoint(request_data: UsernameUpdateRequest, request: Request):
     # Find all posts where the author_id matches the given user_id
-    posts = await PostModel.find(PostModel.author_id == request_data.user_id).to_list()
+    author_id = Binary.from_uuid(request_data.user_id)
+    collection = PostModel.get_motor_collection()
+    post_ids = await collection.distinct("_id", {"author_id": author_id})
     
-    # Update the author field in each post
-    for post in posts:
-        post.author = request_data.new_username
-        await post.save()
+    # Update the author field in each post, leaving the rest as it is now
+    if post_ids:
+        await collection.update_many({"author_id": author_id}, {"$set": {"author": request_data.new_username}})
+        await forget_entities(request.app, PostModel, post_ids)
+        await invalidate_tags(request.app, *[f"post:{post_id}" for post_id in post_ids], "list:posts")
     
     return {"message": "Username updated in posts"}
 
 
 @router.post("/admin/posts/{post_id}/comments/{comment_id}/unflag")
-async def unflag_nested_comment(post_id: str, comment_id: str):
-    post = await PostModel.get(post_id)
-    if not post:
+async def unflag_nested_comment(post_id: str, comment_id: str, request: Request):
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
-
-    def unflag_comment(comments):
-        for c in comments:
-            if str(c.id) == comment_id:
-                c.flagged = False
-                c.reports = []
-                return True
-            if unflag_comment(c.replies):
-                return True
-        return False
-
-    updated = unflag_comment(post.comments)
-
-    if not updated:
+    unflag = unflag_stored_comment if migrated else unflag_embedded_comment
+    cid = parse_comment_id(comment_id)
+    if not await unflag(PydanticObjectId(post_id), cid):
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    await post.save()
+    await resolve_items(request.app, COMMENT, [cid], "dismissed")
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
     return {"message": "Nested comment unflagged"}
 
 
-
-def extract_flagged_comments(comments, post_id, results):
+def walk_comments(comments):
     for comment in comments:
-        if comment.flagged:
-            results.append({
-                "post_id": str(post_id),
-                "comment": comment.dict()
-            })
-        if comment.replies:
-            extract_flagged_comments(comment.replies, post_id, results)
+        yield comment
+        yield from walk_comments(comment.replies)
 
+# Pages of the moderation queue, with the comments and posts they point to
 @router.get("/admin/flagged/comments")
-async def get_flagged_comments():
-    posts = await PostModel.find_all().to_list()
-    results = []
-    for post in posts:
-        extract_flagged_comments(post.comments, post.id, results)
-    return results
-
-
-
-@router.get("/admin/flagged/posts")
-async def get_flagged_posts():
-    return await PostModel.find(PostModel.flagged == True).to_list()
-
 @router.get("/posts/flagged-comments")
-async def get_flagged_comments():
-    flagged_comments = []
-
-    # Get all posts
-    posts = list(posts_collection.find({}))
-
-    for post in posts:
-        post_id = str(post["_id"])
-        post_title = post.get("title", "")
-        post_content = post.get("content", "")
-        comments = post.get("comments", [])
-
-        for comment in comments:
-            # Use the boolean flag to check if this comment is flagged
-            if comment.get("flagged", False):
-                flagged_comments.append({
-                    "post_id": post_id,
-                    "post_title": post_title,
-                    "post_content": post_content,
-                    "comment_id": comment["id"],
-                    "comment": comment
-                })
+@cache_policy(vary_params=("cursor", "limit"), vary_on=VARY_ROLE)
+async def get_flagged_comments(request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    items, cursor = await queue_page(OPEN, cursor, page_size(limit), COMMENT)
+    post_ids = list({ObjectId(item["parent_id"]) for item in items})
+    tag_response(request, MODERATION_QUEUE_TAG, *[f"post:{post_id}" for post_id in post_ids])
+    posts = await PostModel.get_motor_collection().find(
+        {"_id": {"$in": post_ids}}, {"title": 1, "comments_migrated": 1}
+    ).to_list(None)
+    titles = {str(post["_id"]): post.get("title", "") for post in posts}
+
+    wanted = [UUID(item["target_id"]) for item in items]
+    stored = await PostCommentModel.find(In(PostCommentModel.id, wanted)).to_list()
+    comments = {str(comment.id): comment.dict() for comment in stored}
+    # Only the posts these comments are on are still walked
+    unmigrated = [post["_id"] for post in posts if not post.get("comments_migrated")]
+    if unmigrated:
+        targets = {str(comment_id) for comment_id in wanted}
+        for post in await PostModel.find(In(PostModel.id, unmigrated)).to_list():
+            for comment in walk_comments(post.comments):
+                if str(comment.id) in targets:
+                    comments[str(comment.id)] = comment.dict()
+
+    items = await resolve_missing(request.app, COMMENT, items, comments)
+    return {"items": [{
+        "post_id": item["parent_id"],
+        "post_title": titles.get(item["parent_id"], ""),
+        "comment_id": item["target_id"],
+        "comment": comments[item["target_id"]],
+        "report_count": item["report_count"],
+    } for item in items], "next_cursor": cursor}
 
-    return flagged_comments
+@router.get("/admin/flagged/posts")
+@cache_policy(vary_params=("cursor", "limit"), vary_on=VARY_ROLE)
+async def get_flagged_posts(request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    items, cursor = await queue_page(OPEN, cursor, page_size(limit), POST)
+    tag_response(request, MODERATION_QUEUE_TAG, *[f"post:{item['target_id']}" for item in items])
+    posts = await PostModel.find(In(PostModel.id, [ObjectId(item["target_id"]) for item in items])).to_list()
+    posts = {str(post.id): post for post in posts}
+    items = await resolve_missing(request.app, POST, items, posts)
+    return {"items": [posts[item["target_id"]] for item in items], "next_cursor": cursor}
 
 
 @router.post("/posts/{post_id}/comments/{comment_id}/report")
-async def report_comment(post_id: PydanticObjectId, comment_id: str, report: ReportRequest):
-    post = await PostModel.get(post_id)
-    if not post:
+async def report_comment(post_id: PydanticObjectId, comment_id: str, report: ReportRequest, request: Request):
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
     
     user = await UserModel.get(report.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    def apply_report(comment):
-        if any(r.user_id == report.user_id for r in comment.reports):
-            raise HTTPException(status_code=400, detail="You already reported this comment")
-        comment.reports.append(ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username))
-        comment.flagged = True
-        return True
-    
-    if not find_comment_and_apply_action(post.comments, comment_id, apply_report):
-        raise HTTPException(status_code=404, detail="Comment not found")
-    
-    await post.save()
+
+    detail = ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username)
+    cid = parse_comment_id(comment_id)
+    add_report, exists = (
+        (report_stored_comment, stored_comment_exists) if migrated
+        else (report_embedded_comment, embedded_comment_exists)
+    )
+    if not await add_report(post_id, cid, detail):
+        if not await exists(post_id, cid):
+            raise HTTPException(status_code=404, detail="Comment not found")
+        raise HTTPException(status_code=400, detail="You already reported this comment")
+
+    await enqueue_report(request.app, COMMENT, cid, parent_id=post_id)
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
     return {"message": "Comment reported"}
 
 
 @router.post("/posts/{post_id}/report")
-async def report_post(post_id: PydanticObjectId, report: ReportRequest):
-    post = await PostModel.get(post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
-    # prevent duplicate reports by same user
-    if any(r.user_id == report.user_id for r in post.reports):
-        raise HTTPException(status_code=400, detail="You have already reported this post")
+async def report_post(post_id: PydanticObjectId, report: ReportRequest, request: Request):
     user = await UserModel.get(report.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    post.reports.append(ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username))
-
-    # Example threshold logic (optional)
-    if len(post.reports) >= 1:
-        post.flagged = True
+    detail = ReportDetail(user_id=report.user_id, reason=report.reason, user_name=user.username)
+
+    # One report per user, pushed without rewriting the rest of the post
+    post = await PostModel.get_motor_collection().find_one_and_update(
+        {"_id": post_id, "reports.user_id": {"$ne": Binary.from_uuid(report.user_id)}},
+        {"$push": {"reports": Encoder().encode(detail)}, "$set": {"flagged": True}},
+        projection={"reports.user_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if post is None:
+        if not await PostModel.get_motor_collection().count_documents({"_id": post_id}, limit=1):
+            raise HTTPException(status_code=404, detail="Post not found")
+        raise HTTPException(status_code=400, detail="You have already reported this post")
 
-    await post.save()
-    return {"message": "Post reported", "reports": len(post.reports)}
+    await enqueue_report(request.app, POST, post_id)
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    return {"message": "Post reported", "reports": len(post["reports"])}
 
 # Create a new post
 @router.post("/posts", response_model=PostModel)
@@ -256,17 +314,21 @@ async def create_post(request: Request, post_data: PostCreateRequest = Body(...)
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    now = datetime.now(timezone.utc)
     post = PostModel(
         title=post_data.title,
         content=post_data.content,
-        created_at=datetime.now(timezone.utc),
+        created_at=now,
+        last_activity_at=now,
         author_id=current_user.id,
         author=post_data.author,
         likes=[],
         comments=[],
+        comments_migrated=True,
+        comment_count=0,
         views=0
     )
-    await post.insert()
+    await insert_entity(request.app, post)
     
     # Get the user and update their posts array
     if post_data.author.lower() != "anonymous":
@@ -274,90 +336,164 @@ async def create_post(request: Request, post_data: PostCreateRequest = Body(...)
         if user:
             user.posts.append(str(post.id))
             await user.save()
-    
+
+    await invalidate_tags(request.app, "list:posts", f"user:{current_user.username}")
+    await rescore_posts(request.app, [post.id])
     return post
 
-# Get all posts
+async def hot_posts_page(app, cursor: Optional[str], limit: int) -> Optional[dict]:
+    """A page of the hot ranking; None while Redis can't serve it."""
+    if not app.state.redis:
+        return None
+    try:
+        ids, cursor = await hot_page(app, cursor, limit)
+        if not ids and not cursor:
+            await rebuild_hot_ranking(app)
+            ids, cursor = await hot_page(app, cursor, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Hot ranking unavailable: {e}")
+        return None
+    posts = await PostModel.aggregate([
+        {"$match": {"_id": {"$in": [ObjectId(post_id) for post_id in ids]}}},
+        {"$project": POST_SUMMARY_PROJECTION},
+    ]).to_list()
+    rank = {post_id: i for i, post_id in enumerate(ids)}
+    for post in posts:
+        post["_id"] = str(post["_id"])
+    posts.sort(key=lambda post: rank[post["_id"]])
+    return {"posts": posts, "next_cursor": cursor}
+
+# Get a page of the feed, newest or hottest first
 @router.get("/posts")
-async def get_posts():
-    posts = await PostModel.find_all().to_list()
-    return posts
+@cache_policy(vary_params=("cursor", "limit", "sort"))
+async def get_posts(
+    request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+    sort: Literal["new", "hot"] = "new",
+):
+    tag_response(request, "list:posts")
+    limit = page_size(limit)
+    if sort == "hot":
+        page = await hot_posts_page(request.app, cursor, limit)
+        if page is not None:
+            return page
+        # Without Redis the first page falls back to newest; a hot cursor means nothing there
+        if cursor:
+            raise HTTPException(status_code=503, detail="Hot ranking unavailable")
+    posts = await PostModel.aggregate([
+        {"$match": after_cursor(cursor)},
+        {"$sort": NEWEST_FIRST},
+        {"$limit": limit + 1},
+        {"$project": POST_SUMMARY_PROJECTION},
+    ]).to_list()
+    cursor = next_cursor(posts, limit)
+    for post in posts:
+        post["_id"] = str(post["_id"])
+    return {"posts": posts, "next_cursor": cursor}
+
+# Which of the given posts the current user has liked, for the feed's hearts
+@router.get("/posts/liked")
+@cache_policy(vary_params=("ids",), vary_on=VARY_USER)
+async def get_liked_posts(request: Request, ids: str = ""):
+    current_user = await get_current_user(request)
+    post_ids = [ObjectId(post_id) for post_id in ids.split(",") if ObjectId.is_valid(post_id)]
+    # Liking or unliking invalidates the post, and with it this user's answer
+    tag_response(request, *[f"post:{post_id}" for post_id in post_ids[:MAX_PAGE_SIZE]])
+    if not current_user or not post_ids:
+        return {"liked": []}
+    liked = await PostModel.get_motor_collection().find(
+        {"_id": {"$in": post_ids[:MAX_PAGE_SIZE]}, "likes": Binary.from_uuid(current_user.id)}, {"_id": 1}
+    ).to_list(None)
+    return {"liked": [str(post["_id"]) for post in liked]}
 
 # Get a single post by ID
 @router.get("/posts/{post_id}", response_model=PostModel)
-async def get_post(post_id: PydanticObjectId):
-    post = await PostModel.get(post_id)
+@cache_policy(vary_params=(), negative_ttl=NEGATIVE_CACHE_TTL)
+async def get_post(post_id: PydanticObjectId, request: Request):
+    tag_response(request, f"post:{post_id}")
+    post = await get_entity(request.app, PostModel, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    print(post, '----- post details -----')
+    post.views += await pending_views(request.app, post_id, post.views_batch)
     return post
 
+async def toggle_post_like(post_id: PydanticObjectId, user_id: UUID, like: bool) -> Optional[int]:
+    """Like or unlike in one update; the new like count, None if nothing matched."""
+    update = like_update("", user_id, like)
+    if like:
+        update["$max"] = {"last_activity_at": datetime.now(timezone.utc)}
+    post = await PostModel.get_motor_collection().find_one_and_update(
+        {"_id": post_id, "likes": liked_by(user_id, like)},
+        update,
+        projection={"like_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return post["like_count"] if post else None
+
+async def post_exists(post_id) -> bool:
+    return await PostModel.get_motor_collection().find_one({"_id": post_id}, {"_id": 1}) is not None
+
 @router.post("/posts/{post_id}/like")
 async def like_post(post_id: PydanticObjectId, request: Request):
 
     current_user = await get_current_user(request)
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    user_id = current_user.id
-
-    post = await PostModel.get(post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
 
-    if user_id in post.likes:
+    likes_count = await toggle_post_like(post_id, current_user.id, like=True)
+    if likes_count is None:
+        if not await post_exists(post_id):
+            raise HTTPException(status_code=404, detail="Post not found")
         raise HTTPException(status_code=400, detail="User already liked this post")
 
-    post.likes.append(user_id)
-    await post.save()
-    return {"message": "Post liked", "likes_count": len(post.likes)}
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    await rescore_posts(request.app, [post_id])
+    return {"message": "Post liked", "likes_count": likes_count}
 
 @router.post("/posts/{post_id}/unlike")
 async def unlike_post(post_id: PydanticObjectId, request: Request):
     current_user = await get_current_user(request)
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    user_id = current_user.id
 
-    post = await PostModel.get(post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
-    if user_id not in post.likes:
+    likes_count = await toggle_post_like(post_id, current_user.id, like=False)
+    if likes_count is None:
+        if not await post_exists(post_id):
+            raise HTTPException(status_code=404, detail="Post not found")
         raise HTTPException(status_code=400, detail="User has not liked this post")
 
-    post.likes.remove(user_id)
-    await post.save()
-    return {"message": "Post unliked", "likes_count": len(post.likes)}
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    await rescore_posts(request.app, [post_id])
+    return {"message": "Post unliked", "likes_count": likes_count}
 
 @router.delete("/posts/{post_id}")
-async def delete_post(post_id: str):
+async def delete_post(post_id: str, request: Request):
     # Fetch the post from the database (adjust as needed for your ORM)
-    post = await PostModel.get(post_id)
+    post = await get_entity(request.app, PostModel, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
     # Delete the post (this may vary based on your database/ORM)
-    await post.delete()
+    await delete_entity(request.app, post)
+    await PostCommentModel.find(PostCommentModel.post_id == post.id).delete()
+    await resolve_items(request.app, POST, [post.id], "gone")
+    await resolve_children(request.app, COMMENT, [post.id], "gone")
+    await forget_hot_post(request.app, post.id)
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
     
     return {"message": "Post deleted successfully"}
 
-def find_comment_by_id(comments: List[CommentModel], comment_id: UUID) -> Optional[CommentModel]:
-    for c in comments:
-        if c.id == comment_id:
-            return c
-        found = find_comment_by_id(c.replies, comment_id)
-        if found:
-            return found
-    return None
-
 @router.post("/posts/{post_id}/comment")
 async def add_comment(post_id: PydanticObjectId, request: Request, comment_data: CommentRequest = Body(...)):
     current_user = await get_current_user(request)
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated") 
 
-    post = await PostModel.get(post_id)
-    if not post:
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
 
     new_comment = CommentModel(
@@ -370,149 +506,112 @@ async def add_comment(post_id: PydanticObjectId, request: Request, comment_data:
         replies=[]
     )
 
-    if comment_data.parent_id:
-        parent_comment = find_comment_by_id(post.comments, comment_data.parent_id)
-        if not parent_comment:
-            raise HTTPException(status_code=404, detail="Parent comment not found")
-        parent_comment.replies.append(new_comment)
-    else:
-        post.comments.append(new_comment)
-
-    await post.save()
+    add = insert_comment if migrated else push_embedded_comment
+    if not await add(post_id, new_comment):
+        # The comments may have moved stores since the flag was read
+        now_migrated = await comments_migrated(post_id)
+        if now_migrated is None:
+            raise HTTPException(status_code=404, detail="Post not found")
+        if now_migrated != migrated or not comment_data.parent_id:
+            raise HTTPException(status_code=409, detail=MIGRATING)
+        raise HTTPException(status_code=404, detail="Parent comment not found")
+
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    await rescore_posts(request.app, [post_id])
     return {"message": "Comment added successfully", "comment": new_comment}
 
 
 
 @router.get("/posts/{post_id}/comments")
-async def get_comments(post_id: PydanticObjectId):
-    post = await PostModel.get(post_id)
-    if not post:
+@cache_policy(vary_params=("cursor", "depth", "limit", "sort"), negative_ttl=NEGATIVE_CACHE_TTL)
+async def get_comments(
+    post_id: PydanticObjectId, request: Request, cursor: Optional[str] = None,
+    depth: int = DEFAULT_THREAD_DEPTH, limit: int = DEFAULT_THREAD_REPLIES,
+    sort: Literal["old", "new", "top"] = "old",
+):
+    """A page of a post's comments, `depth` levels deep (see commentThreads.py).
+
+    With a cursor (next_cursor, or a comment's replies_cursor) the page holds
+    the comments after it, in the sort order it was made with.
+    """
+    tag_response(request, f"post:{post_id}")
+    parent_id, last = None, None
+    if cursor:
+        parent_id, sort, last = decode_thread_cursor(cursor)
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
-
-    def fetch_replies(comment: CommentModel):
-        """ Recursively fetch replies for a comment, including likes count """
-        return {
-        "id": comment.id,
-        "content": comment.content,
-        "author_id": comment.author_id,
-        "author_name": comment.author_name,
-        "created_at": comment.created_at,
-        "parent_id": comment.parent_id,
-        "likes": [str(like) for like in comment.likes] if comment.likes else [],
-        "likes_count": len(comment.likes) if comment.likes else 0,
-        "replies": [fetch_replies(reply) for reply in comment.replies],
-    }
-
-    # Convert top-level comments to include nested replies and likes
-    comments_with_replies = [fetch_replies(comment) for comment in post.comments if comment.parent_id is None]
-
-    return {"comments": comments_with_replies}
+    if migrated:
+        thread = StoredThread(post_id, sort)
+    else:
+        post = await get_entity(request.app, PostModel, post_id)
+        if not post:
+            raise HTTPException(status_code=404, detail="Post not found")
+        thread = EmbeddedThread(post, sort)
+    return await thread_page(thread, parent_id, last, max(1, min(depth, MAX_THREAD_DEPTH)), page_size(limit))
 
 
-@router.post("/posts/{post_id}/comments/{comment_id}/like")
-async def like_comment(post_id: PydanticObjectId, comment_id: UUID, request: LikeRequest):
-    post = await PostModel.get(post_id)
-    if not post:
+async def set_comment_like(post_id: PydanticObjectId, comment_id: UUID, user_id: UUID, like: bool) -> Optional[int]:
+    """Like or unlike a comment wherever the post keeps them; None if it was already so."""
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
-
-    def find_comment(comments):
-        for comment in comments:
-            if comment.id == comment_id:
-                return comment
-            found = find_comment(comment.replies)
-            if found:
-                return found
-        return None
-
-    comment = find_comment(post.comments)
-    if not comment:
+    toggle, exists = (
+        (toggle_stored_comment_like, stored_comment_exists) if migrated
+        else (toggle_embedded_comment_like, embedded_comment_exists)
+    )
+    likes_count = await toggle(post_id, comment_id, user_id, like)
+    if likes_count is None and not await exists(post_id, comment_id):
         raise HTTPException(status_code=404, detail="Comment not found")
+    return likes_count
 
-    # ✅ Ensure comment.likes is a list before modifying it
-    if comment.likes is None:
-        comment.likes = []
-
-    if request.user_id in comment.likes:
+@router.post("/posts/{post_id}/comments/{comment_id}/like")
+async def like_comment(post_id: PydanticObjectId, comment_id: UUID, request: LikeRequest, http_request: Request):
+    likes_count = await set_comment_like(post_id, comment_id, request.user_id, like=True)
+    if likes_count is None:
         raise HTTPException(status_code=400, detail="User already liked this comment")
 
-    comment.likes.append(request.user_id)
-    await post.save()
-    return {"message": "Comment liked", "likes_count": len(comment.likes)}
+    await forget_entities(http_request.app, PostModel, [post_id])
+    await invalidate_tags(http_request.app, f"post:{post_id}", "list:posts")
+    return {"message": "Comment liked", "likes_count": likes_count}
 
 @router.post("/posts/{post_id}/comments/{comment_id}/unlike")
-async def unlike_comment(post_id: PydanticObjectId, comment_id: UUID, request: LikeRequest):
-    post = await PostModel.get(post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
-    def find_comment(comments):
-        for comment in comments:
-            if comment.id == comment_id:
-                return comment
-            found = find_comment(comment.replies)
-            if found:
-                return found
-        return None
-
-    comment = find_comment(post.comments)
-    if not comment:
-        raise HTTPException(status_code=404, detail="Comment not found")
-
-    if comment.likes is None:
-        comment.likes = []
-
-    if request.user_id not in comment.likes:
+async def unlike_comment(post_id: PydanticObjectId, comment_id: UUID, request: LikeRequest, http_request: Request):
+    likes_count = await set_comment_like(post_id, comment_id, request.user_id, like=False)
+    if likes_count is None:
         raise HTTPException(status_code=400, detail="User has not liked this comment")
 
-    comment.likes.remove(request.user_id)
-    await post.save()
-    return {"message": "Comment unliked", "likes_count": len(comment.likes)}
+    await forget_entities(http_request.app, PostModel, [post_id])
+    await invalidate_tags(http_request.app, f"post:{post_id}", "list:posts")
+    return {"message": "Comment unliked", "likes_count": likes_count}
 
 @router.delete("/posts/{post_id}/comments/{comment_id}")
-async def delete_comment(post_id: str, comment_id: str, user=Depends(get_current_user)):
-    post = await PostModel.get(post_id)
-    if not post:
+async def delete_comment(post_id: str, comment_id: str, request: Request, user=Depends(get_current_user)):
+    migrated = await comments_migrated(post_id)
+    if migrated is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Recursive function to find the comment and its parent list
-    def find_and_remove(comments, comment_id):
-        for idx, comment in enumerate(comments):
-            if str(comment.id) == comment_id:
-                return idx, comments
-            if comment.replies:
-                result = find_and_remove(comment.replies, comment_id)
-                if result is not None:
-                    return result
-        return None
-
-    result = find_and_remove(post.comments, comment_id)
-    if result is None:
+    delete = delete_comment_subtree if migrated else pull_embedded_comment
+    cid = parse_comment_id(comment_id)
+    if not await delete(PydanticObjectId(post_id), cid):
         raise HTTPException(status_code=404, detail="Comment not found")
-    
-    idx, parent_list = result
-    comment_to_delete = parent_list[idx]
-        
-    # Remove the comment
-    parent_list.pop(idx)
-    await post.save()
-    
+
+    await resolve_items(request.app, COMMENT, [cid], "gone")
+    await forget_entities(request.app, PostModel, [post_id])
+    await invalidate_tags(request.app, f"post:{post_id}", "list:posts")
+    await rescore_posts(request.app, [post_id])
     return {"message": "Comment deleted successfully"}
 
 
 # Update the view increment endpoint
 @router.post("/posts/{post_id}/view")
-async def increment_view(post_id: PydanticObjectId):
-    post = await PostModel.get(post_id)
+async def increment_view(post_id: PydanticObjectId, request: Request):
+    # Only the stored count is read; the view itself is written in batches
+    post = await PostModel.get_motor_collection().find_one({"_id": post_id}, {"views": 1, "views_batch": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Initialize views if it doesn't exist
-    if not hasattr(post, 'views') or post.views is None:
-        post.views = 0
-    
-    # Increment view count
-    post.views += 1
-    await post.save()
-    
+
+    pending = await record_view(request.app, post_id, post.get("views_batch"))
+
     # Return the updated view count
-    return {"success": True, "views": post.views}
+    return {"success": True, "views": (post.get("views") or 0) + pending}
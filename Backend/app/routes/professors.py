@@ -1,18 +1,24 @@
-from fastapi import APIRouter, HTTPException, Body, Request
+from fastapi import APIRouter, FastAPI, HTTPException, Body, Request
 from app.models.professor import ProfessorModel, ProfessorReviewModel, ReportDetail
 from beanie import PydanticObjectId  # Needed for MongoDB ObjectId
 from typing import List, Optional, Union
 from app.models.courses import CourseModel
 from app.models.user import UserModel 
 from app.routes.auth import get_current_user
+from app.cache import (
+    tag_response, invalidate_tags, cache_policy, NEGATIVE_CACHE_TTL, VARY_ROLE,
+    get_entity, get_entities, insert_entity, forget_entities, forget_all_entities,
+)
+from app.moderationQueue import PROFESSOR_REVIEW, OPEN, MODERATION_QUEUE_TAG, enqueue_report, resolve_items, queue_page, resolve_missing
+from app.pagination import DEFAULT_PAGE_SIZE, page_size
+from beanie.operators import In
 from pydantic import BaseModel
 from uuid import UUID
-from bson import ObjectId
+from bson import Binary, ObjectId
 
 from app.courseScraper import get_courses_by_professor
 
 from app.models.user import UserModel
-from beanie.operators import In
 
 router = APIRouter()
 REPORT_THRESHOLD = 3
@@ -26,18 +32,37 @@ class ReviewAuthorUpdateRequest(BaseModel):
     old_username: str
     new_username: str
 
+async def update_professor(app: FastAPI, professor_id: UUID, update: dict):
+    """Apply an update to one professor and drop its cached copy.
+
+    Routes write only the fields they change, rather than saving a cached
+    copy of the professor over whatever was written since it was read.
+    """
+    await ProfessorModel.get_motor_collection().update_one({"_id": Binary.from_uuid(professor_id)}, update)
+    await forget_entities(app, ProfessorModel, [professor_id])
+
+async def add_professor_to_courses(app: FastAPI, course_ids: list, professor_id: UUID):
+    """Add the professor to these courses, leaving their reviews alone."""
+    if course_ids:
+        await CourseModel.get_motor_collection().update_many(
+            {"_id": {"$in": course_ids}}, {"$addToSet": {"professors": Binary.from_uuid(professor_id)}}
+        )
+        await forget_entities(app, CourseModel, course_ids)
+
 @router.delete("/professors/reviews/{review_id}")
-async def delete_professor_review(review_id: str):
+async def delete_professor_review(review_id: str, request: Request):
     # 1. Fetch the review
     review = await ProfessorReviewModel.get(review_id)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
 
     await review.delete()
+    await resolve_items(request.app, PROFESSOR_REVIEW, [review.id], "gone")
+    await invalidate_tags(request.app, f"professor:{review.professor_id}")
     return {"message": "Review deleted successfully"}
 
 @router.post("/professors/update-reviews-author")
-async def update_professor_reviews_author(request_data: ReviewAuthorUpdateRequest):
+async def update_professor_reviews_author(request_data: ReviewAuthorUpdateRequest, request: Request):
     # Find all professor reviews where the author field matches the old username.
     # (If you had stored a user id in the review, you would filter by that as well.)
     reviews = await ProfessorReviewModel.find(ProfessorReviewModel.author == request_data.old_username).to_list()
@@ -47,21 +72,23 @@ async def update_professor_reviews_author(request_data: ReviewAuthorUpdateReques
     for review in reviews:
         review.author = request_data.new_username
         await review.save()
+    await invalidate_tags(request.app, *{f"professor:{review.professor_id}" for review in reviews})
     
     return {"message": "Professor review authors updated successfully."}
 
 @router.delete("/admin/professors/reviews/{review_id}")
-async def delete_professor_review(review_id: str):
+async def delete_professor_review(review_id: str, request: Request):
     review = await ProfessorReviewModel.get(review_id)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
 
-    professor = await ProfessorModel.get(review.professor_id)
+    professor = await get_entity(request.app, ProfessorModel, review.professor_id)
     if not professor:
         raise HTTPException(status_code=404, detail="Associated professor not found")
 
     # Delete the review
     await review.delete()
+    await resolve_items(request.app, PROFESSOR_REVIEW, [review.id], "removed")
 
     # Fetch remaining reviews for that professor
     reviews = await ProfessorReviewModel.find({"professor_id": professor.id}).to_list()
@@ -86,12 +113,13 @@ async def delete_professor_review(review_id: str):
         professor.ratings.strictness = 0.0
         professor.ratings.total_reviews = 0
 
-    await professor.save()
+    await update_professor(request.app, professor.id, {"$set": {"ratings": professor.ratings.dict()}})
+    await invalidate_tags(request.app, f"professor:{professor.id}", "list:professors")
     return {"message": "Professor review deleted and ratings updated"}
 
 
 @router.post("/admin/professors/reviews/{review_id}/unflag")
-async def unflag_professor_review(review_id: str):
+async def unflag_professor_review(review_id: str, request: Request):
     review = await ProfessorReviewModel.get(review_id)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
@@ -99,16 +127,24 @@ async def unflag_professor_review(review_id: str):
     review.flagged = False
     review.reports = []
     await review.save()
+    await resolve_items(request.app, PROFESSOR_REVIEW, [review.id], "dismissed")
+    await invalidate_tags(request.app, f"professor:{review.professor_id}")
     return {"message": "Professor review unflagged"}
 
 
 @router.get("/admin/flagged/professor-reviews")
-async def get_flagged_professor_reviews():
-    # Fetch all professors whose reviews were flagged
-    flagged_reviews = await ProfessorReviewModel.find(ProfessorReviewModel.flagged == True).to_list()
+@cache_policy(vary_params=("cursor", "limit"), vary_on=VARY_ROLE)
+async def get_flagged_professor_reviews(request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    items, cursor = await queue_page(OPEN, cursor, page_size(limit), PROFESSOR_REVIEW)
+    reviews = await ProfessorReviewModel.find(
+        In(ProfessorReviewModel.id, [ObjectId(item["target_id"]) for item in items])
+    ).to_list()
+    reviews = {str(review.id): review for review in reviews}
+    flagged_reviews = [reviews[item["target_id"]] for item in await resolve_missing(request.app, PROFESSOR_REVIEW, items, reviews)]
     professor_ids = {review.professor_id for review in flagged_reviews}
+    tag_response(request, MODERATION_QUEUE_TAG, *[f"professor:{professor_id}" for professor_id in professor_ids])
 
-    professors = await ProfessorModel.find(In(ProfessorModel.id, list(professor_ids))).to_list()
+    professors = await get_entities(request.app, ProfessorModel, list(professor_ids))
     professor_map = {str(prof.id): prof.name for prof in professors}
 
     response = []
@@ -123,10 +159,10 @@ async def get_flagged_professor_reviews():
             "reports": [r.dict() for r in review.reports] if review.reports else []
         })
 
-    return response
+    return {"items": response, "next_cursor": cursor}
 
 @router.post("/professors/reviews/{review_id}/report")
-async def report_professor_review(review_id: str, report: ReportRequest):
+async def report_professor_review(review_id: str, report: ReportRequest, request: Request):
     review = await ProfessorReviewModel.get(review_id)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
@@ -142,25 +178,24 @@ async def report_professor_review(review_id: str, report: ReportRequest):
         review.flagged = True   # Flag review if threshold met
 
     await review.save()
+    await enqueue_report(request.app, PROFESSOR_REVIEW, review.id, parent_id=review.professor_id)
+    await invalidate_tags(request.app, f"professor:{review.professor_id}")
     return {"message": "Review reported", "reports": len(review.reports)}
 
 # Fetch detailed professor page
 @router.get("/professors/{professor_id}/page")
-async def get_professor_page(professor_id: UUID):
-    professor = await ProfessorModel.get(professor_id)
+@cache_policy(vary_params=(), negative_ttl=NEGATIVE_CACHE_TTL, soft_ttl=300)
+async def get_professor_page(professor_id: UUID, request: Request):
+    tag_response(request, f"professor:{professor_id}")
+    professor = await get_entity(request.app, ProfessorModel, professor_id)
     if not professor:
         raise HTTPException(status_code=404, detail="Professor not found")
 
-    # ✅ Correct way: lookup by ObjectId
-    current_courses = await CourseModel.find({
-        "_id": {"$in": professor.current_courses}
-    }).to_list()
-
-    past_courses = await CourseModel.find({
-        "_id": {"$in": professor.past_courses}
-    }).to_list()
+    current_courses = await get_entities(request.app, CourseModel, professor.current_courses)
+    past_courses = await get_entities(request.app, CourseModel, professor.past_courses)
 
     reviews = await ProfessorReviewModel.find({"professor_id": professor_id}).to_list()
+    tag_response(request, *[f"course:{c.id}" for c in current_courses + past_courses])
 
     return {
         "id": professor.id,
@@ -185,13 +220,16 @@ class ProfessorReviewCreate(BaseModel):
 
 # ✅ Create a new professor
 @router.post("/professors", response_model=ProfessorModel)
-async def create_professor(professor: ProfessorModel):
-    await professor.insert()
+async def create_professor(professor: ProfessorModel, request: Request):
+    await insert_entity(request.app, professor)
+    await invalidate_tags(request.app, "list:professors")
     return professor
 
 # ✅ Get all professors
 @router.get("/professors")
-async def get_professors(page: int = 0, limit: int = 20):
+@cache_policy(vary_params=("page", "limit"))
+async def get_professors(request: Request, page: int = 0, limit: int = 20):
+    tag_response(request, "list:professors")
     skip = page * limit
     professors = await ProfessorModel.find_all().skip(skip).limit(limit).to_list()
 
@@ -212,15 +250,17 @@ async def get_professors(page: int = 0, limit: int = 20):
 
 # ✅ Get a single professor by ID
 @router.get("/professors/{professor_id}", response_model=ProfessorModel)
-async def get_professor(professor_id: PydanticObjectId):
-    professor = await ProfessorModel.get(professor_id)
+async def get_professor(professor_id: PydanticObjectId, request: Request):
+    tag_response(request, f"professor:{professor_id}")
+    professor = await get_entity(request.app, ProfessorModel, professor_id)
     if not professor:
         raise HTTPException(status_code=404, detail="Professor not found")
     return professor
 
 # ✅ Get all reviews for a professor
 @router.get("/professors/{professor_id}/reviews", response_model=List[ProfessorReviewModel])
-async def get_professor_reviews(professor_id: UUID):
+async def get_professor_reviews(professor_id: UUID, request: Request):
+    tag_response(request, f"professor:{professor_id}")
     return await ProfessorReviewModel.find(ProfessorReviewModel.professor_id == professor_id).to_list()
 
 # ✅ Add a review for a professor
@@ -239,7 +279,7 @@ async def add_professor_review(professor_id: UUID, review: ProfessorReviewCreate
     review_data = ProfessorReviewModel(professor_id=professor_id, **review.dict())
     await review_data.insert()
 
-    # Step 2: Fetch the professor
+    # Step 2: Fetch the professor, fresh: the ratings below build on the current ones
     professor = await ProfessorModel.get(professor_id)
     if not professor:
         raise HTTPException(status_code=404, detail="Professor not found")
@@ -258,8 +298,8 @@ async def add_professor_review(professor_id: UUID, review: ProfessorReviewCreate
     ratings.total_reviews = total
 
     # Step 4: Save professor
-    professor.ratings = ratings
-    await professor.save()
+    await update_professor(request.app, professor.id, {"$set": {"ratings": ratings.dict()}})
+    await invalidate_tags(request.app, f"professor:{professor_id}", "list:professors")
 
     return review_data
 
@@ -270,7 +310,7 @@ class LikeReviewRequest(BaseModel):
 
 # Like/unlike a professor review
 @router.post("/professors/reviews/{review_id}/like", response_model=ProfessorReviewModel)
-async def like_professor_review(review_id: str, like_request: LikeReviewRequest = Body(...)):
+async def like_professor_review(review_id: str, request: Request, like_request: LikeReviewRequest = Body(...)):
     try:
         # Find the review - try both UUID and string ID approaches
         review = None
@@ -301,6 +341,7 @@ async def like_professor_review(review_id: str, like_request: LikeReviewRequest
         
         # Save the updated review
         await review.save()
+        await invalidate_tags(request.app, f"professor:{review.professor_id}")
         return review
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing like: {str(e)}")
@@ -312,9 +353,10 @@ class LinkCoursesRequest(BaseModel):
 @router.post("/professors/{professor_id}/link-courses")
 async def link_courses_to_professor(
         professor_id: UUID,
-        body: LinkCoursesRequest
+        body: LinkCoursesRequest,
+        request: Request
 ):
-    professor = await ProfessorModel.get(professor_id)
+    professor = await get_entity(request.app, ProfessorModel, professor_id)
     if not professor:
         raise HTTPException(status_code=404, detail="Professor not found")
 
@@ -325,18 +367,19 @@ async def link_courses_to_professor(
     matched_codes = {c.title.split(" ")[0] for c in matched_courses}
     matched_ids = [c.id for c in matched_courses]
 
-    if body.current:
-        professor.current_courses = list(set(professor.current_courses + matched_ids))
-    else:
-        professor.past_courses = list(set(professor.past_courses + matched_ids))
-
-    await professor.save()
+    field = "current_courses" if body.current else "past_courses"
+    await update_professor(request.app, professor.id, {"$addToSet": {field: {"$each": matched_ids}}})
 
     # ✅ Also add the professor to each matched course
-    for course in matched_courses:
-        if professor.id not in course.professors:
-            course.professors.append(professor.id)
-            await course.save()
+    await add_professor_to_courses(request.app, matched_ids, professor.id)
+
+    await invalidate_tags(
+        request.app,
+        f"professor:{professor.id}",
+        "list:professors",
+        "list:courses",
+        *[f"course:{c.id}" for c in matched_courses]
+    )
 
     return {
         "linked": [f"{c.title}" for c in matched_courses],
@@ -344,9 +387,10 @@ async def link_courses_to_professor(
     }
 
 @router.post("/professors/link-all-courses")
-async def link_all_professors_to_courses():
+async def link_all_professors_to_courses(request: Request):
     professors = await ProfessorModel.find_all().to_list()
     results = []
+    updated_tags = {"list:professors", "list:courses"}
 
     for prof in professors:
         print(f"Linking for: {prof.name}")
@@ -366,8 +410,8 @@ async def link_all_professors_to_courses():
                 continue
 
             # Add prof ID to course
-            course.professors = list(set(course.professors + [prof.id]))
-            await course.save()
+            await add_professor_to_courses(request.app, [course.id], prof.id)
+            updated_tags.add(f"course:{course.id}")
 
             # Link course to professor
             if session == "20251":  # Winter
@@ -375,9 +419,10 @@ async def link_all_professors_to_courses():
             elif session == "20249":  # Fall
                 past_ids.append(course.id)
 
-        prof.current_courses = list(set(prof.current_courses + current_ids))
-        prof.past_courses = list(set(prof.past_courses + past_ids))
-        await prof.save()
+        await update_professor(request.app, prof.id, {"$addToSet": {
+            "current_courses": {"$each": current_ids}, "past_courses": {"$each": past_ids},
+        }})
+        updated_tags.add(f"professor:{prof.id}")
 
         results.append({
             "professor": prof.name,
@@ -385,9 +430,16 @@ async def link_all_professors_to_courses():
             "linked_past": len(past_ids)
         })
 
+    await invalidate_tags(request.app, *updated_tags)
     return {"summary": sorted(results, key=lambda x: x["professor"].lower())}
 
 @router.delete("/professors/delete_all")
-async def delete_all_professors():
+async def delete_all_professors(request: Request):
+    # Each professor's own pages are tagged with its id only; raw ids are Binary UUIDs
+    deleted = await ProfessorModel.get_motor_collection().find({}, {"_id": 1}).to_list(None)
     result = await ProfessorModel.delete_all()
+    await forget_all_entities(request.app, ProfessorModel)
+    await invalidate_tags(
+        request.app, "list:professors", *(f"professor:{professor['_id'].as_uuid()}" for professor in deleted)
+    )
     return {"message": f"✅ Deleted {result.deleted_count} professors from the database"}
@@ -1,7 +1,8 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from app.models.posts import PostModel
 from app.models.professor import ProfessorModel
 from app.models.courses import CourseModel
+from app.cache import tag_response, cache_policy
 from fuzzywuzzy import fuzz
 from typing import List, Dict
 import re
@@ -9,7 +10,9 @@ import re
 router = APIRouter(prefix="/api") 
 
 @router.get("/search/posts")  
-async def searchPosts(query: str):
+@cache_policy(vary_params=("query",))
+async def searchPosts(query: str, request: Request):
+    tag_response(request, "list:posts")
     query = query.lower()
     posts = await PostModel.find_all().to_list()
     postsList = []
@@ -23,7 +26,9 @@ async def searchPosts(query: str):
     }
 
 @router.get("/search/professors")  
-async def searchProfessors(query: str):
+@cache_policy(vary_params=("query",))
+async def searchProfessors(query: str, request: Request):
+    tag_response(request, "list:professors")
     query = query.lower()
     profs = await ProfessorModel.find_all().to_list()
     profList = []
@@ -45,7 +50,9 @@ async def searchProfessors(query: str):
     }
 
 @router.get("/search/courses")  
-async def searchPosts(query: str):
+@cache_policy(vary_params=("query",))
+async def searchPosts(query: str, request: Request):
+    tag_response(request, "list:courses")
     query = query.lower()
     courses = await CourseModel.find_all().to_list()
     courseList = []
@@ -68,7 +75,9 @@ def fuzzy_match(query: str, text: str, threshold: int = 60) -> bool:
     return ratio >= threshold
 
 @router.get("/search/suggestions")
-async def get_search_suggestions(query: str, type: str):
+@cache_policy(vary_params=("query", "type"), soft_ttl=60)
+async def get_search_suggestions(query: str, type: str, request: Request):
+    tag_response(request, f"list:{type}")
     if not query:
         return []
         
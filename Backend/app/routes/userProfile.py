@@ -1,36 +1,46 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from app.models.posts import PostModel
 from app.models.user import UserModel
-from beanie import PydanticObjectId
+from bson import Binary
+from typing import Optional
+from app.cache import tag_response, invalidate_tags, cache_policy
+from app.pagination import DEFAULT_PAGE_SIZE, NEWEST_FIRST, after_cursor, page_size, next_cursor
+from app.routes.posts import POST_SUMMARY_PROJECTION
+import re
 
 router = APIRouter()
 
+# Posted anonymously: the author is recorded but not shown on their profile
+ANONYMOUS = re.compile("^anonymous$", re.IGNORECASE)
+
 @router.get("/profile/{username}")
-async def get_user_profile(username: str):
+@cache_policy(vary_params=("cursor", "limit"))
+async def get_user_profile(username: str, request: Request, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    # The summaries' counts change with any post write, which invalidates list:posts
+    tag_response(request, f"user:{username}", "list:posts")
     user = await UserModel.find_one(UserModel.username == username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Fetch complete post objects for each post ID
-    posts = []
-    for post_id in user.posts:
-        try:
-            post = await PostModel.get(PydanticObjectId(post_id))
-            if post:
-                posts.append(post)
-        except:
-            continue
-    
-    # Sort posts by created_at
-    posts.sort(key=lambda x: x.created_at, reverse=True)
-    
-    # Create response with user data and complete post objects
+
+    # A page of the user's posts, newest first, off the (author_id, created_at) index
+    limit = page_size(limit)
+    posts = await PostModel.aggregate([
+        {"$match": {"author_id": Binary.from_uuid(user.id), "author": {"$not": ANONYMOUS}, **after_cursor(cursor)}},
+        {"$sort": NEWEST_FIRST},
+        {"$limit": limit + 1},
+        {"$project": POST_SUMMARY_PROJECTION},
+    ]).to_list()
+    cursor = next_cursor(posts, limit)
+    for post in posts:
+        post["_id"] = str(post["_id"])
+
     user_data = user.dict()
     user_data['posts'] = posts
+    user_data['next_cursor'] = cursor
     return user_data
 
 @router.put("/profile/{username}")
-async def update_user_profile(username: str, profile_data: dict):
+async def update_user_profile(username: str, profile_data: dict, request: Request):
     user = await UserModel.find_one(UserModel.username == username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -47,4 +57,5 @@ async def update_user_profile(username: str, profile_data: dict):
         user.username = profile_data["username"]
     
     await user.save()
+    await invalidate_tags(request.app, f"user:{username}", f"user:{user.username}")
     return user
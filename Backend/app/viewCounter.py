@@ -0,0 +1,191 @@
+"""Write-behind post view counts.
+
+Opening a post used to load and save the whole document to add one to
+views. Views are now counted in a Redis hash, or in this process while Redis
+isn't available, and a background task adds the accumulated deltas to MongoDB
+with one unordered bulk_write every VIEW_FLUSH_INTERVAL seconds.
+
+A flush first renames the pending hash to FLUSHING_KEY and gives it a batch
+id, so views keep landing in a fresh hash while it writes. Each post's $inc
+also sets views_batch to that id, in the same update, and only applies to a
+post whose views_batch isn't that id yet. Readers add the pending hash to the
+stored count, and the flushing one unless the post already has its batch:
+the count never goes back or counts a view twice, and retrying a batch that
+failed, or whose worker died mid-flush, writes each post once. One worker
+flushes at a time.
+
+Views counted in this process are taken out of local_pending for the write
+and put back if it fails.
+"""
+from fastapi import FastAPI
+from collections import Counter
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.cache import CACHE_NAMESPACE, forget_entities, invalidate_tags
+from app.cacheMiddleware import RELEASE_LOCK_SCRIPT
+from app.models.posts import PostModel
+from app.hotPosts import rescore_posts
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", 5))
+
+# post id -> views not yet in MongoDB
+PENDING_KEY = f"{CACHE_NAMESPACE}views:pending"
+# The batch being written, renamed from PENDING_KEY; BATCH_FIELD holds its id
+FLUSHING_KEY = f"{CACHE_NAMESPACE}views:flushing"
+BATCH_FIELD = "batch"
+FLUSH_LOCK_KEY = f"{CACHE_NAMESPACE}views:flush-lock"
+FLUSH_LOCK_MS = 30000
+
+# The id of the batch in FLUSHING_KEY, after moving PENDING_KEY there if
+# there wasn't one (or giving one left by an older version an id); nil if
+# there's nothing to flush
+START_BATCH_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 0 then
+    if redis.call('exists', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+end
+redis.call('hsetnx', KEYS[2], ARGV[2], ARGV[1])
+return redis.call('hget', KEYS[2], ARGV[2])
+"""
+
+# Fallback while Redis is down or not configured
+local_pending = Counter()
+
+
+def unflushed(flushing, batch, views_batch) -> int:
+    """The flushing batch's views for a post, unless they're already in views."""
+    if batch is not None and batch.decode() == views_batch:
+        return 0
+    return int(flushing or 0)
+
+async def record_view(app: FastAPI, post_id, views_batch: str = None) -> int:
+    """Count a view; returns the views not yet in MongoDB, this one included.
+
+    views_batch is the post's, read along with the views these are added to.
+    """
+    post_id = str(post_id)
+    if app.state.redis:
+        try:
+            pipe = app.state.redis.pipeline(transaction=False)
+            pipe.hincrby(PENDING_KEY, post_id, 1)
+            pipe.hmget(FLUSHING_KEY, [post_id, BATCH_FIELD])
+            pending, (flushing, batch) = await pipe.execute()
+            return pending + unflushed(flushing, batch, views_batch) + local_pending[post_id]
+        except Exception as e:
+            logger.error(f"Failed to count view in Redis: {e}")
+    local_pending[post_id] += 1
+    return local_pending[post_id]
+
+async def pending_views(app: FastAPI, post_id, views_batch: str = None) -> int:
+    """Views counted for a post but not yet written to MongoDB."""
+    post_id = str(post_id)
+    pending = local_pending[post_id]
+    if app.state.redis:
+        try:
+            pipe = app.state.redis.pipeline(transaction=False)
+            pipe.hget(PENDING_KEY, post_id)
+            pipe.hmget(FLUSHING_KEY, [post_id, BATCH_FIELD])
+            waiting, (flushing, batch) = await pipe.execute()
+            pending += int(waiting or 0) + unflushed(flushing, batch, views_batch)
+        except Exception as e:
+            logger.error(f"Failed to read pending views: {e}")
+    return pending
+
+
+async def write_views(deltas: dict, batch: str = None) -> dict:
+    """$inc every post's views in one bulk_write; returns the deltas that weren't written.
+
+    With a batch id, posts that already have it are skipped and the rest get it.
+    """
+    post_ids = [post_id for post_id in deltas if ObjectId.is_valid(post_id)]
+    if not post_ids:
+        return {}
+    operations = [
+        UpdateOne({"_id": ObjectId(post_id), "views_batch": {"$ne": batch}},
+                  {"$inc": {"views": deltas[post_id]}, "$set": {"views_batch": batch}})
+        if batch else UpdateOne({"_id": ObjectId(post_id)}, {"$inc": {"views": deltas[post_id]}})
+        for post_id in post_ids
+    ]
+    try:
+        await PostModel.get_motor_collection().bulk_write(operations, ordered=False)
+        return {}
+    except BulkWriteError as e:
+        failed = {post_ids[error["index"]] for error in e.details.get("writeErrors", [])}
+        logger.error(f"Failed to write views for {len(failed)} posts")
+        return {post_id: deltas[post_id] for post_id in failed}
+    except Exception as e:
+        # Unknown how much was applied; without a batch id, retrying may count some views twice
+        logger.error(f"Failed to write views: {e}")
+        return {post_id: deltas[post_id] for post_id in post_ids}
+
+async def forget_views_written(app: FastAPI, post_ids: list):
+    """Drop the cached posts, and post pages, whose views were just written.
+
+    Their cached views no longer add up with the smaller pending count.
+    """
+    if post_ids:
+        await forget_entities(app, PostModel, post_ids)
+        await invalidate_tags(app, *[f"post:{post_id}" for post_id in post_ids])
+
+async def flush_local_views(app: FastAPI):
+    if not local_pending:
+        return
+    # Out of the count while written, rather than in it twice once written
+    deltas = dict(local_pending)
+    local_pending.clear()
+    failed = await write_views(deltas)
+    local_pending.update(failed)
+    written = [post_id for post_id in deltas if post_id not in failed]
+    await forget_views_written(app, written)
+    await rescore_posts(app, written)
+
+async def flush_redis_views(app: FastAPI):
+    redis = app.state.redis
+    owner = uuid.uuid4().hex
+    if not await redis.set(FLUSH_LOCK_KEY, owner, nx=True, px=FLUSH_LOCK_MS):
+        return
+    try:
+        # An existing batch failed or was abandoned; finish it before taking more
+        batch = await redis.eval(START_BATCH_SCRIPT, 2, PENDING_KEY, FLUSHING_KEY, uuid.uuid4().hex, BATCH_FIELD)
+        if batch is None:
+            return  # nothing pending
+        fields = await redis.hgetall(FLUSHING_KEY)
+        deltas = {post_id.decode(): int(count) for post_id, count in fields.items() if post_id.decode() != BATCH_FIELD}
+        failed = await write_views(deltas, batch.decode())
+        written = [post_id for post_id in deltas if post_id not in failed]
+        if written:
+            await forget_views_written(app, written)
+            # Views count toward the hot ranking too
+            await rescore_posts(app, written)
+        if not failed:
+            await redis.delete(FLUSHING_KEY)
+    finally:
+        await redis.eval(RELEASE_LOCK_SCRIPT, 1, FLUSH_LOCK_KEY, owner)
+
+async def flush_views(app: FastAPI):
+    await flush_local_views(app)
+    if app.state.redis:
+        try:
+            await flush_redis_views(app)
+        except Exception as e:
+            logger.error(f"Failed to flush views from Redis: {e}")
+
+
+async def flush_views_periodically(app: FastAPI):
+    """Background task: write pending views every VIEW_FLUSH_INTERVAL seconds."""
+    try:
+        while True:
+            await asyncio.sleep(VIEW_FLUSH_INTERVAL)
+            await flush_views(app)
+    finally:
+        # Shutting down: don't leave this process's views behind
+        await flush_views(app)
@@ -0,0 +1,41 @@
+"""Tests run against mongomock, an in-memory MongoDB, so they need no server."""
+import asyncio
+import os
+import sys
+import pytest
+
+# Read when the app is imported
+os.environ.setdefault("EMAIL_PORT", "25")
+os.environ.setdefault("JWT_SECRET", "test")
+os.environ.setdefault("JWT_REFRESH_SECRET", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock.aggregate
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+
+
+# mongomock has no $round, which the rating pipelines use
+parse_expression = mongomock.aggregate._Parser.parse
+
+def parse_with_round(parser, expression):
+    if isinstance(expression, dict) and list(expression) == ["$round"]:
+        value, places = expression["$round"]
+        value = parser.parse(value)
+        return None if value is None else round(value, places)
+    return parse_expression(parser, expression)
+
+mongomock.aggregate._Parser.parse = parse_with_round
+
+
+@pytest.fixture
+def run():
+    """Run coroutines against a fresh database."""
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(init_beanie(
+        AsyncMongoMockClient()["UFound"], document_models=[PostModel, PostCommentModel, CourseModel]
+    ))
+    yield loop.run_until_complete
+    loop.close()
@@ -0,0 +1,145 @@
+"""Writes that bypass the API invalidate the cache through the change stream.
+
+Change streams need a real replica set, so these run only when
+TEST_REPLICA_SET_URI points at one (see changeStreams.py for a single-node
+setup), e.g.
+
+    TEST_REPLICA_SET_URI=mongodb://localhost:27017/?replicaSet=rs0 python -m pytest tests
+
+Redis is taken from TEST_REDIS_URL, by default database 15 on localhost.
+Each run uses, and then drops, a database of its own.
+"""
+import asyncio
+import os
+import time
+from uuid import uuid4
+import pytest
+import redis.asyncio as redis
+from beanie import init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+from app import changeStreams
+from app.cache import RESPONSE_PREFIX, tag_cache_key
+from app.main import app
+from app.models.posts import PostModel, PostCommentModel
+from app.models.courses import CourseModel
+from app.models.professor import ProfessorModel, ProfessorReviewModel
+from app.redisClient import CircuitBreakerRedis
+
+REPLICA_SET_URI = os.getenv("TEST_REPLICA_SET_URI")
+REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+# How long the consumer gets to apply a change
+INVALIDATION_TIMEOUT = 10.0
+
+pytestmark = pytest.mark.skipif(not REPLICA_SET_URI, reason="TEST_REPLICA_SET_URI is not set")
+
+
+async def cache_response(path: str, tag: str) -> str:
+    key = f"{RESPONSE_PREFIX}GET:{path}"
+    await app.state.redis.set(key, b"cached")
+    await tag_cache_key(app, key, [tag])
+    return key
+
+async def invalidated(key: str) -> bool:
+    deadline = time.monotonic() + INVALIDATION_TIMEOUT
+    while time.monotonic() < deadline:
+        if not await app.state.redis.exists(key):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """Follow the change stream of a fresh database; yields (run, server version)."""
+    loop = asyncio.new_event_loop()
+    client = AsyncIOMotorClient(REPLICA_SET_URI)
+    db = client[f"UFoundTest{uuid4().hex[:8]}"]
+    cache = redis.Redis.from_url(REDIS_URL)
+
+    async def start():
+        hello = await client.admin.command("hello")
+        if "setName" not in hello:
+            pytest.skip("TEST_REPLICA_SET_URI is not a replica set")
+        try:
+            await cache.ping()
+        except redis.ConnectionError:
+            pytest.skip(f"No Redis at {REDIS_URL}")
+        await init_beanie(db, document_models=[
+            PostModel, PostCommentModel, CourseModel, ProfessorModel, ProfessorReviewModel,
+        ])
+        return (await client.server_info())["versionArray"]
+
+    try:
+        version = loop.run_until_complete(start())
+    except BaseException:
+        loop.run_until_complete(cache.aclose())
+        client.close()
+        loop.close()
+        raise
+    monkeypatch.setattr(changeStreams, "db", db)
+    monkeypatch.setattr(changeStreams, "tokens_collection", db["change_stream_tokens"])
+    monkeypatch.setattr(app.state, "redis", CircuitBreakerRedis(cache))
+    consumer = loop.create_task(changeStreams.consume_changes(app))
+
+    async def following():
+        # The stream starts from now once it's open: poke a post until a change shows up
+        post = PostModel(title="ready", content="c")
+        await post.insert()
+        key = await cache_response(f"/api/posts/{post.id}", f"post:{post.id}")
+        deadline = time.monotonic() + INVALIDATION_TIMEOUT
+        while await app.state.redis.exists(key):
+            assert not consumer.done(), consumer.exception()
+            assert time.monotonic() < deadline, "change stream never started"
+            await PostModel.get_motor_collection().update_one({"_id": post.id}, {"$inc": {"like_count": 1}})
+            await asyncio.sleep(0.1)
+
+    try:
+        loop.run_until_complete(following())
+        yield loop.run_until_complete, version
+    finally:
+        consumer.cancel()
+        loop.run_until_complete(asyncio.gather(consumer, return_exceptions=True))
+        loop.run_until_complete(client.drop_database(db.name))
+        loop.run_until_complete(cache.aclose())
+        client.close()
+        loop.close()
+
+
+def test_out_of_band_update_invalidates_post(stream):
+    run, _ = stream
+
+    async def scenario():
+        post, other = PostModel(title="t", content="c"), PostModel(title="o", content="c")
+        await post.insert()
+        await other.insert()
+        key = await cache_response(f"/api/posts/{post.id}", f"post:{post.id}")
+        other_key = await cache_response(f"/api/posts/{other.id}", f"post:{other.id}")
+        # As fix_likes.py or the mongo shell would, without the API
+        await PostModel.get_motor_collection().update_one({"_id": post.id}, {"$set": {"title": "edited"}})
+        return await invalidated(key), await app.state.redis.exists(other_key)
+
+    gone, other_left = run(scenario())
+    assert gone
+    assert other_left
+
+
+def test_out_of_band_comment_delete_invalidates_its_post(stream):
+    run, version = stream
+    if version < [6, 0]:
+        pytest.skip("Change stream pre-images need MongoDB 6.0")
+
+    async def scenario():
+        post, other = PostModel(title="t", content="c"), PostModel(title="o", content="c")
+        await post.insert()
+        await other.insert()
+        comment = PostCommentModel(post_id=post.id, path="a", content="c", author_id=uuid4(), author_name="u")
+        await comment.insert()
+        key = await cache_response(f"/api/posts/{post.id}/comments", f"post:{post.id}")
+        other_key = await cache_response(f"/api/posts/{other.id}/comments", f"post:{other.id}")
+        # The delete event carries only the comment's _id; its post comes from the pre-image
+        await PostCommentModel.get_motor_collection().delete_one({"_id": comment.id})
+        return await invalidated(key), await app.state.redis.exists(other_key)
+
+    gone, other_left = run(scenario())
+    assert gone
+    assert other_left
@@ -0,0 +1,55 @@
+"""like_count stays equal to len(likes) however likes and other writes interleave."""
+import asyncio
+import random
+from datetime import datetime, timezone
+from uuid import uuid4
+from bson import Binary
+from app.models.posts import PostModel
+from app.models.courses import CourseModel, ReviewModel, ReportDetail
+from app.routes.posts import toggle_post_like
+from app.routes.courses import add_review, report_review
+
+
+def review(content: str, likes=()) -> ReviewModel:
+    return ReviewModel(content=content, ratingE=4, ratingMD=2, ratingAD=3, author="a", likes=list(likes), like_count=len(likes))
+
+
+def test_concurrent_post_likes(run):
+    async def scenario():
+        post = PostModel(title="t", content="c", last_activity_at=datetime.now(timezone.utc))
+        await post.insert()
+        users = [uuid4() for _ in range(20)]
+        calls = [(user, like) for user in users for like in (True, True, False, True)]
+        random.Random(0).shuffle(calls)
+        await asyncio.gather(*(toggle_post_like(post.id, user, like) for user, like in calls))
+        return await PostModel.get_motor_collection().find_one({"_id": post.id})
+
+    post = run(scenario())
+    assert post["like_count"] == len(post["likes"]) == len(set(post["likes"]))
+
+
+def test_review_writes_keep_likes(run):
+    # mongomock can't $addToSet or $pull under reviews.N, so the likes are
+    # there from the start, and the writes around them mustn't undo any
+    users = [uuid4() for _ in range(10)]
+
+    async def scenario():
+        course = CourseModel(title="CSC108", description="d", prerequisites="", exclusions="", distribution="",
+                             reviews=[review("liked", users)])
+        await course.insert()
+        stored = await CourseModel.get_motor_collection().find_one({"_id": course.id})
+        created_at = stored["reviews"][0]["created_at"]
+        reporters = [ReportDetail(user_id=uuid4(), user_name="r", reason="spam") for _ in range(3)]
+        await asyncio.gather(
+            *(add_review(course.id, review(f"new {i}")) for i in range(3)),
+            *(report_review(course.id, 0, created_at, report) for report in reporters),
+        )
+        return await CourseModel.get_motor_collection().find_one({"_id": course.id})
+
+    course = run(scenario())
+    liked = course["reviews"][0]
+    assert liked["like_count"] == len(liked["likes"]) == 10
+    assert set(liked["likes"]) == {Binary.from_uuid(user) for user in users}
+    assert len(liked["reports"]) == 3 and liked["flagged"]
+    assert len(course["reviews"]) == 4
+    assert course["ratings"]["average_rating_E"] == 4.0
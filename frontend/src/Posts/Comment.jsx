@@ -7,7 +7,7 @@ import ReportDialog from "./Reporting.jsx";
 import { useColorMode } from '../theme/ColorModeContext';
 import { FaTrash } from "react-icons/fa";
 
-const Comment = ({ comment, postId, handleReply, handleLike, handleUnlike, depth, handleDelete }) => {
+const Comment = ({ comment, postId, handleReply, handleLike, handleUnlike, depth, handleDelete, handleLoadReplies }) => {
     const [replyText, setReplyText] = useState("");
     const [showReplyInput, setShowReplyInput] = useState(false);
     const [user, setUser] = useState(null);
@@ -159,11 +159,27 @@ const Comment = ({ comment, postId, handleReply, handleLike, handleUnlike, depth
                             handleLike={handleLike}
                             handleUnlike={handleUnlike}
                             handleDelete={handleDelete}
+                            handleLoadReplies={handleLoadReplies}
                             depth={depth + 1}
                         />
                     ))}
                 </VStack>
             )}
+
+            {/* Replies the thread was cut short of */}
+            {comment.replies_cursor && (
+                <Text
+                    mt={2}
+                    ml={6}
+                    fontSize="sm"
+                    cursor="pointer"
+                    onClick={() => handleLoadReplies(comment.id, comment.replies_cursor)}
+                    color={colorMode === 'light' ? 'blue.500' : 'blue.300'}
+                    _hover={{ textDecoration: "underline" }}
+                >
+                    Show {comment.replies_remaining} more {comment.replies_remaining === 1 ? "reply" : "replies"}
+                </Text>
+            )}
         </Box>
     );
 };
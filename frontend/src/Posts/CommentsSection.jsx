@@ -29,6 +29,9 @@ const CommentsSection = ({ postId, onCommentsChange  }) => {
     const [alertConfirm, setAlertConfirm] = useState(false);
     const { showAlert } = useContext(AlertContext);
     const [user, setUser] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [remaining, setRemaining] = useState(0);
+    const [loadingMore, setLoadingMore] = useState(false);
     const { colorMode } = useColorMode();
 
     useEffect(() => {
@@ -46,7 +49,14 @@ const CommentsSection = ({ postId, onCommentsChange  }) => {
             try {
                 const response = await axios.get(`http://localhost:8000/api/posts/${postId}/comments`);
                 console.log("API Response:", response.data);
-                setComments(response.data.comments || []);
+                const fetched = response.data.comments || [];
+                setComments(fetched);
+                setNextCursor(response.data.next_cursor);
+                setRemaining(response.data.remaining || 0);
+                // The post itself no longer carries its comments
+                if (onCommentsChange) {
+                    onCommentsChange(fetched, response.data.remaining || 0);
+                }
             } catch (error) {
                 setMessage("Failed to load comments.");
                 setIsError(true);
@@ -74,6 +84,70 @@ const CommentsSection = ({ postId, onCommentsChange  }) => {
         }, []);
       };
 
+    // Comments added here since the page was loaded can come back in later pages
+    const withoutLoaded = (loaded, page) => {
+        const ids = new Set(loaded.map((comment) => comment.id));
+        return page.filter((comment) => !ids.has(comment.id));
+    };
+
+    function appendReplies(comments, parentId, page) {
+        return comments.map((comment) => {
+            if (comment.id === parentId) {
+                return {
+                    ...comment,
+                    replies: [...comment.replies, ...withoutLoaded(comment.replies, page.comments)],
+                    replies_cursor: page.next_cursor,
+                    replies_remaining: page.remaining,
+                };
+            }
+            return { ...comment, replies: appendReplies(comment.replies, parentId, page) };
+        });
+    }
+
+    const fetchPage = async (cursor) => {
+        const response = await axios.get(`http://localhost:8000/api/posts/${postId}/comments`, {
+            params: { cursor },
+        });
+        return response.data;
+    };
+
+    const loadMoreComments = async () => {
+        setLoadingMore(true);
+        try {
+            const page = await fetchPage(nextCursor);
+            setComments((prevComments) => {
+                const updatedComments = [...prevComments, ...withoutLoaded(prevComments, page.comments)];
+                if (onCommentsChange) {
+                    onCommentsChange(updatedComments, page.remaining);
+                }
+                return updatedComments;
+            });
+            setNextCursor(page.next_cursor);
+            setRemaining(page.remaining);
+        } catch (error) {
+            setMessage("Failed to load comments.");
+            setIsError(true);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
+    const loadMoreReplies = async (commentId, cursor) => {
+        try {
+            const page = await fetchPage(cursor);
+            setComments((prevComments) => {
+                const updatedComments = appendReplies(prevComments, commentId, page);
+                if (onCommentsChange) {
+                    onCommentsChange(updatedComments);
+                }
+                return updatedComments;
+            });
+        } catch (error) {
+            setMessage("Failed to load replies.");
+            setIsError(true);
+        }
+    };
+
     function addReplyToNestedComments(comments, parentId, newReply) {
         return comments.map((comment) => {
             // If this is the parent comment, append the new reply
@@ -284,10 +358,25 @@ const handleComment = async (parentId = null, replyText = null) => {
                             handleLike={handleLike}
                             handleUnlike={handleUnlike}
                             handleDelete={handleDelete} // ✅ Pass the delete function here
+                            handleLoadReplies={loadMoreReplies}
                             depth={0}
                             colorMode={colorMode}
                         />
                     ))}
+                    {nextCursor && (
+                        <Button
+                            size="sm"
+                            onClick={loadMoreComments}
+                            isLoading={loadingMore}
+                            bg={colorMode === 'light' ? 'white' : 'gray.600'}
+                            color={colorMode === 'light' ? 'gray.800' : 'gray.100'}
+                            _hover={{
+                                bg: colorMode === 'light' ? 'gray.100' : 'gray.500'
+                            }}
+                        >
+                            Load more comments ({remaining})
+                        </Button>
+                    )}
                 </VStack>
             )}
 
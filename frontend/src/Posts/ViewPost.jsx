@@ -139,7 +139,7 @@ const ViewPost = () => {
 
   const countTotalComments = (comments) => {
     return comments.reduce((total, comment) => {
-      return total + 1 + countTotalComments(comment.replies || []);
+      return total + 1 + (comment.replies_remaining || 0) + countTotalComments(comment.replies || []);
     }, 0);
   };
 
@@ -307,7 +307,7 @@ const ViewPost = () => {
             bg: colorMode === 'light' ? 'gray.100' : 'gray.500',
           }}
         >
-          {countTotalComments(post.comments)} Comments
+          {countTotalComments(post.comments) + (post.comments_remaining || 0)} Comments
         </Button>
         <Button
           leftIcon={<FaEye />}
@@ -335,9 +335,14 @@ const ViewPost = () => {
       {/* Comments Section */}
       <CommentsSection
         postId={id}
-        onCommentsChange={(updatedComments) => {
+        onCommentsChange={(updatedComments, remaining) => {
           // Update the post's comments with the new value
-          setPost((prevPost) => ({ ...prevPost, comments: updatedComments }));
+          setPost((prevPost) => ({
+            ...prevPost,
+            comments: updatedComments,
+            // Top-level comments not loaded yet
+            comments_remaining: remaining ?? prevPost?.comments_remaining,
+          }));
         }}
       />
     </Box>
@@ -39,17 +39,19 @@ const AdminFlaggedPage = () => {
 
     const fetchData = async () => {
       try {
+        // The newest 100 reports of each kind; each list is a page of the moderation queue
+        const params = { params: { limit: 100 } };
         const [posts, comments, courseReviews, profReviews] = await Promise.all([
-          axios.get("http://localhost:8000/api/admin/flagged/posts"),
-          axios.get("http://localhost:8000/api/admin/flagged/comments"),
-          axios.get("http://localhost:8000/api/admin/flagged/course-reviews"),
-          axios.get("http://localhost:8000/api/admin/flagged/professor-reviews"),
+          axios.get("http://localhost:8000/api/admin/flagged/posts", params),
+          axios.get("http://localhost:8000/api/admin/flagged/comments", params),
+          axios.get("http://localhost:8000/api/admin/flagged/course-reviews", params),
+          axios.get("http://localhost:8000/api/admin/flagged/professor-reviews", params),
         ]);
 
-        setFlaggedPosts(posts.data);
-        setFlaggedComments(comments.data);
-        setFlaggedCourseReviews(courseReviews.data);
-        setFlaggedProfessorReviews(profReviews.data);
+        setFlaggedPosts(posts.data.items);
+        setFlaggedComments(comments.data.items);
+        setFlaggedCourseReviews(courseReviews.data.items);
+        setFlaggedProfessorReviews(profReviews.data.items);
       } catch (err) {
         console.error("Failed to fetch flagged content:", err);
       }
@@ -17,18 +17,13 @@ const RightSidebar = () => {
     useEffect(() => {
         const fetchPosts = async () => {
             try {
-                const response = await fetch('http://localhost:8000/api/posts');
+                // Ranked by the server on likes, comments and views, decayed by age
+                const response = await fetch('http://localhost:8000/api/posts?sort=hot&limit=12');
                 if (!response.ok) {
                     throw new Error('Failed to fetch posts');
                 }
                 const data = await response.json();
-                
-                // Sort posts by number of likes (descending)
-                const sortedPosts = data.sort((a, b) => 
-                    (b.likes?.length || 0) - (a.likes?.length || 0)
-                ).slice(0, 12); // Get top 12 posts
-                
-                setPosts(sortedPosts);
+                setPosts(data.posts);
                 setLoading(false);
             } catch (error) {
                 console.error('Error fetching posts:', error);
@@ -111,14 +106,14 @@ const RightSidebar = () => {
                                         fontSize="xs" 
                                         noOfLines={2}
                                     >
-                                        {post.content.length > 100 ? `${post.content.slice(0, 100)}...` : post.content}
+                                        {post.excerpt.length > 100 ? `${post.excerpt.slice(0, 100)}...` : post.excerpt}
                                     </Text>
                                     <Text 
                                         color={colorMode === 'light' ? 'gray.500' : 'gray.500'} 
                                         fontSize="xs" 
                                         mt={1}
                                     >
-                                        {post.likes?.length || 0} likes · {post.comments?.length || 0} comments
+                                        {post.like_count || 0} likes · {post.comment_count || 0} comments
                                     </Text>
                                 </Box>
                             </Flex>
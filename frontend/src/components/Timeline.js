@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { Box, Text, Flex, HStack, Icon, IconButton, Spacer } from '@chakra-ui/react';
+import { Box, Text, Flex, HStack, Icon, IconButton, Spacer, Button } from '@chakra-ui/react';
 import { Link, useNavigate } from 'react-router-dom';
 import { FaHeart, FaRegHeart, FaComment, FaEye, FaShareAlt } from 'react-icons/fa';
 import axios from 'axios';
@@ -11,6 +11,9 @@ import { useColorMode } from '../theme/ColorModeContext';
 
 const Timeline = () => {
   const [posts, setPosts] = useState([]);
+  const [likedPosts, setLikedPosts] = useState(new Set());
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [user, setUser] = useState(null);
   const navigate = useNavigate();
 
@@ -25,35 +28,51 @@ const Timeline = () => {
     fetchUser();
   }, []);
 
-  useEffect(() => {
-    async function fetchPosts() {
-      try {
-        const response = await fetch('http://localhost:8000/api/posts'); // Adjust URL as needed
-        if (!response.ok) {
-          showAlert("error", "surface", "Error", "Failed to fetch posts");
-          throw new Error('Failed to fetch posts');
-        }
-        const data = await response.json();
-        // Sort posts from most recent to least recent
-        const sortedPosts = data.sort(
-            (a, b) => new Date(b.created_at) - new Date(a.created_at)
-        );
-        
-        // Ensure all posts have a views field
-        const postsWithViews = sortedPosts.map(post => ({
-          ...post,
-          views: post.views || 0
-        }));
-        
-        setPosts(postsWithViews);
-      } catch (error) {
-        showAlert("error", "surface", "Error", "Failed to fetch posts");
-        console.error('Error fetching posts:', error);
+  // The feed comes a page at a time, newest first
+  async function fetchPosts(cursor = null) {
+    try {
+      const url = cursor
+        ? `http://localhost:8000/api/posts?cursor=${encodeURIComponent(cursor)}`
+        : 'http://localhost:8000/api/posts';
+      const response = await fetch(url);
+      if (!response.ok) {
+        throw new Error('Failed to fetch posts');
       }
+      const data = await response.json();
+      setPosts(prevPosts => cursor ? [...prevPosts, ...data.posts] : data.posts);
+      setNextCursor(data.next_cursor);
+      fetchLiked(data.posts);
+    } catch (error) {
+      showAlert("error", "surface", "Error", "Failed to fetch posts");
+      console.error('Error fetching posts:', error);
+    }
+  }
+
+  // The feed is the same for everyone, so which posts the user liked is asked separately
+  async function fetchLiked(pagePosts) {
+    if (pagePosts.length === 0) return;
+    try {
+      const ids = pagePosts.map(p => p._id).join(',');
+      const response = await axios.get(
+        `http://localhost:8000/api/posts/liked?ids=${ids}`,
+        { withCredentials: true }
+      );
+      setLikedPosts(prevLiked => new Set([...prevLiked, ...response.data.liked]));
+    } catch (error) {
+      console.error('Error fetching liked posts:', error);
     }
+  }
+
+  useEffect(() => {
     fetchPosts();
   }, []);
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    await fetchPosts(nextCursor);
+    setLoadingMore(false);
+  };
+
   // Format date according to requirements
   const formatDate = (dateString) => {
     // Parse UTC date from backend and force UTC interpretation
@@ -116,12 +135,6 @@ const Timeline = () => {
     });
   };
   
-  const countTotalComments = (comments) => {
-    return comments.reduce((total, comment) => {
-      return total + 1 + countTotalComments(comment.replies || []);
-    }, 0);
-  };
-
   const handleLike = async (e, postId) => {
     e.preventDefault(); // Prevent navigation to post
     e.stopPropagation(); // Stop event propagation
@@ -132,8 +145,7 @@ const Timeline = () => {
     }
 
     try {
-        const post = posts.find(p => p._id === postId);
-        const hasLiked = post.likes.includes(user.id);
+        const hasLiked = likedPosts.has(postId);
 
         if (hasLiked) {
             // Unlike
@@ -146,11 +158,16 @@ const Timeline = () => {
                 if (p._id === postId) {
                     return {
                         ...p,
-                        likes: p.likes.filter(id => id !== user.id)
+                        like_count: p.like_count - 1
                     };
                 }
                 return p;
             }));
+            setLikedPosts(prevLiked => {
+                const updated = new Set(prevLiked);
+                updated.delete(postId);
+                return updated;
+            });
         } else {
             // Like
             await axios.post(
@@ -162,11 +179,12 @@ const Timeline = () => {
                 if (p._id === postId) {
                     return {
                         ...p,
-                        likes: [...p.likes, user.id]
+                        like_count: p.like_count + 1
                     };
                 }
                 return p;
             }));
+            setLikedPosts(prevLiked => new Set([...prevLiked, postId]));
         }
     } catch (error) {
         console.error("Error updating like:", error);
@@ -236,7 +254,7 @@ const Timeline = () => {
                 flex="1"
                 color={colorMode === 'light' ? 'gray.700' : 'gray.300'}
               >
-                {post.content.length > 400 ? post.content.slice(0, 450) + '...' : post.content}
+                {post.truncated ? post.excerpt + '...' : post.excerpt}
               </Text>
               
               {/* Post actions bar - fixed to bottom with no border */}
@@ -247,13 +265,13 @@ const Timeline = () => {
                 {/* Like button */}
                 <Flex alignItems="center" onClick={(e) => handleLike(e, post._id)}>
                   <Icon 
-                    as={user && post.likes.includes(user.id) ? FaHeart : FaRegHeart} 
-                    color={user && post.likes.includes(user.id) ? "red.500" : colorMode === 'light' ? "gray.500" : "white"} 
+                    as={user && likedPosts.has(post._id) ? FaHeart : FaRegHeart} 
+                    color={user && likedPosts.has(post._id) ? "red.500" : colorMode === 'light' ? "gray.500" : "white"} 
                     cursor="pointer" 
                     mr={1}
                   />
-                  {post.likes.length > 0 && (
-                    <Text fontSize="sm" color={colorMode === 'light' ? "gray.600" : "white"}>{post.likes.length}</Text>
+                  {post.like_count > 0 && (
+                    <Text fontSize="sm" color={colorMode === 'light' ? "gray.600" : "white"}>{post.like_count}</Text>
                   )}
                 </Flex>
                 
@@ -261,7 +279,7 @@ const Timeline = () => {
                 <Flex alignItems="center" ml={4}>
                   <Icon as={FaComment} color={colorMode === 'light' ? "gray.500" : "white"} mr={1} />
                   <Text fontSize="sm" color={colorMode === 'light' ? "gray.600" : "white"}>
-                    {countTotalComments(post.comments)}
+                    {post.comment_count}
                   </Text>
                 </Flex>
                 
@@ -281,6 +299,13 @@ const Timeline = () => {
               </Flex>
             </Box>
         ))}
+        {nextCursor && (
+          <Flex justifyContent="center" mt={4}>
+            <Button onClick={loadMore} isLoading={loadingMore} variant="ghost">
+              Load more
+            </Button>
+          </Flex>
+        )}
       </Box>
   );
 };
@@ -28,6 +28,8 @@ function UserProfile() {
     bio: '',
     posts: []
   });
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [message, setMessage] = useState('');
 
   useEffect(() => {
@@ -47,6 +49,7 @@ function UserProfile() {
           bio: response.data.bio || '',
           posts: response.data.posts || []
         });
+        setNextCursor(response.data.next_cursor);
       } catch (error) {
         console.error('Error fetching profile:', error);
         setMessage('Error loading profile');
@@ -57,6 +60,22 @@ function UserProfile() {
     fetchProfile();
   }, [username]);
 
+  // Profile posts come a page at a time, newest first
+  const loadMorePosts = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`http://localhost:8000/api/profile/${username}`, {
+        params: { cursor: nextCursor }
+      });
+      setProfile(prev => ({ ...prev, posts: [...prev.posts, ...(response.data.posts || [])] }));
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more posts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const isOwnProfile = currentUser?.username === username;
   const isAdmin = currentUser?.is_admin === true;
 
@@ -453,10 +472,10 @@ function UserProfile() {
                       {post.title}
                     </Text>
                     <Text color={colorMode === 'light' ? 'gray.600' : 'gray.300'} fontSize="xs" noOfLines={2}>
-                      {post.content}
+                      {post.truncated ? post.excerpt + '...' : post.excerpt}
                     </Text>
                     <Text color={colorMode === 'light' ? 'gray.500' : 'gray.400'} fontSize="xs" mt={1}>
-                      {post.likes?.length || 0} likes · {post.comments?.length || 0} comments
+                      {post.like_count || 0} likes · {post.comment_count || 0} comments
                     </Text>
                   </Box>
                 </Flex>
@@ -466,6 +485,11 @@ function UserProfile() {
                   No posts yet
                 </Text>
               )}
+              {nextCursor && (
+                <Button onClick={loadMorePosts} isLoading={loadingMore} variant="ghost" size="sm">
+                  Load more
+                </Button>
+              )}
             </VStack>
           </Box>
         </Box>
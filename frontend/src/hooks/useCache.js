@@ -82,4 +82,30 @@ const useCache = (cacheKey) => {
   return { data, loading, error, fetchCache, updateCache, invalidateCache };
 };
 
+// Batch versions: one request (and one Redis round trip) for many keys
+const postCache = async (path, body) => {
+  const response = await fetch(`${API_BASE_URL}/${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  return response.json();
+};
+
+// Resolves to { key: value or null }
+export const fetchCacheMany = async (keys) => {
+  const result = await postCache('mget', { keys });
+  return result.data || {};
+};
+
+export const updateCacheMany = async (values, expiration = 3600) => {
+  const result = await postCache('mset', { values, expiration });
+  return result.success;
+};
+
+export const invalidateCacheMany = async (keys) => {
+  const result = await postCache('invalidate-many', { keys });
+  return result.success;
+};
+
 export default useCache;
\ No newline at end of file